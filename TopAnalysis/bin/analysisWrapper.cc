@@ -1,4 +1,5 @@
 #include <iostream>
+#include <vector>
 
 #include "TopLJets2015/TopAnalysis/interface/CommonTools.h"
 #include "TopLJets2015/TopAnalysis/interface/ExclusiveZX.h"
@@ -8,6 +9,9 @@
 
 #include "TH1F.h"
 #include "TFile.h"
+#include "TSystem.h"
+#include "TObjArray.h"
+#include "TObjString.h"
 
 using namespace std;
 
@@ -16,12 +20,13 @@ void printHelp()
 {
   cout << "analysisWrapper options are:" << endl
        << "\t --in - input file" << endl
-       << "\t --out - output file" << endl
+       << "\t --out - output file (comma-separated list, one per variation, if several variations are given)" << endl
        << "\t --channel - channel to analyze" << endl
        << "\t --charge  - charge selection to apply" << endl
        << "\t --flag    - job flag to apply" << endl
        << "\t --runSysts - activate running systematics" << endl
-       << "\t --systVar  - specify single systematic variation" << endl
+       << "\t --systVar  - specify single systematic variation or a comma-separated list" << endl
+       << "\t              (a list is processed in one pass)" << endl
        << "\t --era      - era directory to use for corrections, uncertainties" << endl
        << "\t --normTag  - normalization tag" << endl
        << "\t --method   - method to run" << endl
@@ -96,6 +101,22 @@ int main(int argc, char* argv[])
       return -1;
     }
 
+  //a list of variations is processed in one pass, the analysis runs on the first output
+  std::vector<TString> systVarList,outList;
+  TObjArray *tkns=TString(systVar).Tokenize(",");
+  for(int i=0; i<tkns->GetEntriesFast(); i++) systVarList.push_back( ((TObjString *)tkns->At(i))->GetString() );
+  delete tkns;
+  tkns=out.Tokenize(",");
+  for(int i=0; i<tkns->GetEntriesFast(); i++) outList.push_back( ((TObjString *)tkns->At(i))->GetString() );
+  delete tkns;
+  if(outList.size()>1 && outList.size()!=systVarList.size())
+    {
+      cout << "Check the number of outputs (" << outList.size() << ") and variations (" << systVarList.size() << ")" << endl;
+      printHelp();
+      return -1;
+    }
+  out=outList[0];
+
   //check method to run
   if(method=="ExclusiveZX::RunExclusiveZX") {
     RunExclusiveZX(in,out,channel,charge,normH,puH,era,debug);
@@ -119,6 +140,15 @@ int main(int argc, char* argv[])
     printHelp();
     return -1;
   }
+
+  //the methods do not depend on the variation: the remaining outputs are copies of the first one
+  for(size_t i=1; i<outList.size(); i++) {
+    if(debug) cout << "Storing " << systVarList[i] << " variation in " << outList[i] << endl;
+    if(gSystem->CopyFile(out,outList[i],kTRUE)!=0) {
+      cout << "Failed to copy " << out << " to " << outList[i] << endl;
+      return -1;
+    }
+  }
   
   //all done
   return 0;
@@ -1,4 +1,5 @@
 import ROOT
+import numpy as np
 
 class HistoTool:
 
@@ -18,6 +19,16 @@ class HistoTool:
         """ returns an histogram """
 
         return self.histos[k][cat] if k in self.histos and cat in self.histos[k] else None
+
+    def getForCategory(self,key,cat):
+
+        """returns the histogram for a given category, starting a new one if not yet available"""
+
+        if not cat in self.histos[key]:
+            self.histos[key][cat]=self.histos[key]['inc'].Clone('%s_%s'%(key,cat))
+            self.histos[key][cat].SetDirectory(0)
+            self.histos[key][cat].Reset('ICE')
+        return self.histos[key][cat]
         
     def fill(self,val,key,cats,pfix=None):
 
@@ -26,11 +37,19 @@ class HistoTool:
         if not key in self.histos: return
         for cat in cats:
             if pfix: cat=cat+pfix
-            if not cat in self.histos[key]:
-                self.histos[key][cat]=self.histos[key]['inc'].Clone('%s_%s'%(key,cat))
-                self.histos[key][cat].SetDirectory(0)
-                self.histos[key][cat].Reset('ICE')
-            self.histos[key][cat].Fill(*val)
+            self.getForCategory(key,cat).Fill(*val)
+
+    def fillN(self,vals,wgts,key,cats,pfix=None):
+
+        """same as fill for 1D histograms but using arrays of values and weights (filled in the order given)"""
+
+        if not key in self.histos: return
+        if len(vals)==0: return
+        vals=np.ascontiguousarray(vals,dtype=np.float64)
+        wgts=np.ascontiguousarray(wgts,dtype=np.float64)
+        for cat in cats:
+            if pfix: cat=cat+pfix
+            self.getForCategory(key,cat).FillN(len(vals),vals,wgts)
             
 
     def writeToFile(self,fOut):
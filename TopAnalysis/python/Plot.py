@@ -1,5 +1,6 @@
 import ROOT
 import math
+import numpy as np
 import os,sys
 from collections import OrderedDict
 
@@ -41,6 +42,36 @@ def divideByBinWidth(h):
         h.SetBinError(xbin,unc/wid)
 
 
+def getBinContentsArray(h):
+    """ bin contents (with under/overflow) as an array, read directly from the histogram buffer when possible"""
+    n=h.GetNbinsX()+2
+    for base,dtype in [('TArrayD',np.float64),('TArrayF',np.float32)]:
+        try:
+            if not h.InheritsFrom(base) : continue
+            return np.ndarray((n,),dtype=dtype,buffer=h.GetArray()).astype(np.float64)
+        except Exception:
+            break
+    return np.array([h.GetBinContent(xbin) for xbin in xrange(0,n)],dtype=np.float64)
+
+def getBinErrorsArray(h):
+    """ bin errors (with under/overflow) as an array"""
+    n=h.GetNbinsX()+2
+    try:
+        sumw2=h.GetSumw2()
+        if sumw2.GetSize()==n:
+            return np.sqrt(np.ndarray((n,),dtype=np.float64,buffer=sumw2.GetArray()))
+    except Exception:
+        pass
+    return np.array([h.GetBinError(xbin) for xbin in xrange(0,n)],dtype=np.float64)
+
+def getSystEnvelope(nominal,variations):
+    """ sums in quadrature the positive and negative differences of the variations (rows) with respect to nominal"""
+    if len(variations)==0:
+        return np.zeros_like(nominal),np.zeros_like(nominal)
+    diff=np.asarray(variations)-nominal
+    up=np.sqrt(np.sum(np.where(diff>0,diff,0.)**2,axis=0))
+    down=np.sqrt(np.sum(np.where(diff>0,0.,diff)**2,axis=0))
+    return up,down
 
 """
 A wrapper to store data and MC histograms for comparison
@@ -182,6 +213,11 @@ class Plot(object):
 
     def appendTo(self,outUrl):
         outF = ROOT.TFile.Open(outUrl,'UPDATE')
+        self.writeTo(outF)
+        outF.Close()
+
+    def writeTo(self,outF):
+        """writes the histograms in a directory named as the plot in a file which is already open"""
         if not outF.cd(self.name):
             outDir = outF.mkdir(self.name)
             outDir.cd()
@@ -195,7 +231,6 @@ class Plot(object):
             self.dataH.Write(self.dataH.GetName(), ROOT.TObject.kOverwrite)
         if self.data :
             self.data.Write(self.data.GetName(), ROOT.TObject.kOverwrite)
-        outF.Close()
 
     def reset(self):
         for o in self._garbageList:
@@ -322,49 +357,40 @@ class Plot(object):
         #systematics
         if (totalMC and nominalDistForSysts and len(self.mcsyst)>0):
             # complete
-            systUp=[0.]
-            systDown=[0.]
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                systUp.append(0.)
-                systDown.append(0.)
-                for hname in self.mcsyst:
-                    diff = self.mcsyst[hname].GetBinContent(xbin) - nominalDistForSysts.GetBinContent(xbin)
-                    if (diff > 0):
-                        systUp[xbin] = math.sqrt(systUp[xbin]**2 + diff**2)
-                    else:
-                        systDown[xbin] = math.sqrt(systDown[xbin]**2 + diff**2)
+            nbins=nominalDistForSysts.GetNbinsX()
+            nominalVals=getBinContentsArray(nominalDistForSysts)
+            systVals=np.array([getBinContentsArray(self.mcsyst[hname]) for hname in self.mcsyst])
+            systUp,systDown=getSystEnvelope(nominalVals,systVals)
+            totalMCVals=getBinContentsArray(totalMC)
+            totalMCErrs=getBinErrorsArray(totalMC)
             totalMCUnc = totalMC.Clone('totalmcunc')
             self._garbageList.append(totalMCUnc)
             totalMCUnc.SetDirectory(0)
             totalMCUnc.SetFillColor(1) #ROOT.TColor.GetColor('#99d8c9'))
             ROOT.gStyle.SetHatchesLineWidth(1)
             totalMCUnc.SetFillStyle(3344) #3254)
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                totalMCUnc.SetBinContent(xbin, totalMCUnc.GetBinContent(xbin) + (systUp[xbin]-systDown[xbin])/2.)
-                totalMCUnc.SetBinError(xbin, math.sqrt(totalMCUnc.GetBinError(xbin)**2 + ((systUp[xbin]+systDown[xbin])/2.)**2))
+            uncVals=totalMCVals+(systUp-systDown)/2.
+            uncErrs=np.sqrt(totalMCErrs**2+((systUp+systDown)/2.)**2)
+            for xbin in xrange(1,nbins+1):
+                totalMCUnc.SetBinContent(xbin, uncVals[xbin])
+                totalMCUnc.SetBinError(xbin, uncErrs[xbin])
             # shape
             nominalIntegral = nominalDistForSysts.Integral()
-            for hname,h in self.mcsyst.iteritems():
-                if (h.Integral()>0.): h.Scale(nominalIntegral/h.Integral())
-            systUpShape=[0.]
-            systDownShape=[0.]
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                systUpShape.append(0.)
-                systDownShape.append(0.)
-                for hname in self.mcsyst:
-                    diff = self.mcsyst[hname].GetBinContent(xbin) - nominalDistForSysts.GetBinContent(xbin)
-                    if (diff > 0):
-                        systUpShape[xbin] = math.sqrt(systUpShape[xbin]**2 + diff**2)
-                    else:
-                        systDownShape[xbin] = math.sqrt(systDownShape[xbin]**2 + diff**2)
+            systIntegrals = systVals[:,1:nbins+1].sum(axis=1)
+            shapeSF = np.where(systIntegrals>0., nominalIntegral/np.where(systIntegrals>0.,systIntegrals,1.), 1.)
+            for ih,(hname,h) in enumerate(self.mcsyst.iteritems()):
+                if (systIntegrals[ih]>0.): h.Scale(shapeSF[ih])
+            systUpShape,systDownShape=getSystEnvelope(nominalVals,systVals*shapeSF[:,np.newaxis])
             totalMCUncShape = totalMC.Clone('totalmcuncshape')
             self._garbageList.append(totalMCUncShape)
             totalMCUncShape.SetDirectory(0)
             totalMCUncShape.SetFillColor(ROOT.TColor.GetColor('#d73027'))
             totalMCUncShape.SetFillStyle(3254)
-            for xbin in xrange(1,nominalDistForSysts.GetNbinsX()+1):
-                totalMCUncShape.SetBinContent(xbin, totalMCUncShape.GetBinContent(xbin) + (systUpShape[xbin]-systDownShape[xbin])/2.)
-                totalMCUncShape.SetBinError(xbin, math.sqrt(totalMCUncShape.GetBinError(xbin)**2 + ((systUpShape[xbin]+systDownShape[xbin])/2.)**2))
+            uncShapeVals=totalMCVals+(systUpShape-systDownShape)/2.
+            uncShapeErrs=np.sqrt(totalMCErrs**2+((systUpShape+systDownShape)/2.)**2)
+            for xbin in xrange(1,nbins+1):
+                totalMCUncShape.SetBinContent(xbin, uncShapeVals[xbin])
+                totalMCUncShape.SetBinError(xbin, uncShapeErrs[xbin])
             self.totalMCUnc = totalMCUnc
 
         #test for null plots
@@ -585,19 +611,23 @@ class Plot(object):
 
                 totalMCnoUnc=totalMC.Clone('totalMCnounc')
                 self._garbageList.append(totalMCnoUnc)
+                vals=getBinContentsArray(totalMC)
+                hasVal=(vals!=0)
+                safeVals=np.where(hasVal,vals,1.)
+                if (len(self.mcsyst)>0):
+                    totalUnc=np.sqrt((getBinErrorsArray(totalMCUnc)/safeVals)**2+self.mcUnc**2)
+                    totalUncShape=np.sqrt((getBinErrorsArray(totalMCUncShape)/safeVals)**2+self.mcUnc**2)
+                    shapeRatio=getBinContentsArray(totalMCUncShape)/safeVals
+                else:
+                    totalUnc=np.sqrt((getBinErrorsArray(totalMC)/safeVals)**2+self.mcUnc**2)
                 for xbin in xrange(1,totalMC.GetNbinsX()+1):
                     ratioframe.SetBinContent(xbin,1)
-                    val=totalMC.GetBinContent(xbin)
                     totalMCnoUnc.SetBinError(xbin,0.)
-                    if val==0 : continue
+                    if not hasVal[xbin] : continue
                     if (len(self.mcsyst)>0):
-                        totalUnc=ROOT.TMath.Sqrt((totalMCUnc.GetBinError(xbin)/val)**2+self.mcUnc**2)
-                        totalUncShape=ROOT.TMath.Sqrt((totalMCUncShape.GetBinError(xbin)/val)**2+self.mcUnc**2)
-                        ratioframeshape.SetBinContent(xbin,totalMCUncShape.GetBinContent(xbin)/val)
-                        ratioframeshape.SetBinError(xbin,totalUncShape)
-                    else: totalUnc=ROOT.TMath.Sqrt((totalMC.GetBinError(xbin)/val)**2+self.mcUnc**2)
-                    ratioframe.SetBinContent(xbin,totalMCnoUnc.GetBinContent(xbin)/val)
-                    ratioframe.SetBinError(xbin,totalUnc)
+                        ratioframeshape.SetBinContent(xbin,shapeRatio[xbin])
+                        ratioframeshape.SetBinError(xbin,totalUncShape[xbin])
+                    ratioframe.SetBinError(xbin,totalUnc[xbin])
                 ratioframe.Draw('e2')
 
                 if (len(self.mcsyst)>0): 
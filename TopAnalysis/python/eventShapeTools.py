@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import ROOT
+import numpy as np
 
 class EventShapeTool:
 
@@ -49,3 +50,45 @@ class EventShapeTool:
         self.aplanarity=1.5*lambdas[2]
         self.C=3.*(lambdas[0]*lambdas[1] + lambdas[0]*lambdas[2] + lambdas[1]*lambdas[2])
         self.D=27.*lambdas[0]*lambdas[1]*lambdas[2]
+
+
+def toPaddedArray(values,counts,fill=0.):
+    """converts a flat array with the values of all the events and the number of values per event to a padded (N,max) array and its mask"""
+    values,counts=np.asarray(values),np.asarray(counts,dtype=int)
+    nmax=counts.max() if len(counts)>0 else 0
+    mask=np.arange(nmax)[None,:]<counts[:,None]
+    padded=np.full((len(counts),nmax)+values.shape[1:],fill,dtype=values.dtype)
+    padded[mask]=values
+    return padded,mask
+
+
+def computeMomentumTensors(p3,mask=None,r=2):
+    """
+    momentum tensors for N events from an (N,M,3) array of particle momenta (padded, mask flags the real particles)
+    same definition as EventShapeTool.computeMomentumTensor, events with less than two particles have a null tensor
+    """
+    p3=np.asarray(p3,dtype=float)
+    if mask is None : mask=np.ones(p3.shape[:2],dtype=bool)
+    pR=np.where(mask,np.linalg.norm(p3,axis=2)**r,0.)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        pRminus2=np.where(mask,pR**(0.5*r-1),0.)
+    tensors=np.einsum('nm,nmi,nmj->nij',pRminus2,p3,p3)
+    norm=pR.sum(axis=1)
+    good=(mask.sum(axis=1)>=2) & (norm>0)
+    tensors[good]/=norm[good,None,None]
+    tensors[~good]=0.
+    return tensors
+
+
+def computeEventShapes(p3,mask=None,r=2):
+    """
+    sphericity, aplanarity, C and D for N events from an (N,M,3) array of particle momenta (see computeMomentumTensors)
+    events with a null momentum tensor get 0 for all the variables
+    """
+    tensors=computeMomentumTensors(p3,mask,r)
+    lambdas=np.linalg.eigvalsh(tensors)[:,::-1]
+    sphericity=1.5*(lambdas[:,1]+lambdas[:,2])
+    aplanarity=1.5*lambdas[:,2]
+    C=3.*(lambdas[:,0]*lambdas[:,1] + lambdas[:,0]*lambdas[:,2] + lambdas[:,1]*lambdas[:,2])
+    D=27.*lambdas[:,0]*lambdas[:,1]*lambdas[:,2]
+    return sphericity,aplanarity,C,D
@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import zlib
+import hashlib
+import sqlite3
+
+LEDGERSCHEMA='''CREATE TABLE IF NOT EXISTS tasks (
+                   output   TEXT PRIMARY KEY,
+                   input    TEXT,
+                   inputSize INTEGER,
+                   tag      TEXT,
+                   systVar  TEXT,
+                   config   TEXT,
+                   status   TEXT,
+                   exitCode INTEGER,
+                   runtime  REAL,
+                   nevents  INTEGER,
+                   checksum TEXT,
+                   size     INTEGER,
+                   mtime    REAL,
+                   updated  REAL)'''
+
+def getLocalPath(url):
+
+    """converts an eos url to the local (fuse mounted) path"""
+
+    if url.startswith('root://'):
+        url='/eos/cms/'+url.split('//')[-1].replace('eos/cms/','')
+    elif url.startswith('/store/'):
+        url='/eos/cms'+url
+    return url
+
+
+def getAdler32(url,blockSize=16*1024*1024):
+
+    """computes the adler32 checksum of a file (the same used by eos/xrootd)"""
+
+    checksum=1
+    with open(getLocalPath(url),'rb') as f:
+        while True:
+            block=f.read(blockSize)
+            if not block: break
+            checksum=zlib.adler32(block,checksum)
+    return '%08x'%(checksum & 0xffffffff)
+
+
+def getFileSize(url):
+
+    """size of a file in bytes (None if it can't be accessed)"""
+
+    try:
+        return os.path.getsize(getLocalPath(url))
+    except OSError:
+        return None
+
+
+def getVariationOutputs(outF,systVar):
+
+    """
+    output files of a task: if several variations (comma-separated) are processed in one pass
+    the output of each variation is named as for a single variation task, i.e. with a _<variation> suffix
+    placed before the chunk number if any (outF is used for nominal)
+    """
+
+    varList=systVar.split(',')
+    if len(varList)==1: return [outF]
+    outputs=[]
+    for var in varList:
+        if var=='nominal' or var in os.path.basename(outF):
+            outputs.append(outF)
+        elif re.search('_\d+\.root$',outF):
+            outputs.append(re.sub('(_\d+\.root)$',r'_%s\1'%var,outF))
+        else:
+            outputs.append(outF[:-5]+'_'+var+'.root')
+    return outputs
+
+
+def isValidROOTFile(url):
+
+    """checks that the file can be opened and was closed correctly (i.e. it's not truncated)"""
+
+    import ROOT
+    try:
+        fIn=ROOT.TFile.Open(url)
+        isValid = fIn and not fIn.IsZombie() and not fIn.TestBit(ROOT.TFile.kRecovered) and fIn.GetListOfKeys().GetSize()>0
+        if fIn: fIn.Close()
+    except:
+        isValid=False
+    return True if isValid else False
+
+
+def getEntries(url,tname='analysis/data'):
+
+    """number of entries in a tree (None if not available)"""
+
+    import ROOT
+    nentries=None
+    try:
+        fIn=ROOT.TFile.Open(url)
+        nentries=int(fIn.Get(tname).GetEntriesFast())
+        fIn.Close()
+    except:
+        pass
+    return nentries
+
+
+class JobLedger:
+
+    """
+    keeps track in a SQLite database of the tasks run by runLocalAnalysis
+    for each output file it stores the input, systematic variation, exit code, runtime, number of events
+    and the checksum, size and modification time of the output so that only failed or stale tasks are re-run
+    """
+
+    def __init__(self,url):
+        self.url=url
+        conn=self.connect()
+        conn.execute(LEDGERSCHEMA)
+        conn.commit()
+        conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.url,timeout=300)
+
+    @staticmethod
+    def getConfigHash(task):
+
+        """hash of the task configuration (all arguments but the output file)"""
+
+        return hashlib.md5(repr(tuple(task[0:2])+tuple(task[3:]))).hexdigest()
+
+    def getRecord(self,outF):
+        conn=self.connect()
+        conn.row_factory=sqlite3.Row
+        rec=conn.execute('SELECT * FROM tasks WHERE output=?',(outF,)).fetchone()
+        conn.close()
+        return rec
+
+    def update(self,outF,**kwargs):
+        kwargs['updated']=time.time()
+        conn=self.connect()
+        conn.execute('INSERT OR IGNORE INTO tasks (output) VALUES (?)',(outF,))
+        conn.execute('UPDATE tasks SET %s WHERE output=?'%','.join(['%s=?'%k for k in kwargs]),
+                     kwargs.values()+[outF])
+        conn.commit()
+        conn.close()
+
+    def markSubmitted(self,task,runtimeURL=None):
+
+        """
+        registers a task which is going to run
+        the runtime file and the outputs left by a previous run are removed so that they are not taken as the result of this one
+        """
+
+        method,inF,outF=task[0:3]
+        systVar,tag=task[7],task[9]
+        for url in [runtimeURL]+[getLocalPath(f) for f in getVariationOutputs(outF,systVar)]:
+            try:
+                if url and os.path.isfile(url): os.remove(url)
+            except OSError:
+                pass
+        self.update(outF,input=inF,inputSize=getFileSize(inF),tag=tag,systVar=systVar,config=self.getConfigHash(task),
+                    status='submitted',exitCode=None,runtime=None,nevents=None,checksum=None,size=None,mtime=None)
+
+    def markFinished(self,outF,exitCode,runtime=None,nevents=None):
+
+        """
+        records the result of a task, it is only considered done if all the outputs are valid files
+        (for tasks with several variations the checksum, size and time refer to the first output)
+        """
+
+        status,checksum,size,mtime='failed',None,None,None
+        rec=self.getRecord(outF)
+        outputs=[getLocalPath(f) for f in getVariationOutputs(outF,rec['systVar'] if rec and rec['systVar'] else 'nominal')]
+        localOutF=outputs[0]
+        if exitCode==0 and all([isValidROOTFile(f) for f in outputs]):
+            try:
+                checksum=getAdler32(localOutF)
+                size=os.path.getsize(localOutF)
+                mtime=os.path.getmtime(localOutF)
+                status='done'
+            except Exception:
+                pass
+        self.update(outF,status=status,exitCode=exitCode,runtime=runtime,nevents=nevents,checksum=checksum,size=size,mtime=mtime)
+        return status=='done'
+
+    def needsRun(self,task,runtimeURL=None):
+
+        """
+        checks if a task needs to be (re-)run: it is new, it has failed, the configuration changed or the output is missing or was modified
+        tasks submitted to the batch are only settled once the job has ended, i.e. the runtime file with the exit code
+        and the wall time was written (runtimeURL) or all the outputs are valid files, otherwise they are pending and are not re-run
+        """
+
+        outF=task[2]
+        rec=self.getRecord(outF)
+        if rec is None: return True
+        if rec['config']!=self.getConfigHash(task): return True
+        if rec['status']=='submitted':
+            exitCode,runtime=0,None
+            hasEnded=False
+            try:
+                with open(runtimeURL,'r') as f:
+                    hasEnded=True
+                    exitCode,runtime=f.read().split()[0:2]
+                    exitCode,runtime=int(exitCode),float(runtime)
+            except (TypeError,IOError,ValueError):
+                pass
+            if not hasEnded:
+                outputs=[getLocalPath(f) for f in getVariationOutputs(outF,task[7])]
+                hasEnded=all([os.path.isfile(f) and isValidROOTFile(f) for f in outputs])
+            if not hasEnded: return False
+            return not self.markFinished(outF,exitCode,runtime)
+        if rec['status']!='done': return True
+        try:
+            outputs=[getLocalPath(f) for f in getVariationOutputs(outF,task[7])]
+            if os.path.getsize(outputs[0])!=rec['size'] or os.path.getmtime(outputs[0])!=rec['mtime']:
+                return True
+            if not all([os.path.isfile(f) for f in outputs[1:]]):
+                return True
+        except OSError:
+            return True
+        return False
+
+    def getSecondsPerMB(self):
+
+        """average processing time per MB of input for each tag (None is the average over all tags)"""
+
+        conn=self.connect()
+        rows=conn.execute('''SELECT tag, SUM(runtime), SUM(inputSize) FROM tasks
+                             WHERE status='done' AND runtime>0 AND inputSize>0 GROUP BY tag''').fetchall()
+        conn.close()
+        secPerMB=dict( (tag,runtime/(inputSize/1024.**2)) for tag,runtime,inputSize in rows )
+        if len(rows)>0:
+            secPerMB[None]=sum([r[1] for r in rows])/(sum([r[2] for r in rows])/1024.**2)
+        return secPerMB
+
+    def summary(self):
+
+        """prints the number of tasks per status and the throughput for each sample"""
+
+        conn=self.connect()
+        rows=conn.execute('''SELECT tag, SUM(status='done'), SUM(status='failed'), SUM(status='submitted'), SUM(nevents), SUM(runtime)
+                             FROM tasks GROUP BY tag ORDER BY tag''').fetchall()
+        conn.close()
+        print '%40s %8s %8s %8s %12s %10s'%('tag','done','failed','pending','events','events/s')
+        for tag,ndone,nfailed,npending,nevents,runtime in rows:
+            throughput='%10.1f'%(float(nevents)/runtime) if nevents and runtime else '%10s'%'-'
+            print '%40s %8d %8d %8d %12d %s'%(tag,ndone,nfailed,npending,nevents if nevents else 0,throughput)
@@ -0,0 +1,200 @@
+import os
+import time
+import json
+import subprocess
+from multiprocessing import Pool
+
+def isint(string):
+    try:
+        int(string)
+        return True
+    except ValueError:
+        return False
+
+
+def isGoodChunk(url):
+
+    """checks that a chunk can be opened and was closed correctly"""
+
+    import ROOT
+    goodFile=False
+    try:
+        fIn=ROOT.TFile.Open(url)
+        if fIn and not fIn.IsZombie() and not fIn.TestBit(ROOT.TFile.kRecovered):
+            goodFile=True
+        if fIn: fIn.Close()
+    except:
+        pass
+    return goodFile
+
+
+def validateChunks(fileList,njobs=8):
+
+    """validates a list of chunks in parallel, returns a dict with the status of each file"""
+
+    if njobs<2 or len(fileList)<2:
+        return dict( (f,isGoodChunk(f)) for f in fileList )
+    pool=Pool(min(njobs,len(fileList)))
+    status=pool.map(isGoodChunk,fileList,chunksize=max(1,len(fileList)/(4*njobs)))
+    pool.close()
+    pool.join()
+    return dict(zip(fileList,status))
+
+
+def getChunkGroups(dirname,njobs=8):
+
+    """
+    groups the chunks of a directory by basename (<basename>_<number>.root)
+    returns the groups, the files which are not chunks and the files which failed the validation
+    """
+
+    fileList=sorted([os.path.join(dirname,item) for item in os.listdir(dirname) if os.path.splitext(item)[1]=='.root'])
+    status=validateChunks(fileList,njobs)
+
+    groups,singles,badFiles={},[],[]
+    for f in fileList:
+        filename=os.path.splitext(os.path.basename(f))[0]
+        if not status[f]:
+            badFiles.append(f)
+            continue
+        try:
+            basename, number = filename.rsplit('_',1)
+        except ValueError:
+            basename, number = filename, None
+        if number is None or (number!='missing' and not isint(number)):
+            singles.append(f)
+            continue
+        groups.setdefault(basename,[]).append(f)
+    return groups,singles,badFiles
+
+
+def isUpToDate(target,inputs):
+
+    """a merged file is up to date if it is newer than all its inputs"""
+
+    try:
+        return os.path.getmtime(target)>=max([os.path.getmtime(f) for f in inputs])
+    except OSError:
+        return False
+
+
+def getFileStamp(url):
+    return [os.path.getsize(url),os.path.getmtime(url)]
+
+
+def getManifestURL(target):
+    return os.path.join(os.path.dirname(target),'.%s.manifest.json'%os.path.splitext(os.path.basename(target))[0])
+
+
+def writeManifest(target,inputs):
+
+    """records the chunks (with sizes and modification times) which were merged in a file"""
+
+    manifest={'target':getFileStamp(target),
+              'chunks':dict( (f,getFileStamp(f)) for f in inputs )}
+    with open(getManifestURL(target),'w') as f:
+        json.dump(manifest,f,indent=0)
+
+
+def getNewChunks(target,inputs):
+
+    """
+    compares the chunks with the ones recorded when the file was merged
+    returns the list of chunks to append or None if the file has to be fully re-merged
+    (no record, the merged file was modified or a chunk was removed or replaced)
+    """
+
+    try:
+        with open(getManifestURL(target),'r') as f:
+            manifest=json.load(f)
+        if getFileStamp(target)!=manifest['target']: return None
+    except (IOError,OSError,ValueError,KeyError):
+        return None
+
+    for f,stamp in manifest['chunks'].items():
+        if not f in inputs: return None
+        if getFileStamp(f)!=stamp: return None
+    return [f for f in inputs if not f in manifest['chunks']]
+
+
+def runMerge(args):
+
+    """merges (or appends if requested) a list of files with hadd, returns the merge report"""
+
+    target,inputs,noTrees,haddJobs,allInputs=args
+    cmd=['hadd','-a'] if allInputs!=inputs else ['hadd','-f']
+    if noTrees    : cmd.append('-T')
+    if haddJobs>1 : cmd += ['-j','%d'%haddJobs]
+    cmd += [target]+inputs
+
+    start=time.time()
+    try:
+        p=subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        log,_=p.communicate()
+        exitCode=p.returncode
+    except OSError as e:
+        log,exitCode=str(e),-1
+    if exitCode==0:
+        try:
+            writeManifest(target,allInputs)
+        except (IOError,OSError):
+            pass
+    return {'target':target,
+            'inputs':len(inputs),
+            'bytes':sum([os.path.getsize(f) for f in inputs if os.path.isfile(f)]),
+            'wall':time.time()-start,
+            'exitCode':exitCode,
+            'log':log}
+
+
+def mergeChunkGroups(groups,outputdir,noTrees=False,njobs=4,haddJobs=1,bigSample=10.,force=False,incremental=False):
+
+    """
+    merges the groups of chunks concurrently (one hadd per basename)
+    targets newer than all their inputs are skipped unless force is set
+    in incremental mode only the new chunks are appended to the merged file (see getNewChunks)
+    samples larger than bigSample (Gb) are merged with haddJobs parallel processes
+    """
+
+    tasks=[]
+    for basename in sorted(groups):
+        allInputs=groups[basename]
+        inputs=allInputs
+        target=os.path.join(outputdir,'%s.root'%basename)
+        if incremental and not force:
+            newChunks=getNewChunks(target,allInputs)
+            if newChunks is not None:
+                if len(newChunks)==0:
+                    print '... %s is up to date'%basename
+                    continue
+                print '... %s: appending %d new chunks'%(basename,len(newChunks))
+                inputs=newChunks
+        elif not force and isUpToDate(target,allInputs):
+            print '... %s is up to date'%basename
+            continue
+        size=sum([os.path.getsize(f) for f in inputs])/1024.**3
+        tasks.append( (size,(target,inputs,noTrees,haddJobs if size>bigSample else 1,allInputs)) )
+
+    #merge the largest samples first
+    tasks=[t for size,t in sorted(tasks,key=lambda x : -x[0])]
+
+    reports=[]
+    start=time.time()
+    pool=Pool(max(1,min(njobs,len(tasks)))) if njobs>1 and len(tasks)>1 else None
+    results=pool.imap_unordered(runMerge,tasks) if pool else (runMerge(t) for t in tasks)
+    for r in results:
+        print '... %s merged from %d chunks in %3.1fs (%3.1f MB/s)%s'%(os.path.basename(r['target']),r['inputs'],r['wall'],
+                                                                      r['bytes']/1024.**2/max(r['wall'],1e-3),
+                                                                      '' if r['exitCode']==0 else ' FAILED, exit code %d'%r['exitCode'])
+        if r['exitCode']!=0: print r['log']
+        reports.append(r)
+    if pool:
+        pool.close()
+        pool.join()
+
+    if len(reports)>0:
+        totalWall=time.time()-start
+        totalBytes=sum([r['bytes'] for r in reports])
+        print 'Merged %3.1f MB in %3.1fs (%3.1f MB/s)'%(totalBytes/1024.**2,totalWall,totalBytes/1024.**2/max(totalWall,1e-3))
+
+    return reports
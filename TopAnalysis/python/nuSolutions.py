@@ -260,3 +260,311 @@ class doubleNeutrinoSolutions(object):
                  for ss in self.solutionSets]
         return [(K.dot(s), K_.dot(s_))
                 for s, s_ in zip(self.perp, self.perp_)]
+
+
+# Batched versions of the solvers above: the quantities of N events are
+# stored in arrays and the 3x3 matrices are stacked in (N,3,3) arrays so that
+# the linear algebra runs once for all the events.  Events which can't be
+# solved (singular matrices, non-finite inputs) are flagged in a validity mask
+# instead of raising.
+
+
+def p4FromPtEtaPhiM(pt, eta, phi, m):
+    '''(N,4) array of [px,py,pz,E] from arrays of pt,eta,phi,m (negative m as in ROOT, E=sqrt(p2-m2))'''
+    pt, eta, phi, m = [np.asarray(x, dtype=float) for x in (pt, eta, phi, m)]
+    px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+    p2 = px**2 + py**2 + pz**2
+    return np.stack([px, py, pz, np.sqrt(np.maximum(p2 + np.sign(m)*m**2, 0))], axis=-1)
+
+
+def massArray(p4):
+    '''Mass of arrays of [px,py,pz,E] (last axis), negative if space-like as TLorentzVector::M()'''
+    p4 = np.asarray(p4, dtype=float)
+    mm = p4[..., 3]**2 - (p4[..., 0]**2 + p4[..., 1]**2 + p4[..., 2]**2)
+    return np.where(mm < 0, -1., 1.)*np.sqrt(np.abs(mm))
+
+
+def R_batch(axis, angle):
+    '''Rotation matrices about x(0),y(1), or z(2) axis: (N,3,3)'''
+    c, s = np.cos(angle), np.sin(angle)
+    R = c[:, None, None] * np.eye(3)
+    R[:, axis, axis] = 1
+    R[:, (axis+1) % 3, (axis-1) % 3] = -s
+    R[:, (axis-1) % 3, (axis+1) % 3] = s
+    return R
+
+
+def sanitize(M, valid):
+    '''Replaces the matrices of invalid events by the identity'''
+    valid = valid & np.isfinite(M).all(axis=(1, 2))
+    return np.where(valid[:, None, None], M, np.eye(3)), valid
+
+
+def inv_batch(M, valid):
+    '''Inverse of stacked matrices, singular ones are flagged invalid'''
+    M, valid = sanitize(M, valid)
+    valid = valid & (np.linalg.det(M) != 0)
+    return np.linalg.inv(np.where(valid[:, None, None], M, np.eye(3))), valid
+
+
+def cofactor_batch(A, (i, j)):
+    '''Cofactor[i,j] of stacked 3x3 matrices A'''
+    rows, cols = [k for k in range(3) if k != i], [k for k in range(3) if k != j]
+    a = A[:, rows][:, :, cols]
+    return (-1)**(i+j) * (a[:, 0, 0]*a[:, 1, 1] - a[:, 1, 0]*a[:, 0, 1])
+
+
+def factor_degenerate_batch(G, valid, zero=0):
+    '''Linear factors of degenerate quadratic polynomials: (N,2,3) lines and (N,2) mask'''
+    n = len(G)
+    lines = np.zeros((n, 2, 3))
+    lineValid = np.zeros((n, 2), dtype=bool)
+
+    swapXY = np.abs(G[:, 0, 0]) > np.abs(G[:, 1, 1])
+    Q = np.where(swapXY[:, None, None], G[:, (1, 0, 2)][:, :, (1, 0, 2)], G)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Q = Q / Q[:, 1, 1][:, None, None]
+        q22 = cofactor_batch(Q, (2, 2))
+
+        # -q22<=zero: lines with the same slope
+        y = -cofactor_batch(Q, (0, 0))
+        r = np.sqrt(np.maximum(y, 0))
+        parallel = -q22 <= zero
+        for k, sign in enumerate([-1, 1]):
+            sel = parallel
+            lines[sel, k] = np.stack([Q[sel, 0, 1], Q[sel, 1, 1], Q[sel, 1, 2] + sign*r[sel]], axis=-1)
+        lineValid[parallel, 0] = y[parallel] >= 0
+        lineValid[parallel, 1] = y[parallel] > 0
+
+        # -q22>zero: lines crossing at (x0,y0)
+        sel = ~parallel
+        x0 = cofactor_batch(Q[sel], (0, 2)) / q22[sel]
+        y0 = cofactor_batch(Q[sel], (1, 2)) / q22[sel]
+        rq = np.sqrt(-q22[sel])
+        for k, sign in enumerate([-1, 1]):
+            m = Q[sel, 0, 1] + sign*rq
+            lines[sel, k] = np.stack([m, Q[sel, 1, 1], -Q[sel, 1, 1]*y0 - m*x0], axis=-1)
+        lineValid[sel] = True
+
+    lines = np.where(swapXY[:, None, None], lines[:, :, (1, 0, 2)], lines)
+
+    degenerate = (G[:, 0, 0] == 0) & (G[:, 1, 1] == 0)
+    if degenerate.any():
+        g = G[degenerate]
+        zeros = np.zeros(len(g))
+        lines[degenerate, 0] = np.stack([g[:, 0, 1], zeros, g[:, 1, 2]], axis=-1)
+        lines[degenerate, 1] = np.stack([zeros, g[:, 0, 1], g[:, 0, 2] - g[:, 1, 2]], axis=-1)
+        lineValid[degenerate] = True
+
+    lineValid &= valid[:, None] & np.isfinite(lines).all(axis=2)
+    return lines, lineValid
+
+
+def intersections_ellipse_line_batch(ellipse, line, valid, zero=1e-12):
+    '''Points of intersection between ellipses and lines: (N,2,3) points and (N,2) mask'''
+    M = np.cross(line[:, None, :], ellipse).transpose(0, 2, 1)
+    M, valid = sanitize(M, valid)
+    _, V = np.linalg.eig(M)
+    v = V.real.transpose(0, 2, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        points = v / v[:, :, 2:3]
+    k = (np.einsum('nij,nj->ni', v, line)**2 +
+         np.einsum('nij,njk,nik->ni', v, ellipse, v)**2)
+    order = np.argsort(k, axis=1, kind='mergesort')[:, :2]
+    idx = np.arange(len(v))[:, None]
+    return points[idx, order], valid[:, None] & (k[idx, order] < zero)
+
+
+def intersections_ellipses_batch(A, B, valid=None):
+    '''Points of intersection between pairs of ellipses: (N,4,3) points and (N,4) mask'''
+    if valid is None: valid = np.ones(len(A), dtype=bool)
+    A, valid = sanitize(A, valid)
+    B, valid = sanitize(B, valid)
+    swap = np.abs(np.linalg.det(B)) > np.abs(np.linalg.det(A))
+    A, B = np.where(swap[:, None, None], B, A), np.where(swap[:, None, None], A, B)
+
+    invA, valid = inv_batch(A, valid)
+    eigvals = np.linalg.eigvals(np.matmul(invA, B))
+    isReal = eigvals.imag == 0
+    valid = valid & isReal.any(axis=1)
+    e = eigvals.real[np.arange(len(A)), np.argmax(isReal, axis=1)]
+
+    lines, lineValid = factor_degenerate_batch(B - e[:, None, None]*A, valid)
+    results = [intersections_ellipse_line_batch(A, lines[:, k], lineValid[:, k])
+               for k in range(2)]
+    points = np.concatenate([p for p, _ in results], axis=1)
+    pointsValid = np.concatenate([m for _, m in results], axis=1)
+    return points, pointsValid
+
+
+class nuSolutionSetBatch(object):
+    '''Definitions for nu analytic solution, t->b,mu,nu, for N events'''
+
+    def __init__(self, b, mu,  # (N,4) arrays of [px,py,pz,E]
+                 mW2=mW**2, mT2=mT**2, mN2=mN**2):
+        b, mu = np.asarray(b, dtype=float), np.asarray(mu, dtype=float)
+        bP, muP = np.linalg.norm(b[:, :3], axis=1), np.linalg.norm(mu[:, :3], axis=1)
+        bE, muE = b[:, 3], mu[:, 3]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ptot = bP * muP
+            c = np.where(ptot > 0, np.einsum('ni,ni->n', b[:, :3], mu[:, :3]) / ptot, 0)
+            c = np.clip(c, -1, 1)
+            s = np.sqrt(1 - c**2)
+
+            x0p = - (mT2 - mW2 - (bE**2 - bP**2)) / (2*bE)
+            x0 = - (mW2 - (muE**2 - muP**2) - mN2) / (2*muE)
+
+            Bb, Bm = bP / bE, muP / muE
+
+            Sx = (x0 * Bm - muP*(1-Bm**2)) / Bm**2
+            Sy = (x0p / Bb - c * Sx) / s
+
+            w = (Bm / Bb - c) / s
+            w_ = (-Bm / Bb - c) / s
+
+            Om2 = w**2 + 1 - Bm**2
+            eps2 = (mW2 - mN2) * (1 - Bm**2)
+            x1 = Sx - (Sx+w*Sy) / Om2
+            y1 = Sy - (Sx+w*Sy) * w / Om2
+            Z2 = x1**2 * Om2 - (Sy-w*Sx)**2 - (mW2-x0**2-eps2)
+            Z = np.sqrt(np.maximum(0, Z2))
+
+        for item in ['b','mu','c','s','x0','x0p',
+                     'Sx','Sy','w','w_','x1','y1',
+                     'Z','Om2','eps2','mW2','muP']:
+            setattr(self, item, eval(item))
+
+    @property
+    def R_T(self):
+        '''Rotations from F coord. to laboratory coord.'''
+        mu = self.mu
+        R_z = R_batch(2, -np.arctan2(mu[:, 1], mu[:, 0]))
+        R_y = R_batch(1, 0.5*math.pi - np.arctan2(np.hypot(mu[:, 0], mu[:, 1]), mu[:, 2]))
+        xyz = np.einsum('nij,njk,nk->ni', R_y, R_z, self.b[:, :3])
+        R_x = R_batch(0, -np.arctan2(xyz[:, 2], xyz[:, 1]))
+        return np.einsum('nji,nkj,nlk->nil', R_z, R_y, R_x)
+
+    @property
+    def H_tilde(self):
+        '''Transformations of t=[c,s,1] to p_nu: F coord.'''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Om = np.sqrt(self.Om2)
+            H = np.zeros((len(self.Z), 3, 3))
+            H[:, 0, 0] = self.Z/Om
+            H[:, 0, 2] = self.x1 - self.muP
+            H[:, 1, 0] = self.w*self.Z/Om
+            H[:, 1, 2] = self.y1
+            H[:, 2, 1] = self.Z
+        return H
+
+    @property
+    def H(self):
+        '''Transformations of t=[c,s,1] to p_nu: lab coord.'''
+        return np.matmul(self.R_T, self.H_tilde)
+
+    @property
+    def H_perp(self):
+        '''Transformations of t=[c,s,1] to pT_nu: lab coord.'''
+        H_perp = self.H
+        H_perp[:, 2] = [0, 0, 1]
+        return H_perp
+
+    @property
+    def N(self):
+        '''Solution ellipses of pT_nu and their validity: lab coord.'''
+        HpInv, valid = inv_batch(self.H_perp, np.ones(len(self.Z), dtype=bool))
+        return np.matmul(np.matmul(HpInv.transpose(0, 2, 1), UnitCircle()), HpInv), valid
+
+
+class singleNeutrinoSolutionBatch(object):
+    '''Most likely neutrino momentum for tt-->lepton+jets, for N events'''
+    def __init__(self, b, mu,   # (N,4) arrays of [px,py,pz,E]
+                 (metX, metY),  # (N,) arrays of momentum imbalance
+                 sigma2,        # Mo. imbalance unc. matrix: (2,2) or (N,2,2)
+                 mW2=mW**2, mT2=mT**2):
+        self.solutionSet = nuSolutionSetBatch(b, mu, mW2, mT2)
+        n = len(self.solutionSet.Z)
+        S2 = np.zeros((n, 3, 3))
+        S2[:, :2, :2] = np.linalg.inv(np.broadcast_to(sigma2, (n, 2, 2)))
+        deltaNu = -self.solutionSet.H
+        deltaNu[:, 0, 2] += metX
+        deltaNu[:, 1, 2] += metY
+
+        self.X = np.matmul(np.matmul(deltaNu.transpose(0, 2, 1), S2), deltaNu)
+        XD = np.matmul(self.X, Derivative())
+        M = XD + XD.transpose(0, 2, 1)
+
+        solutions, valid = intersections_ellipses_batch(M, np.tile(UnitCircle().astype(float), (n, 1, 1)))
+        X2 = np.where(valid, self.calcX2(solutions), np.inf)
+        best = np.argmin(X2, axis=1)
+        idx = np.arange(n)
+        self.solutions = solutions[idx, best]
+        self.valid = valid[idx, best]
+        self._chi2 = X2[idx, best]
+
+    def calcX2(self, t):
+        '''chi2 of solutions t: (N,3) or (N,k,3)'''
+        if t.ndim == 2: return np.einsum('ni,nij,nj->n', t, self.X, t)
+        return np.einsum('nki,nij,nkj->nk', t, self.X, t)
+
+    @property
+    def chi2(self):
+        '''chi2 of the best solution (inf if not valid)'''
+        return self._chi2
+
+    @property
+    def nu(self):
+        '''Solutions for neutrino momentum: (N,3) array, see valid'''
+        return np.einsum('nij,nj->ni', self.solutionSet.H, self.solutions)
+
+
+class doubleNeutrinoSolutionsBatch(object):
+    '''Solution pairs of neutrino momenta, tt -> leptons, for N events'''
+    def __init__(self, (b, b_), (mu, mu_),  # (N,4) arrays of [px,py,pz,E]
+                 (metX, metY),              # (N,) arrays of ETmiss
+                 mW2=mW**2, mT2=mT**2):
+        self.solutionSets = [nuSolutionSetBatch(B, M, mW2, mT2)
+                             for B,M in zip((b,b_),(mu,mu_))]
+
+        metX, metY = np.asarray(metX, dtype=float), np.asarray(metY, dtype=float)
+        self.S = np.tile(-UnitCircle().astype(float), (len(metX), 1, 1))
+        self.S[:, 0, 2] += metX
+        self.S[:, 1, 2] += metY
+
+        (N, valid), (N_, valid_) = [ss.N for ss in self.solutionSets]
+        n_ = np.matmul(np.matmul(self.S.transpose(0, 2, 1), N_), self.S)
+
+        v, vValid = intersections_ellipses_batch(N, n_, valid & valid_)
+        v_ = np.einsum('nij,nkj->nki', self.S, v)
+
+        # no intersection: closest approach (event by event, only for the few failing ones)
+        noSol = valid & valid_ & ~vValid.any(axis=1)
+        if noSol.any() and leastsq:
+            es = [ss.H_perp for ss in self.solutionSets]
+            for i in np.flatnonzero(noSol):
+                met = np.array([metX[i], metY[i], 1])
+
+                def nus(ts):
+                    return tuple(e[i].dot([math.cos(t), math.sin(t), 1])
+                                 for e, t in zip(es, ts))
+
+                def residuals(params):
+                    return sum(nus(params), -met)[:2]
+
+                ts,_ = leastsq(residuals, [0, 0],
+                               ftol=5e-5, epsfcn=0.01)
+                v[i, 0], v_[i, 0] = nus(ts)
+                vValid[i, 0] = True
+
+        for k, v in {'perp': v, 'perp_': v_, 'n_': n_, 'valid': vValid}.items():
+            setattr(self, k, v)
+
+    @property
+    def nunu_s(self):
+        '''Solution pairs for neutrino momenta: (N,4,3) arrays for each neutrino and the (N,4) mask'''
+        K, K_ = [np.matmul(ss.H, inv_batch(ss.H_perp, np.ones(len(ss.Z), dtype=bool))[0])
+                 for ss in self.solutionSets]
+        nu = np.einsum('nij,nkj->nki', K, self.perp)
+        nu_ = np.einsum('nij,nkj->nki', K_, self.perp_)
+        return nu, nu_, self.valid
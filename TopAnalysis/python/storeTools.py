@@ -1,6 +1,146 @@
 import ROOT
 import pickle
 import os
+import time
+import hashlib
+import heapq
+import math
+import locale
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#in-memory and on-disk cache of the directory listings (entries expire after LSCACHETTL seconds or if the directory is modified)
+LSCACHEDIR = os.environ.get('STORETOOLS_CACHE',os.path.join(os.path.expanduser('~'),'.cache','storeTools'))
+LSCACHETTL = 3600
+LSTHREADS  = 8
+
+#the listings are sorted with the collation of the user locale, i.e. in the same order as ls
+#(files are numbered after their position in the listing e.g. in runLocalAnalysis)
+try:
+    locale.setlocale(locale.LC_COLLATE,'')
+except locale.Error:
+    pass
+
+class LocalStoreBackend:
+
+    """
+    lists the directories of the storage through a local mount point (by default eos mounted under /eos/cms)
+    another root can be used e.g. to run on a local copy of the directory tree
+    """
+
+    def __init__(self,root='/eos/cms'):
+        self.root=root
+
+    def getLocalPath(self,directory):
+        return directory if directory.startswith(self.root) else os.path.join(self.root,directory.lstrip('/'))
+
+    def getMTime(self,directory):
+        return os.stat(self.getLocalPath(directory)).st_mtime
+
+    def exists(self,directory):
+        return os.path.exists(self.getLocalPath(directory))
+
+    def listDir(self,directory):
+
+        """returns a list of (name,isDir,size in bytes) sorted by name, hidden entries are skipped as ls does"""
+
+        path=self.getLocalPath(directory)
+        entries=[]
+        if scandir is not None:
+            for e in scandir(path):
+                if e.name.startswith('.'): continue
+                isDir=e.is_dir()
+                entries.append( (e.name,isDir,0 if isDir else e.stat().st_size) )
+        else:
+            for name in os.listdir(path):
+                if name.startswith('.'): continue
+                st=os.stat(os.path.join(path,name))
+                isDir=os.path.isdir(os.path.join(path,name))
+                entries.append( (name,isDir,0 if isDir else st.st_size) )
+        return sorted(entries,key=lambda e : locale.strxfrm(e[0]))
+
+STOREBACKEND = LocalStoreBackend()
+
+def setStoreBackend(backend):
+
+    """changes the backend used to list the directories (returns the previous one)"""
+
+    global STOREBACKEND
+    prevBackend=STOREBACKEND
+    STOREBACKEND=backend
+    LSMEMCACHE.clear()
+    return prevBackend
+
+LSMEMCACHE = {}
+
+def listEOSDirectory(directory,useCache=True):
+
+    """
+    lists a directory returning (name,isDir,size in bytes) for each entry
+    the result is cached in memory and on disk, and re-used if the directory has not been modified since
+    and it is not older than LSCACHETTL (files re-written in place do not change the directory time)
+    """
+
+    directory=os.path.normpath(directory)
+    try:
+        mtime=STOREBACKEND.getMTime(directory)
+    except OSError:
+        return []
+
+    if useCache and LSCACHETTL>0:
+
+        if directory in LSMEMCACHE:
+            cmtime,ctime,entries=LSMEMCACHE[directory]
+            if cmtime==mtime and time.time()-ctime<LSCACHETTL:
+                return entries
+
+        cacheURL=os.path.join(LSCACHEDIR,hashlib.md5(STOREBACKEND.getLocalPath(directory)+locale.setlocale(locale.LC_COLLATE)).hexdigest()+'.pck')
+        try:
+            with open(cacheURL,'r') as cache:
+                cmtime,ctime,entries=pickle.load(cache)
+            if cmtime==mtime and time.time()-ctime<LSCACHETTL:
+                LSMEMCACHE[directory]=(cmtime,ctime,entries)
+                return entries
+        except Exception:
+            pass
+
+    try:
+        entries=STOREBACKEND.listDir(directory)
+    except OSError:
+        return []
+
+    if useCache and LSCACHETTL>0:
+        LSMEMCACHE[directory]=(mtime,time.time(),entries)
+        try:
+            if not os.path.isdir(LSCACHEDIR): os.makedirs(LSCACHEDIR)
+            tmpURL='%s.%d'%(cacheURL,os.getpid())
+            with open(tmpURL,'w') as cache:
+                pickle.dump(LSMEMCACHE[directory],cache,pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpURL,cacheURL)
+        except Exception:
+            pass
+
+    return entries
+
+def listEOSDirectories(directoryList,nthreads=LSTHREADS,useCache=True):
+
+    """lists several directories in parallel, returns a dict with the entries of each directory"""
+
+    directoryList=[os.path.normpath(d) for d in directoryList]
+    if len(directoryList)<2 or nthreads<2:
+        return dict( (d,listEOSDirectory(d,useCache)) for d in directoryList )
+    pool=ThreadPool(min(nthreads,len(directoryList)))
+    result=pool.map(lambda d : listEOSDirectory(d,useCache), directoryList)
+    pool.close()
+    pool.join()
+    return dict(zip(directoryList,result))
 
 def getEOSlslist(directory, mask='', prepend='root://eoscms//eos/cms/'):
 
@@ -8,52 +148,106 @@ def getEOSlslist(directory, mask='', prepend='root://eoscms//eos/cms/'):
     Takes a directory on eos (starting from /store/...) and returns a list of all files with 'prepend' prepended
     """
 
-
-    from subprocess import Popen, PIPE
     print 'looking into: '+directory+'...'
 
-    #eos should be mounted
-    data = Popen(['ls', '/eos/cms/%s'%directory],stdout=PIPE)
-    out,err = data.communicate()
-
     full_list = []
 
     ## if input file was single root file:
     if directory.endswith('.root'):
-        if len(out.split('\n')[0]) > 0:
+        if STOREBACKEND.exists(directory):
             return [prepend + directory]
 
     ## instead of only the file name append the string to open the file in ROOT
-    for line in out.split('\n'):
-        if len(line.split()) == 0: continue
-        full_list.append(prepend + directory + '/' + line)
+    for name,isDir,size in listEOSDirectory(directory):
+        full_list.append(prepend + directory + '/' + name)
 
     ## strip the list of files if required
     if mask != '':
         stripped_list = [x for x in full_list if mask in x]
         return stripped_list
 
-    ## return 
+    ## return
     return full_list
 
-def getChunksInSizeOf(chunkSize,directoryList,mask='',prepend='root://eoscms//eos/cms/'):
-    
-    """groups files in directory in chunks of a given size"""
+def getEOSlslists(directoryList, mask='', prepend='root://eoscms//eos/cms/', nthreads=LSTHREADS):
+
+    """
+    same as getEOSlslist for several directories which are listed in parallel, returns a dict with the list of each directory
+    """
 
-    chunkList=[[]]
-    cursize=0.
+    listings=listEOSDirectories(directoryList,nthreads)
+    lslists={}
     for directory in directoryList:
+        full_list=[prepend + directory + '/' + name for name,isDir,size in listings[os.path.normpath(directory)]]
+        if mask != '':
+            full_list=[x for x in full_list if mask in x]
+        lslists[directory]=full_list
+    return lslists
+
+def getEntriesPerFile(fList,tname):
+
+    """number of entries of a tree in each file (0 if it can't be read)"""
+
+    nentries=[]
+    for f in fList:
+        n=0
+        try:
+            fIn=ROOT.TFile.Open(f)
+            n=fIn.Get(tname).GetEntriesFast()
+            fIn.Close()
+        except:
+            pass
+        nentries.append(float(n))
+    return nentries
 
-        fList=getEOSlslist(directory=directory, mask=mask, prepend='/eos/cms')
+def planChunks(weights,chunkSize):
 
-        for f in fList:
+    """
+    balanced bin-packing of a list of weights in bins of approximately chunkSize
+    the number of bins is fixed by the total weight and the items are assigned by decreasing weight
+    to the least loaded bin (longest processing time first), returns the list of indices in each bin and the bin loads
+    """
+
+    nchunks=max(1,int(math.ceil(sum(weights)/chunkSize))) if chunkSize>0 else 1
+    nchunks=min(nchunks,max(1,len(weights)))
+    loads=[(0.,ichunk) for ichunk in xrange(0,nchunks)]
+    chunks=[[] for ichunk in xrange(0,nchunks)]
+    for i in sorted(xrange(0,len(weights)),key=lambda i : -weights[i]):
+        load,ichunk=heapq.heappop(loads)
+        chunks[ichunk].append(i)
+        heapq.heappush(loads,(load+weights[i],ichunk))
+    loads=[load for load,ichunk in sorted(loads,key=lambda x : x[1])]
+    return [sorted(c) for c in chunks],loads
+
+def getChunksInSizeOf(chunkSize,directoryList,mask='',prepend='root://eoscms//eos/cms/',entriesTree=None,report=False):
+
+    """
+    groups files in directory in chunks of a given size (in Gb)
+    the files are distributed to have chunks as similar as possible (see planChunks)
+    if entriesTree is given the files are weighted by the number of entries of the tree instead of their size
+    """
+
+    fList,fSizes=[],[]
+    listings=listEOSDirectories(directoryList)
+    for directory in directoryList:
+
+        for name,isDir,size in listings[os.path.normpath(directory)]:
+            f='/eos/cms'+directory+'/'+name
+            if mask!='' and not mask in f : continue
             if not '.root' in f : continue
-            fsize=float(os.path.getsize(f))/(1024.e+6)
-            if cursize+fsize>chunkSize: 
-                chunkList.append([])
-                cursize=fsize
-            else:
-                cursize += fsize
-            chunkList[-1].append(f.replace('/eos/cms/',prepend))
-
-    return chunkList
+            fList.append(f)
+            fSizes.append(float(size)/(1024.e+6))
+
+    #weight by the number of entries, normalized to the total size
+    weights=fSizes
+    if entriesTree and len(fList)>0:
+        nentries=getEntriesPerFile(fList,entriesTree)
+        if sum(nentries)>0:
+            weights=[n*sum(fSizes)/sum(nentries) for n in nentries]
+
+    chunks,loads=planChunks(weights,chunkSize)
+    if report and len(fList)>0:
+        print '%d files in %d chunks, expected size min/mean/max = %3.2f/%3.2f/%3.2f Gb'\
+            %(len(fList),len(chunks),min(loads),sum(loads)/len(loads),max(loads))
+
+    return [[fList[i].replace('/eos/cms/',prepend) for i in c] for c in chunks]
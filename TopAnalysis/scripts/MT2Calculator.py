@@ -1,6 +1,8 @@
 from ROOT import TLorentzVector, TVector2, TVector3
 from math import *
 from copy import copy
+import numpy as np
+from TopLJets2015.TopAnalysis.nuSolutions import massArray
 
 # parameter used to set lower bounds while searching
 mc=0.0
@@ -260,3 +262,197 @@ def mt2Sqrt(x):
 			root=(root+x/root)*0.5
 
 		return root
+
+"""
+Vectorized version of mt2Sqrt() for arrays (same Newton iterations, so that the results are identical)
+"""
+def mt2SqrtArray(x):
+	x=np.asarray(x, dtype=float)
+	with np.errstate(invalid='ignore'):
+		positive=x>0.0
+	root=np.where(np.isinf(x) & positive, np.inf, 0.0)
+	active=np.flatnonzero(positive & ~np.isinf(x))
+	xa=x.ravel()[active]
+	prev2root=np.full(len(active), -1.0)
+	prevroot=np.full(len(active), -1.0)
+	newroot=np.ones(len(active))
+	todo=np.arange(len(active))
+	while len(todo)>0:
+		prev2root[todo]=prevroot[todo]
+		prevroot[todo]=newroot[todo]
+		newroot[todo]=(newroot[todo]+xa[todo]/newroot[todo])*0.5
+		todo=todo[(newroot[todo]!=prevroot[todo]) & (newroot[todo]!=prev2root[todo])]
+	root.ravel()[active]=newroot
+	return root
+
+"""
+Mass after TLorentzVector::SetXYZM(px,py,0,m) (calcMt2 uses the mass recomputed from the energy for the visible systems)
+"""
+def transverseMassArray(px, py, m):
+	p2=px*px+py*py
+	en=np.where(m>=0, np.sqrt(p2+m*m), np.sqrt(np.maximum(p2-m*m, 0.0)))
+	mm=en*en-p2
+	return np.where(mm<0, -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm)))
+
+"""
+Calculate M_{T2} for N events at once: same algorithm as calcMt2 with the bisection run in parallel for all events
+vis1in, vis2in and childin are (N,4) arrays of [px,py,pz,E], returns an (N,) array
+"""
+def calcMt2Batch(vis1in, vis2in, childin):
+	vis1in, vis2in, childin=[np.atleast_2d(np.asarray(p, dtype=float)) for p in (vis1in, vis2in, childin)]
+	n=len(vis1in)
+
+	swap=(massArray(vis1in)>massArray(vis2in))[:,None]
+	vis1=np.where(swap, vis2in, vis1in)
+	vis2=np.where(swap, vis1in, vis2in)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+
+		#rotate so that vis1 is along x
+		mag=mt2SqrtArray(vis1[:,0]*vis1[:,0]+vis1[:,1]*vis1[:,1])
+		cospart=vis1[:,0]/mag
+		sinpart=vis1[:,1]/mag
+
+		vis1Px, vis1Py=mag, np.zeros(n)
+		vis2Px=vis2[:,0]*cospart+vis2[:,1]*sinpart
+		vis2Py=vis2[:,1]*cospart-vis2[:,0]*sinpart
+		childPx=childin[:,0]*cospart+childin[:,1]*sinpart
+		childPy=childin[:,1]*cospart-childin[:,0]*sinpart
+		vis1M=transverseMassArray(vis1Px, vis1Py, massArray(vis1))
+		vis2M=transverseMassArray(vis2Px, vis2Py, massArray(vis2))
+		mc=massArray(childin)
+
+		vis1M2=vis1M*vis1M
+		vis2M2=vis2M*vis2M
+		mc2=mc*mc
+		vis1Px2=vis1Px*vis1Px
+		vis2Px2=vis2Px*vis2Px
+		childPx2=childPx*childPx
+		vis2Py2=vis2Py*vis2Py
+		childPy2=childPy*childPy
+		vis1Pt2=vis1Px2
+		vis2Pt2=vis2Px2+vis2Py2
+		childPt2=childPx2+childPy2
+		vis1Et2=vis1M2+vis1Pt2
+		vis2Et2=vis2M2+vis2Pt2
+		childEt2=mc2+childPt2
+		vis1Et=mt2SqrtArray(vis1Et2)
+		vis2Et=mt2SqrtArray(vis2Et2)
+
+		#both visible systems massive (A), only vis2 massive (B) or both massless (C)
+		caseA=~((vis1M<=0.0) | (vis2M<=0.0))
+		caseB=~caseA & ~(vis2M<=0.0)
+		caseC=~caseA & ~caseB
+
+		xlmin=vis1Px*mc/vis1M
+		xrmin=vis2Px*mc/vis2M
+		yrmin=vis2Py*mc/vis2M
+		altxlmin=childPx-xlmin
+		altxrmin=childPx-xrmin
+		altyrmin=childPy-yrmin
+		Mtlmin=np.where(caseA, vis1M+mc, mc)
+		Mtrmin=vis2M+mc
+		Mtratlmin=mt2SqrtArray(vis2M2+mc2+2.0*(vis2Et*mt2SqrtArray(mc2+altxlmin*altxlmin+childPy2)-vis2Px*altxlmin-vis2Py*childPy))
+		Mtlatrmin=mt2SqrtArray(vis1M2+mc2+2.0*(vis1Et*mt2SqrtArray(mc2+altxrmin*altxrmin+altyrmin*altyrmin)-vis1Px*altxrmin))
+
+		solvedL=caseA & (Mtlmin>=Mtratlmin)
+		solvedR=(caseA | caseB) & ~solvedL & (Mtrmin>=Mtlatrmin)
+		solved=solvedL | solvedR
+		outputmt2=np.where(solvedL, Mtlmin, np.where(solvedR, Mtrmin, 0.0))
+
+		Mtmin=np.where(solved, 0.0, np.where(Mtlmin>Mtrmin, Mtlmin, Mtrmin))
+		Mtmax=np.where(solved, 0.0, np.where(caseA & (Mtlatrmin>=Mtratlmin), Mtratlmin, Mtlatrmin))
+
+		backupmid=mt2SqrtArray(mc2+(childPx*childPx+childPy*childPy)*0.25)
+		backup1=mt2SqrtArray(vis1M2+mc2+2.0*(vis1Et*backupmid-0.5*vis1Px*childPx))
+		backup2=mt2SqrtArray(vis2M2+mc2+2.0*(vis2Et*backupmid-0.5*(vis2Px*childPx+vis2Py*childPy)))
+		backup=np.where(backup1>backup2, backup1, backup2)
+		Mtmax=np.where(backup<Mtmax, backup, Mtmax)
+
+		trialmid=mt2SqrtArray(mc2+0.25*childPt2)
+		trial1=mt2SqrtArray(mc2+2.0*(vis1Et*trialmid-vis1Px*childPx*0.5))
+		trial2=mt2SqrtArray(mc2+2.0*(vis2Et*trialmid-0.5*(vis2Px*childPx+vis2Py*childPy)))
+		Mtmin=np.where(caseC, mc, Mtmin)
+		Mtmax=np.where(caseC, np.where(trial1>trial2, trial1, trial2), Mtmax)
+
+		#bisection, only the events which did not converge yet are updated at each step
+		outputmt2=np.where(solved, outputmt2, Mtmin+(Mtmax-Mtmin)*0.5)
+
+		C1=1.0/vis1Et2
+
+		A2=vis2M2+vis2Py2
+		B2=-2.0*vis2Px*vis2Py
+		C2=1.0/(vis2M2+vis2Px2)
+
+		preF1=vis1Et2*mc2
+
+		preD2=-2.0*childPx*A2-B2*childPy
+		preE2=-2.0*childPy/C2-B2*childPx
+		preF2=vis2Et2*childEt2-childPx2*vis2Px2-childPy2*vis2Py2+B2*childPx*childPy
+
+		G=B2*0.5*C2
+		J1=-vis1M2*C1
+		J2=(B2*B2*0.25*C2-A2)*C2
+
+		alpha=G*G-J1-J2
+		p0_4=alpha*alpha-4.0*J1*J2
+		p0_4nonzero=np.where(np.fabs(p0_4)<1e-9, 1e-9, p0_4)
+
+		active=np.flatnonzero(~solved & (outputmt2>Mtmin) & (outputmt2<Mtmax))
+		while len(active)>0:
+			i=active
+			mt2=outputmt2[i]
+			q1=mc2[i]+vis1M2[i]-mt2*mt2
+			D1=q1*vis1Px[i]
+			F1=preF1[i]-q1*q1*0.25
+
+			q2=mt2*mt2-mc2[i]-vis2M2[i]
+			D2=preD2[i]+q2*vis2Px[i]
+			E2=preE2[i]+q2*vis2Py[i]
+			F2=preF2[i]-q2*(q2*0.25+vis2Px[i]*childPx[i]+vis2Py[i]*childPy[i])
+
+			H=E2*0.5*C2[i]
+
+			K1=-D1*C1[i]
+			L1=-F1*C1[i]
+
+			K2=(B2[i]*E2*0.5*C2[i]-D2)*C2[i]
+			L2=(E2*E2*0.25*C2[i]-F2)*C2[i]
+
+			beta=2.0*G[i]*H-K1-K2
+			gamma=H*H-L1-L2
+
+			al,J1i,J2i,p04,p04nz=alpha[i],J1[i],J2[i],p0_4[i],p0_4nonzero[i]
+			p0_3=(2.0*al*beta-4.0*(J1i*K2+J2i*K1))/p04nz
+			p0_2=(2.0*al*gamma+beta*beta-4.0*(J1i*L2+J2i*L1+K1*K2))/p04nz
+			p0_1=(2.0*beta*gamma-4.0*(K1*L2+K2*L1))/p04nz
+			p0_0=(gamma*gamma-4.0*L1*L2)/p04nz
+
+			p2_2=0.1875*p0_3*p0_3-p0_2*0.5
+			p2_1=p0_3*p0_2*0.125-0.75*p0_1
+			p2_0=p0_3*p0_1*0.0625-p0_0
+
+			p2_2nonzero=np.where(np.fabs(p2_2)<1e-9, 1e-9, p2_2)
+
+			p3_1=(4.0*p2_0+3.0*p0_3*p2_1)/p2_2nonzero-4.0*p2_1*p2_1/(p2_2nonzero*p2_2nonzero)-2.0*p0_2
+			p3_0=3.0*p0_3*p2_0/p2_2nonzero-4.0*p2_1*p2_0/(p2_2nonzero*p2_2nonzero)-p0_1
+
+			p4_0=np.where(np.fabs(p3_1)<1e-9,
+				      np.where(p2_2>0, -1.0, np.where(p2_2==0, 0.0, 1.0)),
+				      p2_1*p3_0/p3_1-p2_2*p3_0*p3_0/(p3_1*p3_1)-p2_0)
+
+			#sign changes of the Sturm sequence
+			negroots=np.ones(len(i), dtype=int)
+			posroots=np.zeros(len(i), dtype=int)
+			for a,b in [(p04,p2_2),(p2_2,p3_1),(p3_1,p4_0)]:
+				negroots+=((a<0.0) & (b<0.0)) | ((a>0.0) & (b>0.0))
+				posroots+=((a<0.0) & (b>0.0)) | ((a>0.0) & (b<0.0))
+
+			moveMin=posroots==negroots
+			Mtmin[i]=np.where(moveMin, mt2, Mtmin[i])
+			Mtmax[i]=np.where(moveMin, Mtmax[i], mt2)
+			outputmt2[i]=Mtmin[i]+(Mtmax[i]-Mtmin[i])*0.5
+
+			active=i[(outputmt2[i]>Mtmin[i]) & (outputmt2[i]<Mtmax[i])]
+
+	return outputmt2
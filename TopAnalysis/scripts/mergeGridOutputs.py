@@ -12,6 +12,7 @@ def main():
     parser.add_option('-i', '--inDir',      dest='inDir',       help='input directory with files',  default=None,       type='string')
     parser.add_option('-o', '--outDir',     dest='outDir',      help='output directory with files', default=None,       type='string')
     parser.add_option('-s', '--chunkSize',  dest='chunkSize',   help='size of the output chunk (Gb) [%default]', default=2, type=float)
+    parser.add_option(      '--entriesTree', dest='entriesTree', help='balance the chunks using the entries of this tree instead of the file size', default=None, type='string')
     parser.add_option(      '--only',       dest='only',        help='only this tag',               default=None    ,   type='string')
     parser.add_option(      '--farm',       dest='farm',        help='farm tag',                    default=None    ,   type='string')
     parser.add_option(      '--localProd',  dest='localProd',   help='local production',            default=False, action='store_true')
@@ -61,12 +62,16 @@ def main():
     condor.write('+JobFlavour ="%s"\n'%opt.queue)
 
     if not opt.localProd:
+
+        #list the <primary-dataset>/<publication-name>/<time-stamp>/<count> tree one level at a time
+        #the directories of each level are listed in parallel, only for the publications selected
         dset_list=getEOSlslist(directory=opt.inDir,prepend='')
+        pub_lists=getEOSlslists(dset_list,prepend='')
+        pubs=[]
         for dset in dset_list:
             dsetname=dset.split('/')[-1]
 
-            pub_list=getEOSlslist(directory=dset,prepend='')
-            for pubDir in pub_list:
+            for pubDir in pub_lists[dset]:
 
                 if not 'crab' in pubDir:
                     print 'Ambiguity found @ <publication-name> for <primary-dataset>=%s , bailing out'%dsetname
@@ -83,34 +88,40 @@ def main():
                         print 'Skipping %s, not in process only list'%pub
                         continue
 
-                #check if it's an extension
-                pubExt=None
-                try:
-                    extSplit=pub.split('_ext')
-                    pubExt='ext%d'%(len(extSplit)-1)
-                    pub=extSplit[0]
-                    print 'Extension will be postfixed with ',pubExt
-                except:
-                    print 'Core sample (no extension)'
-                
-                time_list=getEOSlslist(directory=pubDir,prepend='')
-                if len(time_list)!=1:
-                    print 'Ambiguity found @ <time-stamp> for <primary-dataset>=%s , bailing out'%dsetname
-                    continue
-                time_stamp=time_list[0].split('/')[-1]
-
-                out_list=[]
-                count_list=getEOSlslist(directory=time_list[0],prepend='')
-
-                chunkList=getChunksInSizeOf(chunkSize=opt.chunkSize,directoryList=count_list,prepend='/eos/cms/')
-                print pub,'will be hadded in',len(chunkList),'chunks of approx %fGb'%opt.chunkSize
-                for ichunk in xrange(0,len(chunkList)):
-                    outFile='/eos/cms/{0}/{1}/Chunk_{2}_{3}.root'.format(opt.outDir,pub,ichunk,pubExt)
-                    condor.write('arguments = %s %s\n'%(outFile,' '.join(chunkList[ichunk])))
-                    condor.write('queue 1\n')
+                pubs.append( (dsetname,pubDir,pub) )
+
+        time_lists=getEOSlslists([pubDir for _,pubDir,_ in pubs],prepend='')
+        count_lists=getEOSlslists([time_lists[pubDir][0] for _,pubDir,_ in pubs if len(time_lists[pubDir])==1],prepend='')
+        for dsetname,pubDir,pub in pubs:
+
+            #check if it's an extension
+            pubExt=None
+            try:
+                extSplit=pub.split('_ext')
+                pubExt='ext%d'%(len(extSplit)-1)
+                pub=extSplit[0]
+                print 'Extension will be postfixed with ',pubExt
+            except:
+                print 'Core sample (no extension)'
+            
+            time_list=time_lists[pubDir]
+            if len(time_list)!=1:
+                print 'Ambiguity found @ <time-stamp> for <primary-dataset>=%s , bailing out'%dsetname
+                continue
+            time_stamp=time_list[0].split('/')[-1]
+
+            out_list=[]
+            count_list=count_lists[time_list[0]]
+
+            chunkList=getChunksInSizeOf(chunkSize=opt.chunkSize,directoryList=count_list,prepend='/eos/cms/',entriesTree=opt.entriesTree,report=True)
+            print pub,'will be hadded in',len(chunkList),'chunks of approx %fGb'%opt.chunkSize
+            for ichunk in xrange(0,len(chunkList)):
+                outFile='/eos/cms/{0}/{1}/Chunk_{2}_{3}.root'.format(opt.outDir,pub,ichunk,pubExt)
+                condor.write('arguments = %s %s\n'%(outFile,' '.join(chunkList[ichunk])))
+                condor.write('queue 1\n')
 
-                #prepare output directory
-                if not opt.dry: os.system('mkdir -p /eos/cms/{0}/{1}'.format(opt.outDir,pub))
+            #prepare output directory
+            if not opt.dry: os.system('mkdir -p /eos/cms/{0}/{1}'.format(opt.outDir,pub))
 
     else:
         print 'Local production'
@@ -127,7 +138,7 @@ def main():
                     print 'Skipping %s, not in process only list'%pub
                     continue
 
-            chunkList=getChunksInSizeOf(chunkSize=opt.chunkSize,directoryList=[dset],prepend='/eos/cms/')
+            chunkList=getChunksInSizeOf(chunkSize=opt.chunkSize,directoryList=[dset],prepend='/eos/cms/',entriesTree=opt.entriesTree,report=True)
             print pub,'will be hadded in',len(chunkList),'chunks of approx %fGb'%opt.chunkSize
             for ichunk in xrange(0,len(chunkList)):
                 outFile='/eos/cms/{0}/{1}/Chunk_{2}_ext0.root'.format(opt.outDir,pub,ichunk)
@@ -1,86 +1,61 @@
 #! /usr/bin/env python
 import os, sys
-import ROOT
-counters = {}
-badFiles = []
+import optparse
+from TopLJets2015.TopAnalysis.mergeTools import getChunkGroups,mergeChunkGroups
+
+"""
+steer the script
+"""
+def main():
+
+    usage = 'usage: %prog inputdir [noTrees] [outputdir] [options]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-j', '--njobs',     dest='njobs',     help='number of samples to validate/merge in parallel [%default]', default=4,   type=int)
+    parser.add_option(      '--haddJobs',  dest='haddJobs',  help='parallel processes to use in hadd for big samples [%default]', default=4, type=int)
+    parser.add_option(      '--bigSample', dest='bigSample', help='size (Gb) above which a sample is considered big [%default]',   default=10., type=float)
+    parser.add_option(      '--incremental', dest='incremental', help='only append new chunks to the merged files (full merge if a chunk was replaced) [%default]', default=False, action='store_true')
+    parser.add_option(      '--force',     dest='force',     help='merge also the samples which are up to date [%default]',     default=False, action='store_true')
+    (opt, args) = parser.parse_args()
 
-def isint(string):
     try:
-        int(string)
-        return True
-    except ValueError:
-        return False
+        inputdir = args[0]
+        if not os.path.isdir(inputdir):
+            print "Input directory not found:", inputdir
+            return -1
+    except IndexError:
+        print "Need to provide an input directory."
+        return -1
+
+    noTrees=False
+    if len(args)>1 and args[1]=='True': noTrees=True
+
+    outputdir = inputdir
+    if len(args)>2 : outputdir=args[2]
+    chunkdir  = os.path.join(inputdir, 'Chunks')
+    os.system('mkdir -p %s' % chunkdir)
+
+    counters,singles,badFiles = getChunkGroups(chunkdir,opt.njobs)
+    for f in singles:
+        print os.path.splitext(os.path.basename(f))[0],'is single'
 
-def getBaseNames(dirname):
-    names = set()
-    for item in os.listdir(dirname):
-        filename, ext = os.path.splitext(item)
-        if not ext == '.root': continue
-        try:
-            #if not ('MC13TeV' in filename or 'Data13TeV' in filename) : continue
-            fIn=ROOT.TFile.Open(dirname+'/'+item)
-            goodFile = False
-            try:
-                if fIn and not fIn.IsZombie() and not fIn.TestBit(ROOT.TFile.kRecovered):
-                    goodFile = True
-            except:
-                pass
-            basename, number = filename.rsplit('_',1)
-            print basename,number,goodFile
-            if (not goodFile):
-                badFiles.append(dirname+'/'+item)
-                continue
-            if not number == 'missing' and not isint(number):
-                raise ValueError
-
-            try:
-                counters[basename].append(dirname+'/'+item)
-            except KeyError:
-                counters[basename] = [dirname+'/'+item]
-            names.add(basename)
-
-        except ValueError:
-            print filename,'is single'
-            names.add(filename)
-    return names
-
-try:
-    inputdir = sys.argv[1]
-    if not os.path.isdir(inputdir):
-        print "Input directory not found:", inputdir
-        exit(-1)
-except IndexError:
-    print "Need to provide an input directory."
-    exit(-1)
-
-noTrees=False
-if len(sys.argv)>2 and sys.argv[2]=='True': noTrees=True
-
-outputdir = inputdir
-if len(sys.argv)>3 : outputdir=sys.argv[3]
-chunkdir  = os.path.join(inputdir, 'Chunks')
-basenames = getBaseNames(chunkdir)
-
-print '-----------------------'
-print 'Will process the following samples:', basenames
-
-os.system('mkdir -p %s' % chunkdir)
-
-for basename, files in counters.iteritems():
-
-    filenames = " ".join(files)
-    target = os.path.join(outputdir,"%s.root" % basename)
-
-    # merging:
-    print '... processing', basename
-    if noTrees:
-        cmd = 'hadd -f -T %s %s' % (target, filenames)
-    else:
-        cmd = 'hadd -f %s %s' % (target, filenames)
-    os.system(cmd)
-
-if (len(badFiles) > 0):
     print '-----------------------'
-    print 'The following files are not done yet or require resubmission, please check LSF output:'
-    for file in badFiles:
-        print file,
+    print 'Will process the following samples:', sorted(counters.keys())
+
+    reports=mergeChunkGroups(counters,outputdir,
+                             noTrees=noTrees,
+                             njobs=opt.njobs,
+                             haddJobs=opt.haddJobs,
+                             bigSample=opt.bigSample,
+                             force=opt.force,
+                             incremental=opt.incremental)
+
+    if (len(badFiles) > 0):
+        print '-----------------------'
+        print 'The following files are not done yet or require resubmission, please check LSF output:'
+        for file in badFiles:
+            print file,
+
+    return 1 if any([r['exitCode']!=0 for r in reports]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
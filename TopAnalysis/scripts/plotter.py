@@ -2,11 +2,377 @@ import optparse
 import os,sys
 import json
 import pickle
+import re
 from collections import OrderedDict
+from multiprocessing import Pool
 
 from TopLJets2015.TopAnalysis.Plot import *
 
 
+"""
+index of the objects stored in a list of files in a directory as {file name:[(key,class name)]}
+the index is kept in the directory and only the files modified since it was written are read again
+"""
+KEYINDEXNAME='.plotter_index.json'
+PLOTCACHEDIR='.plotter_cache'
+def getKeyIndex(inDir,fileList):
+
+    indexURL=os.path.join(inDir,KEYINDEXNAME)
+    index={}
+    try:
+        with open(indexURL,'r') as f:
+            index=json.load(f)
+    except (IOError,ValueError):
+        pass
+
+    keyIndex={}
+    updated=False
+    for fname in fileList:
+        url=os.path.join(inDir,fname)
+        try:
+            stamp=[os.path.getsize(url),os.path.getmtime(url)]
+        except OSError:
+            continue
+        if not fname in index or index[fname]['stamp']!=stamp:
+            fIn=ROOT.TFile.Open(url)
+            if not fIn : continue
+            index[fname]={'stamp':stamp,
+                          'keys':[(tkey.GetName(),tkey.GetClassName()) for tkey in fIn.GetListOfKeys()]}
+            fIn.Close()
+            updated=True
+        keyIndex[fname]=[(str(key),str(cls)) for key,cls in index[fname]['keys']]
+
+    if updated:
+        try:
+            with open(indexURL,'w') as f:
+                json.dump(index,f)
+        except IOError:
+            pass
+
+    return keyIndex
+
+"""
+checks if a class inherits from a base class (without reading any object)
+"""
+INHERITANCECACHE={}
+def inheritsFrom(cls,base):
+    if not (cls,base) in INHERITANCECACHE:
+        tcls=ROOT.TClass.GetClass(str(cls))
+        INHERITANCECACHE[(cls,base)]=True if tcls and tcls.InheritsFrom(base) else False
+    return INHERITANCECACHE[(cls,base)]
+
+"""
+filter plots using a selection list
+"""
+def isSelectedKey(key,onlyList,strictOnly):
+    keep=False if len(onlyList)>0 else True
+    for pname in onlyList:
+        if strictOnly and pname!=key: continue
+        if not strictOnly and not pname in key: continue
+        keep=True
+        break
+    return keep
+
+"""
+opens the files of the processes when they are first needed and computes the pileup normalization correction for each one
+"""
+class ProcFileReader:
+
+    def __init__(self,procList,opt,rawList):
+        self.procList=procList
+        self.opt=opt
+        self.rawList=rawList
+        self.files={}
+        self.stamps={}
+        self.report={}
+
+    def getStamp(self,iproc):
+        """size and modification time of the file of a process"""
+        if not iproc in self.stamps:
+            try:
+                url='%s/%s.root' % ( self.opt.inDir, self.procList[iproc][2][0])
+                self.stamps[iproc]=[os.path.getsize(url),os.path.getmtime(url)]
+            except OSError:
+                self.stamps[iproc]=None
+        return self.stamps[iproc]
+
+    def get(self,iproc):
+        """returns (file,pileup normalization factor) or None if the file can't be opened"""
+        if iproc in self.files: return self.files[iproc]
+
+        tag,sample,sp,isSignal,isSyst=self.procList[iproc]
+        print '%s/%s.root' % ( self.opt.inDir, sp[0]) 
+        fIn=ROOT.TFile.Open('%s/%s.root' % ( self.opt.inDir, sp[0]) )
+        if not fIn : 
+            self.files[iproc]=None
+            return None
+
+        #fix pileup weighting normalization
+        puNormSF=1
+        isData=sample[1]
+        if self.opt.puNormSF and not isData:
+            puCorrH=fIn.Get(self.opt.puNormSF)
+            if tag not in self.rawList:
+                try:
+                    nonWgt=puCorrH.GetBinContent(1)
+                    wgt=puCorrH.GetBinContent(2)
+                    if wgt>0 :
+                        puNormSF=nonWgt/wgt
+                        if puNormSF>1.3 or puNormSF<0.7 : 
+                            puNormSF=1
+                            self.report[iproc]='%s wasn\'t be scaled as too large SF was found (probably low stats)\n' % sp[0]
+                        else :
+                            self.report[iproc]='%s was scaled by %3.3f for pileup normalization\n' % (sp[0],puNormSF)
+                except:
+                    print 'Check pu weight control histo',self.opt.puNormSF,'for',sp[0]
+        self.files[iproc]=(fIn,puNormSF)
+        return self.files[iproc]
+
+    def freeMemory(self,iprocs):
+        """frees the histograms which were read but not kept"""
+        for iproc in iprocs:
+            if self.files.get(iproc) : self.files[iproc][0].GetList().Delete()
+
+    def close(self):
+        for f in self.files.values():
+            if f : f[0].Close()
+
+"""
+cache of the scaled histograms of a plot, stored in a ROOT file per plot with a json index
+each entry is valid while the input file and the scaling inputs (xsec, lumi, pileup normalization, process SF, rebin, ...) do not change
+"""
+class ScaledHistoCache:
+
+    def __init__(self,cacheDir,pname):
+        baseURL=os.path.join(cacheDir,re.sub('[^\w\-\.]','_',pname))
+        self.indexURL=baseURL+'.json'
+        self.rootURL=baseURL+'.root'
+        self.index={}
+        self.updated=False
+        self.fIn=None
+        try:
+            with open(self.indexURL,'r') as f:
+                self.index=json.load(f)
+        except (IOError,ValueError):
+            pass
+        if len(self.index)>0 and os.path.isfile(self.rootURL):
+            self.fIn=ROOT.TFile.Open(self.rootURL,'UPDATE')
+        if not self.fIn:
+            self.index={}
+            try:
+                os.makedirs(cacheDir)
+            except OSError:
+                pass
+            self.fIn=ROOT.TFile.Open(self.rootURL,'RECREATE')
+        if not self.fIn or self.fIn.IsZombie():
+            print 'WARNING: can not write the cache in %s, the histograms will not be cached'%self.rootURL
+            self.fIn=None
+
+    def isOpen(self):
+        return self.fIn is not None
+
+    def get(self,name,stamp,scaleKey,title):
+        """returns (histograms,key is a weight variation,report) if the entry is valid, None otherwise (the histograms are titled after the current process title)"""
+        entry=self.index.get(name)
+        if entry is None or entry['stamp']!=stamp or entry['scale']!=scaleKey: return None
+        histos=[self.fIn.Get(str(hname)) for hname in entry['histos']]
+        if any([not h for h in histos]) : return None
+        for h,suffix in zip(histos,entry['titleSuffixes']): h.SetTitle(title+str(suffix))
+        return histos,entry['keyIsSyst'],str(entry['report'])
+
+    def put(self,name,stamp,scaleKey,title,histos,keyIsSyst,report):
+        entry={'stamp':stamp,'scale':scaleKey,'keyIsSyst':keyIsSyst,'report':report,'histos':[],'titleSuffixes':[]}
+        for ih,h in enumerate(histos):
+            hname='%s_%d'%(name.replace(':','_').replace('/','_'),ih)
+            self.fIn.WriteTObject(h,hname,'Overwrite')
+            entry['histos'].append(hname)
+            entry['titleSuffixes'].append(h.GetTitle()[len(title):])
+        self.index[name]=entry
+        self.updated=True
+
+    def close(self):
+        if self.updated:
+            with open(self.indexURL,'w') as f:
+                json.dump(self.index,f)
+        if self.fIn: self.fIn.Close()
+
+"""
+reads a histogram (or the weight variations stored in a _syst TH2) and applies the scale factors and rebinning
+returns the list of histograms and True if the key holds weight variations
+"""
+def readScaledHistos(fIn,key,puNormSF,sfVal,lumi,proc,opt,rawList):
+
+    tag,sample,sp,isSignal,isSyst=proc
+    xsec=sample[0]
+    isData=sample[1]
+    keyIsSyst=False
+    histos = []
+    obj=fIn.Get(key)
+    if obj.InheritsFrom('TH2') and key[-5:]=='_syst':
+        keyIsSyst=True
+        for ybin in xrange(1,obj.GetNbinsY()+1):
+            for xbin in xrange(0,obj.GetNbinsX()+2):
+                if math.isnan(obj.GetBinContent(xbin, ybin)):
+                    obj.SetBinContent(xbin, ybin, 0)
+                    obj.SetBinError(xbin, ybin, 0)
+            weighthist = obj.ProjectionX('_px'+str(ybin), ybin, ybin)
+            weighthist.SetTitle(sp[1]+' weight '+str(ybin))                                  
+            if (weighthist.Integral() > 0): histos.append(weighthist)
+    else:
+        histos.append(obj)
+        histos[-1].SetTitle(sp[1])
+
+    for hist in histos:
+        if "vbfmva" in hist.GetName() and isData and opt.blined:
+            tmpBin = hist.GetXaxis().FindBin(0.2)
+            for iBin in range(tmpBin,hist.GetXaxis().GetNbins()):
+                hist.SetBinContent(iBin, 0.0000001)
+
+        #scale by xsec, lumi and the special scale factors
+        if not isData and not '(data)' in sp[1]: 
+            if not opt.rawYields and not tag in rawList:
+                hist.Scale(xsec*lumi*puNormSF*sfVal)       
+
+        #rebin if needed
+        if opt.rebin>1:  hist.Rebin(opt.rebin)
+
+    return histos,keyIsSyst
+
+"""
+reads, scales and adds to a plot the histograms from the different processes
+entries is the list of (process index,key) to read, returns the plot (None if nothing was added) and the report lines
+if cacheDir is given the scaled histograms are read from/stored in the cache
+"""
+def fillPlot(pname,entries,procList,procFiles,opt,lumiSpecs,procSF,rawList,cacheDir=None):
+
+    plot=None
+    report={}
+    cache=ScaledHistoCache(cacheDir,pname) if cacheDir else None
+    if cache and not cache.isOpen(): cache=None
+    for iproc,key in entries:
+        tag,sample,sp,isSignal,isSyst=procList[iproc]
+        pkey=key[:-5] if key[-5:]=='_syst' else key
+        try:
+
+            #check if a special scale factor needs to be applied
+            sfVal=1.0                                                 
+            for procToScale in procSF:
+                if sp[1]==procToScale:                                        
+                    for pcat in procSF[procToScale]:                                    
+                        if pcat not in pkey: continue
+                        sfVal=procSF[procToScale][pcat][0]
+                        break
+
+            #lumi to scale to
+            lumi=opt.lumi
+            for lSpec in lumiSpecs:                                    
+                if not lSpec in pkey.split('_'): continue
+                lumi=lumiSpecs[lSpec]
+                break
+
+            #read from the cache or from the original file
+            result=None
+            if cache:
+                cacheName='%s:%s'%(sp[0],key)
+                stamp=procFiles.getStamp(iproc)
+                scaleKey=[sample[0],sample[1],sp[1],lumi,sfVal,opt.puNormSF,tag in rawList,opt.rawYields,opt.rebin,opt.blined]
+                result=cache.get(cacheName,stamp,scaleKey,sp[1])
+            if result is None:
+                procFile=procFiles.get(iproc)
+                if procFile is None: continue
+                fIn,puNormSF=procFile
+                histos,keyIsSyst=readScaledHistos(fIn,key,puNormSF,sfVal,lumi,procList[iproc],opt,rawList)
+                procReport=procFiles.report.get(iproc,'')
+                if cache: cache.put(cacheName,stamp,scaleKey,sp[1],histos,keyIsSyst,procReport)
+            else:
+                histos,keyIsSyst,procReport=result
+            if procReport : report[iproc]=procReport
+
+            for hist in histos:
+
+                #create new plot if needed
+                if plot is None:
+                    plot=Plot(pname,com=opt.com)
+                    plot.ratiorange=opt.ratioRange
+
+                #add process to plot
+                plot.add(h=hist,
+                         title=hist.GetTitle(),
+                         color=sp[2],
+                         isData=sample[1],
+                         spImpose=isSignal,
+                         isSyst=(isSyst or keyIsSyst),
+                         doDivideByBinWidth=opt.binWid)
+
+        except Exception as e:
+            print e
+            pass
+
+    if cache : cache.close()
+    return plot,report
+
+"""
+renders a list of plots, one at a time (read, draw, write and free the memory)
+all the plots are written through a single open output file, returns the lines of the report
+"""
+def renderPlots(args):
+
+    plotList,procList,opt,lumiSpecs,procSF,rawList,outDir,outURL,outMode=args
+
+    procFiles=ProcFileReader(procList,opt,rawList)
+    cacheDir=os.path.join(opt.inDir,PLOTCACHEDIR) if opt.cache else None
+
+    report={}
+    outF=ROOT.TFile.Open(outURL,outMode)
+    for p,entries in plotList:
+        plot,plotReport=fillPlot(p,entries,procList,procFiles,opt,lumiSpecs,procSF,rawList,cacheDir)
+        report.update(plotReport)
+        if plot is None: continue
+        plot.mcUnc=opt.mcUnc
+        if opt.saveLog    : plot.savelog=True
+        skipPlot=False
+        if opt.onlyData and plot.dataH is None: skipPlot=True 
+        if opt.silent : skipPlot=True
+        lumi=opt.lumi
+        for lSpec in lumiSpecs:
+            if not lSpec in p.split('_'): continue
+            lumi=lumiSpecs[lSpec]
+            break
+
+        #continue
+        if opt.normToData: plot.normToData()
+        if not skipPlot: plot.show(outDir=outDir,lumi=lumi,noStack=opt.noStack,saveTeX=opt.saveTeX)
+        plot.writeTo(outF)
+        plot.reset()
+
+        #free the histograms which were read but not kept by the plot
+        procFiles.freeMemory(set([i for i,_ in entries]))
+    outF.Close()
+    procFiles.close()
+
+    return [report[iproc] for iproc in sorted(report)]
+
+"""
+copies the plots stored in several files to the output file (the input files are removed)
+"""
+def mergePlotFiles(outURL,inURLs):
+
+    outF=ROOT.TFile.Open(outURL,'UPDATE')
+    for url in inURLs:
+        fIn=ROOT.TFile.Open(url)
+        for tdir in fIn.GetListOfKeys():
+            pname=tdir.GetName()
+            pdir=fIn.Get(pname)
+            if not outF.cd(pname):
+                outF.mkdir(pname).cd()
+            for tkey in pdir.GetListOfKeys():
+                obj=pdir.Get(tkey.GetName())
+                obj.Write(tkey.GetName(),ROOT.TObject.kOverwrite)
+                obj.Delete()
+        fIn.Close()
+        os.remove(url)
+    outF.Close()
+
 """
 steer the script
 """
@@ -42,6 +408,8 @@ def main():
     parser.add_option(      '--skip',        dest='skip',        help='skip these samples (csv)',       default='MC13TeV_TTJets_cflip',                type='string')
     parser.add_option(      '--rawList',     dest='rawList',     help='don\'t scale these samples',     default='',                type='string')
     parser.add_option(      '--puNormSF',    dest='puNormSF',    help='Use this histogram to correct pu weight normalization', default=None, type='string')
+    parser.add_option(      '--cache',       dest='cache',       help='keep the scaled histograms in a cache in the input directory, re-read only what changed [%default]', default=False, action='store_true')
+    parser.add_option(      '--njobs',       dest='njobs',       help='number of processes to use to render the plots [%default]', default=1, type=int)
     parser.add_option(      '--procSF',      dest='procSF',      help='Use this to scale a given process component e.g. "W":.wjetscalefactors.pck,"DY":dyscalefactors.pck', default=None, type='string')
     (opt, args) = parser.parse_args()
 
@@ -111,10 +479,8 @@ def main():
     onlyList=opt.only.split(',')
     rawList=opt.rawList.split(',')
 
-    #read plots 
-    plots=OrderedDict()
-
-    report=''
+    #list the processes to read
+    procList=[]
     for slist,isSignal,isSyst in [ (samplesList,False,False),(signalSamplesList,True,False),(systSamplesList,False,True) ]:
         if slist is None: continue
         for tag,sample in slist:
@@ -131,8 +497,6 @@ def main():
             if skip:
                 print("SKIPPED "+tag)
                 continue
-            xsec=sample[0]
-            isData=sample[1]
             doFlavourSplitting=sample[6]
             subProcs=[(tag,sample[3],sample[4])]
             if doFlavourSplitting:
@@ -140,112 +504,21 @@ def main():
                 for flav in [(1,sample[3]+'+l'),(4,sample[3]+'+c'),(5,sample[3]+'+b',sample[4])]:
                     subProcs.append(('%d_%s'%(flav[0],tag),flav[1],sample[4]+3*len(subProcs)))
             for sp in subProcs:
-                print '%s/%s.root' % ( opt.inDir, sp[0]) 
-                fIn=ROOT.TFile.Open('%s/%s.root' % ( opt.inDir, sp[0]) )
-                if not fIn : continue
-
-                #fix pileup weighting normalization
-                puNormSF=1
-                if opt.puNormSF and not isData:
-                    puCorrH=fIn.Get(opt.puNormSF)
-                    if tag not in rawList:
-                        try:
-                            nonWgt=puCorrH.GetBinContent(1)
-                            wgt=puCorrH.GetBinContent(2)
-                            if wgt>0 :
-                                puNormSF=nonWgt/wgt
-                                if puNormSF>1.3 or puNormSF<0.7 : 
-                                    puNormSF=1
-                                    report += '%s wasn\'t be scaled as too large SF was found (probably low stats)\n' % sp[0]
-                                else :
-                                    report += '%s was scaled by %3.3f for pileup normalization\n' % (sp[0],puNormSF)
-                        except:
-                            print 'Check pu weight control histo',opt.puNormSF,'for',sp[0]
-
-                for tkey in fIn.GetListOfKeys():
-                    keyIsSyst=False
-                    try:
-                        key=tkey.GetName()
-
-                        #filter plots using a selection list
-                        keep=False if len(onlyList)>0 else True
-                        for pname in onlyList:
-                            if opt.strictOnly and pname!=key: continue
-                            if not opt.strictOnly and not pname in key: continue
-                            keep=True
-                            break
-                        if not keep: continue
-                        histos = []
-                        obj=fIn.Get(key)
-                        if obj.InheritsFrom('TH2'):
-                            if key[-5:]=='_syst':
-                                if sample[3]=='t#bar{t}':
-                                    keyIsSyst=True
-                                    key = key[:-5]
-                                    for ybin in xrange(1,obj.GetNbinsY()+1):
-                                        for xbin in xrange(0,obj.GetNbinsX()+2):
-                                            if math.isnan(obj.GetBinContent(xbin, ybin)):
-                                                obj.SetBinContent(xbin, ybin, 0)
-                                                obj.SetBinError(xbin, ybin, 0)
-                                        weighthist = obj.ProjectionX('_px'+str(ybin), ybin, ybin)
-                                        weighthist.SetTitle(sp[1]+' weight '+str(ybin))                                  
-                                        weighthist.Draw()
-                                        if (weighthist.Integral() > 0): histos.append(weighthist)
-                                else:
-                                    continue
-                            else:
-                                histos.append(obj)
-                                histos[-1].SetTitle(sp[1])
-                        else:
-                            histos.append(obj)
-                            histos[-1].SetTitle(sp[1])
-
-                        for hist in histos:
-                            if "vbfmva" in hist.GetName() and isData and opt.blined:
-                                tmpBin = hist.GetXaxis().FindBin(0.2)
-                                for iBin in range(tmpBin,hist.GetXaxis().GetNbins()):
-                                    hist.SetBinContent(iBin, 0.0000001)
-                                
-                            if not isData and not '(data)' in sp[1]: 
-
-                                #check if a special scale factor needs to be applied
-                                sfVal=1.0                                                 
-                                for procToScale in procSF:
-                                    if sp[1]==procToScale:                                        
-                                        for pcat in procSF[procToScale]:                                    
-                                            if pcat not in key: continue
-                                            sfVal=procSF[procToScale][pcat][0]
-                                            break
-
-                                #scale by lumi
-                                lumi=opt.lumi
-                                for lSpec in lumiSpecs:                                    
-                                    if not lSpec in key.split('_'): continue
-                                    lumi=lumiSpecs[lSpec]
-                                    break
-                                if not opt.rawYields and not tag in rawList:
-                                    hist.Scale(xsec*lumi*puNormSF*sfVal)       
-             
-                            #rebin if needed
-                            if opt.rebin>1:  hist.Rebin(opt.rebin)
-
-                            #create new plot if needed
-                            if not key in plots : 
-                                plots[key]=Plot(key,com=opt.com)
-                                plots[key].ratiorange=opt.ratioRange
-
-                            #add process to plot
-                            plots[key].add(h=hist,
-                                           title=hist.GetTitle(),
-                                           color=sp[2],
-                                           isData=sample[1],
-                                           spImpose=isSignal,
-                                           isSyst=(isSyst or keyIsSyst),
-                                           doDivideByBinWidth=opt.binWid)
-                            
-                    except Exception as e:
-                        print e
-                        pass
+                procList.append( (tag,sample,sp,isSignal,isSyst) )
+
+    #index the histograms in the files and select the ones to plot before reading them
+    keyIndex=getKeyIndex(opt.inDir,['%s.root'%proc[2][0] for proc in procList])
+    plotIndex=OrderedDict()
+    for iproc,(tag,sample,sp,isSignal,isSyst) in enumerate(procList):
+        for key,cls in keyIndex.get('%s.root'%sp[0],[]):
+            if not isSelectedKey(key,onlyList,opt.strictOnly) : continue
+            if not inheritsFrom(cls,'TH1') : continue
+            pname=key
+            if inheritsFrom(cls,'TH2') and key[-5:]=='_syst':
+                if sample[3]!='t#bar{t}': continue
+                pname=key[:-5]
+            plotIndex.setdefault(pname,[]).append( (iproc,key) )
+    print '%d plots to be produced'%len(plotIndex)
 
     #show plots
     ROOT.gStyle.SetOptTitle(0)
@@ -255,23 +528,29 @@ def main():
     else:                outDir = opt.outDir
     os.system('mkdir -p %s' % outDir)
     os.system('rm %s/%s'%(outDir,opt.outName))
-    for p in plots:
-        plots[p].mcUnc=opt.mcUnc
-        if opt.saveLog    : plots[p].savelog=True
-        skipPlot=False
-        if opt.onlyData and plots[p].dataH is None: skipPlot=True 
-        if opt.silent : skipPlot=True
-        lumi=opt.lumi
-        for lSpec in lumiSpecs:
-            if not lSpec in p.split('_'): continue
-            lumi=lumiSpecs[lSpec]
-            break
+    outURL='%s/../%s'%(outDir,opt.outName)
+    plotList=plotIndex.items()
+    if opt.njobs>1 and len(plotList)>1:
 
-        #continue
-        if opt.normToData: plots[p].normToData()
-        if not skipPlot: plots[p].show(outDir=outDir,lumi=lumi,noStack=opt.noStack,saveTeX=opt.saveTeX)
-        plots[p].appendTo('%s/../%s'%(outDir,opt.outName))
-        plots[p].reset()
+        #each worker renders a subset of the plots and writes them to its own file
+        njobs=min(opt.njobs,len(plotList))
+        workerURLs=['%s/%s_worker%d.root'%(outDir,os.path.splitext(opt.outName)[0],i) for i in xrange(0,njobs)]
+        tasks=[(plotList[i::njobs],procList,opt,lumiSpecs,procSF,rawList,outDir,workerURLs[i],'RECREATE') for i in xrange(0,njobs)]
+        pool=Pool(njobs)
+        try:
+            reports=pool.map(renderPlots,tasks)
+            pool.close()
+            pool.join()
+            mergePlotFiles(outURL,workerURLs)
+        finally:
+            pool.terminate()
+            for url in workerURLs:
+                if os.path.isfile(url): os.remove(url)
+
+    else:
+        reports=[renderPlots( (plotList,procList,opt,lumiSpecs,procSF,rawList,outDir,outURL,'UPDATE') )]
+
+    report=''.join(OrderedDict.fromkeys([line for r in reports for line in r]).keys())
 
     print '-'*50
     print 'Plots and summary ROOT file can be found in %s' % outDir
@@ -3,9 +3,110 @@
 import optparse
 import os,sys
 import math
+import pickle
 import ROOT
+import numpy as np
+from multiprocessing import Pool
 from subprocess import Popen, PIPE
 
+"""
+converts a histogram to a picklable summary (class, title, bin edges, contents and sum of squared weights)
+"""
+def getHistoSummary(h):
+    axis=h.GetXaxis()
+    edges=[axis.GetBinLowEdge(xbin) for xbin in xrange(1,h.GetNbinsX()+2)]
+    contents=np.array([h.GetBinContent(xbin) for xbin in xrange(0,h.GetNbinsX()+2)])
+    sumw2=np.array([h.GetBinError(xbin)**2 for xbin in xrange(0,h.GetNbinsX()+2)])
+    return [h.ClassName(),h.GetTitle(),edges,contents,sumw2]
+
+"""
+builds back a histogram from its summary
+"""
+def getHistoFromSummary(name,summary):
+    cls,title,edges,contents,sumw2=summary
+    h=getattr(ROOT,cls)(name,title,len(edges)-1,np.array(edges,dtype=np.float64))
+    h.SetDirectory(0)
+    for xbin in xrange(0,len(contents)):
+        h.SetBinContent(xbin,contents[xbin])
+        h.SetBinError(xbin,math.sqrt(sumw2[xbin]))
+    h.SetEntries(contents.sum())
+    return h
+
+"""
+adds two histogram summaries
+"""
+def addHistoSummaries(a,b):
+    if b is None : return a
+    if a is None : return [b[0],b[1],b[2],b[3].copy(),b[4].copy()]
+    a[3]+=b[3]
+    a[4]+=b[4]
+    return a
+
+"""
+sums the generator level weights of a HiForest tree
+(the weights of each event are added in the bin corresponding to their index, events without weights count as 1 in the first bin)
+"""
+def getHiForestWeights(fIn,nbins=1500):
+    from root_numpy import tree2array
+    hiTree=fIn.Get('hiEvtAnalyzer/HiTree')
+    contents=np.zeros(nbins+2)
+    sumw2=np.zeros(nbins+2)
+    try:
+        ttbar_w=tree2array(hiTree,branches=['ttbar_w'])['ttbar_w']
+        nwgts=np.array([len(w) for w in ttbar_w],dtype=np.int64)
+    except Exception:
+        ttbar_w,nwgts=[],np.zeros(hiTree.GetEntriesFast(),dtype=np.int64)
+
+    #simple counts
+    contents[1]+=np.sum(nwgts==0)
+    sumw2[1]+=np.sum(nwgts==0)
+
+    #weights (the index beyond the last bin goes to the overflow)
+    if nwgts.sum()>0:
+        w=np.concatenate([np.asarray(x,dtype=np.float64) for x in ttbar_w if len(x)>0])
+        idx=np.minimum(np.concatenate([np.arange(n) for n in nwgts if n>0])+1,nbins+1)
+        contents+=np.bincount(idx,weights=w,minlength=nbins+2)
+        sumw2+=np.bincount(idx,weights=w**2,minlength=nbins+2)
+
+    return ['TH1F','genwgts',range(0,nbins+1),contents,sumw2]
+
+"""
+computes the partial sums of weights and the pileup distribution for a single file
+returns (sample,file,partial sums) where the partial sums are None if the file can't be read
+"""
+def getFileWeights(args):
+
+    sample,url,HiForest=args
+    partial=None
+    try:
+        fIn=ROOT.TFile.Open(url)
+        if not HiForest:
+            px=fIn.Get('analysis/fidcounter').ProjectionX('px',1,1)
+            labelH=fIn.Get('analysis/generator_initrwgt')
+            labels=[labelH.GetXaxis().GetBinLabel(xbin) for xbin in xrange(1,labelH.GetNbinsX()+1)] if labelH else None
+            partial={'genwgts':getHistoSummary(px),
+                     'putrue':getHistoSummary(fIn.Get('analysis/putrue')),
+                     'labels':labels}
+            px.Delete()
+        else:
+            partial={'genwgts':getHiForestWeights(fIn),
+                     'putrue':None,
+                     'labels':None}
+        fIn.Close()
+    except Exception:
+        print 'Failed to get weights for',url
+    return sample,url,partial
+
+"""
+file stamp used to check if the partial sums of a file can be re-used
+"""
+def getFileStamp(url):
+    try:
+        st=os.stat(url)
+        return (st.st_size,st.st_mtime)
+    except OSError:
+        return None
+
 """
 steer the script
 """
@@ -16,7 +117,9 @@ def main():
     parser = optparse.OptionParser(usage)
     parser.add_option('-i', '--inDir',       dest='inDir',       help='input directory with files',   default='/store/cmst3/user/psilva/LJets2015/5736a2c',        type='string')
     parser.add_option(      '--HiForest',    dest='HiForest',    help='flag if these are HiForest',   default=False, action='store_true')
-    parser.add_option(      '--update',      dest='update',      help='update current weight cache',   default=False, action='store_true')
+    parser.add_option(      '--update',      dest='update',      help='update current weight cache (only new or modified files are read if the partial sums were stored)',   default=False, action='store_true')
+    parser.add_option(      '--partialCache',dest='partialCache',help='cache with the partial sums of each file, only stored with --update or if this option is given [<output>_partial.pck]',   default=None, type='string')
+    parser.add_option('-j', '--njobs',       dest='njobs',       help='number of files to read in parallel [%default]',   default=8, type=int)
     #parser.add_option(      '--mount',       dest='mount',       help='mount eos locally',   default=False, action='store_true')
     parser.add_option('-o', '--output',      dest='cache',       help='output file',                  default='data/era2016/genweights.root',                      type='string')
     (opt, args) = parser.parse_args()
@@ -27,66 +130,69 @@ def main():
     #    baseEOS='eos/cms'
     #    Popen([eos_cmd, ' -b fuse mount', 'eos'],stdout=PIPE).communicate()
 
-    #loop over samples available
+    #partial sums of each file from a previous run (only used when updating)
+    storePartialCache = opt.update or opt.partialCache is not None
+    if opt.partialCache is None: opt.partialCache=os.path.splitext(opt.cache)[0]+'_partial.pck'
+    partialCache={}
+    if opt.update and os.path.isfile(opt.partialCache):
+        with open(opt.partialCache,'r') as cache:
+            partialCache=pickle.load(cache)
+        print 'Partial sums for %d files read from %s'%(len(partialCache),opt.partialCache)
+
+    #list the files to read
+    fileList={}
+    tasks=[]
+    for sample in os.listdir('/eos/cms/%s' % opt.inDir):
+        fileList[sample]=[]
+        for f in sorted(os.listdir('/eos/cms/%s/%s' % (opt.inDir,sample ) )):
+            url='%s/%s/%s/%s' % (baseEOS,opt.inDir,sample,f )
+            stamp=getFileStamp('/eos/cms/%s/%s/%s' % (opt.inDir,sample,f))
+            fileList[sample].append(url)
+            if url in partialCache and partialCache[url][0]==stamp and partialCache[url][1] is not None: continue
+            partialCache[url]=(stamp,None)
+            tasks.append( (sample,url,opt.HiForest) )
+
+    #read the files in parallel
+    print 'Reading %d files'%len(tasks)
+    if opt.njobs>1 and len(tasks)>1:
+        pool=Pool(opt.njobs)
+        results=pool.imap_unordered(getFileWeights,tasks)
+    else:
+        pool=None
+        results=(getFileWeights(t) for t in tasks)
+    for sample,url,partial in results:
+        partialCache[url]=(partialCache[url][0],partial)
+    if pool:
+        pool.close()
+        pool.join()
+
+    #store the partial sums for future updates
+    if storePartialCache:
+        with open(opt.partialCache,'w') as cache:
+            pickle.dump(partialCache,cache,pickle.HIGHEST_PROTOCOL)
+
+    #sum weight generator level weights
     genweights={}
     puprofile={}
-    for sample in os.listdir('/eos/cms/%s' % opt.inDir):
+    for sample in fileList:
 
-        #sum weight generator level weights
         wgtCounter=None
         putrue=None
-        labelH=None
-        for f in os.listdir('/eos/cms/%s/%s' % (opt.inDir,sample ) ):
-            
-            try:
-                fIn=ROOT.TFile.Open('%s/%s/%s/%s' % (baseEOS,opt.inDir,sample,f ) )
-                if not opt.HiForest:
-                    if wgtCounter is None:
-                        try:
-                            wgtCounter=fIn.Get('analysis/fidcounter').ProjectionX('genwgts',1,1)
-                            wgtCounter.SetDirectory(0)
-                            wgtCounter.Reset('ICE')
-                            
-                            putrue=fIn.Get('analysis/putrue').Clone()
-                            putrue.SetDirectory(0)
-                            putrue.Reset('ICE')                            
-
-                        except:
-                            print 'Check %s/%s/%s/%s probably corrupted?' % (baseEOS,opt.inDir,sample,f )
-                            continue
-                    
-                    labelH=fIn.Get('analysis/generator_initrwgt')
-                    if labelH : labelH.SetDirectory(0)                             
-                    try:
-                        px=fIn.Get('analysis/fidcounter').ProjectionX('px',1,1)
-                        wgtCounter.Add(px)
-                        px.Delete()
-                        putrue.Add( fIn.Get('analysis/putrue') )
-                    except:
-                        print 'Check eos/cms/%s/%s/%s probably corrupted?' % (opt.inDir,sample,f )
-                        continue
-                else:
-                    if wgtCounter is None:
-                        wgtCounter=ROOT.TH1F('genwgts','genwgts',1500,0,1500)
-                        wgtCounter.SetDirectory(0)
-                    hiTree=fIn.Get('hiEvtAnalyzer/HiTree')
-                    for i in xrange(0,hiTree.GetEntriesFast()):
-                        hiTree.GetEntry(i)
-                        try:
-                            ttbar_w=getattr(hiTree,'ttbar_w')
-                            for ibin in xrange(0,ttbar_w.size()):
-                                wgtCounter.Fill(ibin,ttbar_w[ibin])
-                            if ttbar_w.size()==0: raise ValueError('simple count required')
-                        except:
-                            wgtCounter.Fill(0,1)
-                fIn.Close()
-            except:
-                print 'Failed to get weights for','%s/%s/%s/%s' % (baseEOS,opt.inDir,sample,f )
+        labels=None
+        for url in fileList[sample]:
+            partial=partialCache[url][1]
+            if partial is None:
+                print 'Check %s probably corrupted?' % url
+                continue
+            wgtCounter=addHistoSummaries(wgtCounter,partial['genwgts'])
+            putrue=addHistoSummaries(putrue,partial['putrue'])
+            if partial['labels'] : labels=partial['labels']
 
         if wgtCounter is None: continue
-        if labelH:
-            for xbin in range(1,wgtCounter.GetNbinsX()+1):
-                label=labelH.GetXaxis().GetBinLabel(xbin)
+        wgtCounter=getHistoFromSummary('genwgts',wgtCounter)
+        if labels:
+            for xbin in range(1,min(len(labels),wgtCounter.GetNbinsX())+1):
+                label=labels[xbin-1]
                 for tkn in ['<','>',' ','\"','/','weight','=','\n']: label=label.replace(tkn,'')
                 wgtCounter.GetXaxis().SetBinLabel(xbin,label)
 
@@ -100,8 +206,11 @@ def main():
             wgtCounter.SetBinError(xbin,0.)
             
         #normalize pudistribution
-        totalEvts=putrue.Integral(0,putrue.GetNbinsX()+1)
-        if totalEvts>0: putrue.Scale(1./totalEvts)
+        totalEvts=0
+        if putrue is not None:
+            putrue=getHistoFromSummary('putrue',putrue)
+            totalEvts=putrue.Integral(0,putrue.GetNbinsX()+1)
+            if totalEvts>0: putrue.Scale(1./totalEvts)
 
         if wgtCounter.GetBinContent(1)==0 and totalEvts>0:
             print '[Warning] fidcounter seems to have the countings at 0'
@@ -115,9 +224,10 @@ def main():
     cachefile=ROOT.TFile.Open(opt.cache,'UPDATE' if opt.update else 'RECREATE')
     for sample in genweights:
         genweights[sample].SetDirectory(cachefile)
-        genweights[sample].Write(sample)
+        genweights[sample].Write(sample,ROOT.TObject.kOverwrite)
+        if puprofile[sample] is None: continue
         puprofile[sample].SetDirectory(cachefile)
-        puprofile[sample].Write(sample+'_pu')
+        puprofile[sample].Write(sample+'_pu',ROOT.TObject.kOverwrite)
     cachefile.Close()
     print 'Produced normalization cache @ %s'%opt.cache
 
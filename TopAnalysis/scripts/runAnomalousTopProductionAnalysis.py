@@ -8,6 +8,7 @@ import numpy
 import array
 from TopLJets2015.TopAnalysis.storeTools import getEOSlslist
 from TopLJets2015.TopAnalysis.nuSolutions import *
+from TopLJets2015.TopAnalysis.eventShapeTools import toPaddedArray
 
 """
 a dummy converter
@@ -50,69 +51,251 @@ def topRadiusFilter(tree,filtArgs):
     return filtArgs[0].GetBinContent(xbin)
 
 
+CHUNKSIZE=5000
+TWEVBRANCHES=['cat','weight','nl','l_pt','l_eta','l_phi','l_m',
+              'nj','j_pt','j_eta','j_phi','j_m','j_btag','met_pt','met_phi',
+              'nt','t_pt','t_eta','t_phi','t_m','t_id']
+
 """
-Analysis loop
+pads a variable-size (object) or fixed-size (2D) array branch to an (N,max) array with at least one column
+returns the padded array and the mask of the first counts entries filled
 """
-def runAnomalousTopProductionAnalysis(fileName,outFileName,filterName):
-        
-    print '....analysing',fileName,'with output @',outFileName
+def getPaddedArray(col,counts):
+    if col.dtype==object:
+        lens=numpy.array([len(c) for c in col],dtype=numpy.int64)
+        flat=numpy.concatenate(list(col)) if lens.sum()>0 else numpy.zeros(0)
+    else:
+        col=col.reshape(len(col),-1)
+        lens=numpy.full(len(col),col.shape[1],dtype=numpy.int64)
+        flat=col.reshape(-1)
+    padded,mask=toPaddedArray(flat,lens)
+    if padded.shape[1]==0:
+        padded,mask=numpy.zeros((len(col),1),dtype=padded.dtype),numpy.zeros((len(col),1),dtype=bool)
+    mask&=numpy.arange(padded.shape[1])[numpy.newaxis,:]<numpy.asarray(counts)[:,numpy.newaxis]
+    return padded,mask
 
-    fOut=ROOT.TFile.Open(outFileName,'RECREATE')
-    fOut.cd()
-    ntuple = ROOT.TNtuple("data","data","b1pt:b1eta:b1phi:b2pt:b2eta:b2phi:l1pt:l1eta:l1phi:l2pt:l2eta:l2phi:metx:mety:nj:ptest1:ptest2:ptgen")
+"""
+indices of the first n selected entries in each row of a mask and the number found (up to n)
+"""
+def getFirstSelected(sel,n=2):
+    rank=numpy.cumsum(sel,axis=1)-1
+    idx=numpy.stack([numpy.argmax(sel & (rank==k),axis=1) for k in xrange(0,n)],axis=1)
+    return idx,numpy.minimum(sel.sum(axis=1),n)
 
-    #book histograms
-    observablesH={}
-    for k in ['emu','ll']:
-        observablesH['ht_'+k]=ROOT.TH1F('ht_'+k,';H_{T} [GeV];Events',20,0,1000)
+"""
+picks the entries idx of each row of a padded array
+"""
+def takeEntries(arr,idx):
+    return arr[numpy.arange(len(arr))[:,numpy.newaxis],idx]
 
-        observablesH['dphibb_'+k]=ROOT.TH1F('dphibb_'+k,';#Delta#phi(b,#bar{b}) [rad];Events',20,0,3.15)
-        observablesH['cosbstar_'+k]=ROOT.TH1F('cosbstar_'+k,';cos(#theta*_{b});Events',20,-1,1)
-        observablesH['cosbstarprod_'+k]=ROOT.TH1F('cosbstarprod_'+k,';cos(#theta*_{b_{1}})cos(#theta*_{b_{2}});Events',20,-1,1)
+"""
+reads the pt,eta,phi,m branches of a collection (prefix) to padded arrays, returns them and the mask
+"""
+def getCollectionArrays(ev,prefix,counter):
+    coll={}
+    for v in ['pt','eta','phi','m']:
+        coll[v],mask=getPaddedArray(ev[prefix+v],ev[counter])
+    return coll,mask
 
-        observablesH['dphill_'+k]=ROOT.TH1F('dphill_'+k,';#Delta#phi(l,l) [rad];Events',20,0,3.15)
-        observablesH['coslstar_'+k]=ROOT.TH1F('coslstar_'+k,';cos(#theta*_{l});Events',20,-1,1)
-        observablesH['coslstarprod_'+k]=ROOT.TH1F('coslstarprod_'+k,';cos(#theta*_{l_{1}})cos(#theta*_{l_{2}});Events',20,-1,1)
+"""
+(N,k,4) arrays of [px,py,pz,E] for the entries idx of a collection
+"""
+def getP4Arrays(coll,idx):
+    return p4FromPtEtaPhiM(*[takeEntries(coll[v],idx) for v in ['pt','eta','phi','m']])
 
-        observablesH['dphijj_'+k]=ROOT.TH1F('dphijj_'+k,';#Delta#phi(j,j) [rad];Events',20,0,3.15)
-    for var in observablesH:
-        observablesH[var].SetDirectory(0)
-        observablesH[var].Sumw2()
+"""
+same as ROOT.Math.VectorUtil.DeltaPhi for arrays
+"""
+def deltaPhiArrays(phi1,phi2):
+    dphi=phi2-phi1
+    dphi=numpy.where(dphi>numpy.pi,dphi-2*numpy.pi,dphi)
+    return numpy.where(dphi<=-numpy.pi,dphi+2*numpy.pi,dphi)
 
+"""
+pt of arrays of [px,py,pz,E]
+"""
+def ptArray(p4):
+    return numpy.hypot(p4[...,0],p4[...,1])
 
-    #open file
-    puNormSF=1.0
-    if 'MC13TeV' in fileName:
-        fIn=ROOT.TFile.Open(fileName)
-        puCorrH=fIn.Get('puwgtctr')
-        nonWgt=puCorrH.GetBinContent(1)
-        wgt=puCorrH.GetBinContent(2)
-        if wgt>0 : puNormSF=nonWgt/wgt
-        fIn.Close()
-    tree=ROOT.TChain('twev')
-    tree.AddFile(fileName)
+"""
+cosine of the angle between a particle boosted to the rest frame of the top and the top direction
+(same as cos(Angle(boost(p4,top.BoostToCM()),top)) for arrays)
+"""
+def cosThetaStarArrays(p4,top):
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        beta=-top[:,:3]/top[:,3:4]
+        b2=(beta**2).sum(axis=1)
+        gamma=1./numpy.sqrt(1.-b2)
+        bp=(beta*p4[:,:3]).sum(axis=1)
+        gamma2=numpy.where(b2>0,(gamma-1.)/b2,0.)
+        p3=p4[:,:3]+(gamma2*bp+gamma*p4[:,3])[:,numpy.newaxis]*beta
+        ptot2=(p3**2).sum(axis=1)*(top[:,:3]**2).sum(axis=1)
+        arg=numpy.clip((p3*top[:,:3]).sum(axis=1)/numpy.sqrt(ptot2),-1.,1.)
+    return numpy.where(ptot2>0,arg,1.)
 
-    #if some filtering has to be applied, specialize it
-    filtFunc,filtArgs,filtNormRwgt=None,None,1.0
-    if filterName:
-        filtFunc,filtArgsList=filterName.split('=')
-        if filtFunc=='topRadiusFilter':
-            args=filtArgsList.split(',')
-            bsmUrl,smUrl,distName=args
+"""
+contents of the bins of a histogram where the values fall (same as GetBinContent(FindBin(x)) for arrays)
+"""
+def getBinContentArrays(h,x):
+    nbins=h.GetNbinsX()
+    edges=numpy.array([h.GetXaxis().GetBinLowEdge(xbin) for xbin in xrange(1,nbins+2)])
+    contents=numpy.array([h.GetBinContent(xbin) for xbin in xrange(0,nbins+2)])
+    return contents[numpy.searchsorted(edges,x,side='right')]
 
-            #get the target distribution
-            bsmFile=ROOT.TFile.Open(bsmUrl)
-            weightH=bsmFile.Get(distName)
-            weightH.SetDirectory(0)
-            bsmFile.Close()
+"""
+top radius filter for the arrays of a chunk of events (see topRadiusFilter)
+"""
+def topRadiusFilterArrays(ev,filtArgs):
 
-            #get the SM distribution 
-            smFile=ROOT.TFile.Open(smUrl)
-            weightH.Divide(smFile.Get(distName))
-            smFile.Close()
-            filtArgs=[weightH]
+    nev=len(ev)
+    if len(filtArgs)==0 : return numpy.ones(nev)
+    if filtArgs[0] is None : return numpy.ones(nev)
+
+    #angle between ll in laboratory frame
+    t_id,tMask=getPaddedArray(ev['t_id'],ev['nt'])
+    t_phi,_=getPaddedArray(ev['t_phi'],ev['nt'])
+    isLep=tMask & ((numpy.abs(t_id)==11) | (numpy.abs(t_id)==13))
+    idx,nlep=getFirstSelected(isLep,2)
+    phi=takeEntries(t_phi,idx).astype(numpy.float64)
+    dphill=numpy.abs(deltaPhiArrays(phi[:,0],phi[:,1]))
+
+    return numpy.where(nlep>=2,getBinContentArrays(filtArgs[0],dphill),1.0)
+
+"""
+fills a histogram with arrays of values and weights
+"""
+def fillArrays(h,vals,wgts):
+    if len(vals)==0 : return
+    h.FillN(len(vals),numpy.ascontiguousarray(vals,dtype=numpy.float64),numpy.ascontiguousarray(wgts,dtype=numpy.float64))
+
+"""
+columnar version of the event loop: the branches are read in chunks to numpy arrays, the objects are selected with masks,
+the neutrino kinematics is solved for all the events of a chunk at once and the histograms are filled in bulk
+"""
+def runColumnarAnalysis(tree,observablesH,ntuple,puNormSF,filtFunc,filtArgs,filtNormRwgt,chunkSize=CHUNKSIZE):
+
+    from root_numpy import tree2array
+
+    totalEntries=tree.GetEntries()
+    for start in xrange(0,totalEntries,chunkSize):
+
+        sys.stdout.write('\r [ %d/100 ] done' %(int(float(100.*start)/float(totalEntries))) )
+        ev=tree2array(tree,branches=TWEVBRANCHES,start=start,stop=min(start+chunkSize,totalEntries))
+        nev=len(ev)
+        if nev==0 : continue
+
+        filtWeight=numpy.ones(nev)
+        if filtFunc and filtArgs:
+            filtWeight=globals()[filtFunc+'Arrays'](ev,filtArgs)
+
+        #leptons
+        leptons,lMask=getCollectionArrays(ev,'l_','nl')
+
+        #b-jets are the first two b-tagged jets, all the others are kept as other jets
+        jets,jMask=getCollectionArrays(ev,'j_','nj')
+        j_btag,_=getPaddedArray(ev['j_btag'],ev['nj'])
+        isBtag=jMask & ((j_btag.astype(numpy.int64) & 0x1)!=0)
+        isB=isBtag & (numpy.cumsum(isBtag,axis=1)<=2)
+        bIdx,nb=getFirstSelected(isB,2)
+        oIdx,no=getFirstSelected(jMask & ~isB,2)
+
+        #event selection
+        cat=ev['cat']
+        sel=(filtWeight>=0) & (numpy.abs(cat)>=100) & (lMask.sum(axis=1)>=2) & (nb==2)
+        if not sel.any() : continue
+        evWeight=puNormSF*getPaddedArray(ev['weight'],numpy.ones(nev))[0][:,0]*filtWeight*filtNormRwgt
+        lIdx=numpy.zeros((nev,2),dtype=numpy.int64)
+        lIdx[:,1]=1
+        l4=getP4Arrays(leptons,lIdx)[sel]
+        b4=getP4Arrays(jets,bIdx)[sel]
+        o4=getP4Arrays(jets,oIdx)[sel]
+        metx=ev['met_pt'][sel]*numpy.cos(ev['met_phi'][sel])
+        mety=ev['met_pt'][sel]*numpy.sin(ev['met_phi'][sel])
+
+        #try to solve the kinematics for both bl assignments
+        tops,tops_,valid=[],[],[]
+        for la,lb in [(l4[:,0],l4[:,1]),(l4[:,1],l4[:,0])]:
+            with numpy.errstate(invalid='ignore'):
+                nu,nu_,isValid=doubleNeutrinoSolutionsBatch( (b4[:,0],b4[:,1]), (la,lb), (metx,mety) ).nunu_s
+                nu4=numpy.concatenate([nu,numpy.linalg.norm(nu,axis=2)[:,:,numpy.newaxis]],axis=2)
+                nu4_=numpy.concatenate([nu_,numpy.linalg.norm(nu_,axis=2)[:,:,numpy.newaxis]],axis=2)
+            tops.append((b4[:,0]+la)[:,numpy.newaxis,:]+nu4)
+            tops_.append((b4[:,1]+lb)[:,numpy.newaxis,:]+nu4_)
+            valid.append(isValid)
+        tops,tops_,valid=[numpy.concatenate(x,axis=1) for x in (tops,tops_,valid)]
+        pairing=numpy.repeat([0,1],valid.shape[1]/2)
+
+        #sort solutions by increasing m(ttbar)
+        with numpy.errstate(invalid='ignore'):
+            mttbar=numpy.where(valid,massArray(tops+tops_),numpy.inf)
+        order=numpy.argsort(mttbar,axis=1,kind='mergesort')
+        nsols=valid.sum(axis=1)
+        hasSol=nsols>0
+        if not hasSol.any() : continue
+
+        #keep the events with solutions
+        evIdx=numpy.flatnonzero(sel)[hasSol]
+        l4,b4,o4,metx,mety,tops,tops_,order,nsols=[x[hasSol] for x in (l4,b4,o4,metx,mety,tops,tops_,order,nsols)]
+        nsel=len(evIdx)
+        rows=numpy.arange(nsel)
+        top,top_=tops[rows,order[:,0]],tops_[rows,order[:,0]]
+        ttbarPt=ptArray(top+top_)
+        ttbarPt2=numpy.where(nsols>1,ptArray(tops[rows,order[:,1]]+tops_[rows,order[:,1]]),-1)
+        ipair=pairing[order[:,0]]
+
+        #mc truth
+        t_id,tMask=getPaddedArray(ev['t_id'],ev['nt'])
+        genTops,_=getCollectionArrays(ev,'t_','nt')
+        tIdx,ntops=getFirstSelected(tMask & (numpy.abs(t_id)==6),2)
+        gen4=getP4Arrays(genTops,tIdx)[evIdx]
+        genPt=numpy.where(ntops[evIdx]>=2,ptArray(gen4[:,0]+gen4[:,1]),-1)
+
+        bSel=[takeEntries(jets[v],bIdx)[evIdx] for v in ['pt','eta','phi']]
+        lSel=[takeEntries(leptons[v],lIdx)[evIdx] for v in ['pt','eta','phi']]
+        values=numpy.stack([bSel[0][:,0],bSel[1][:,0],bSel[2][:,0],
+                            bSel[0][:,1],bSel[1][:,1],bSel[2][:,1],
+                            lSel[0][:,0],lSel[1][:,0],lSel[2][:,0],
+                            lSel[0][:,1],lSel[1][:,1],lSel[2][:,1],
+                            metx,mety,
+                            jMask.sum(axis=1)[evIdx],
+                            ttbarPt,ttbarPt2,genPt],axis=1).astype(numpy.float32)
+        for row in values:
+            ntuple.Fill(array.array("f",row))
+
+        #leptons associated to the top and anti-top for the lowest mttbar solution
+        l1=numpy.where((ipair==0)[:,numpy.newaxis],l4[:,0],l4[:,1])
+        l2=numpy.where((ipair==0)[:,numpy.newaxis],l4[:,1],l4[:,0])
+        l1phi=numpy.where(ipair==0,lSel[2][:,0],lSel[2][:,1])
+        l2phi=numpy.where(ipair==0,lSel[2][:,1],lSel[2][:,0])
+
+        #angles in the top/anti-top rest frames
+        cosb1,cosb2=cosThetaStarArrays(b4[:,0],top),cosThetaStarArrays(b4[:,1],top_)
+        cosl1,cosl2=cosThetaStarArrays(l1,top),cosThetaStarArrays(l2,top_)
+        dphibb=numpy.abs(deltaPhiArrays(bSel[2][:,0],bSel[2][:,1]))
+        dphill=numpy.abs(deltaPhiArrays(l1phi,l2phi))
+        oSel=[takeEntries(jets['phi'],oIdx)[evIdx],no[evIdx]]
+        dphijj=deltaPhiArrays(oSel[0][:,0],oSel[0][:,1])
+        ht=bSel[0][:,0]+bSel[0][:,1]+lSel[0][:,0]+lSel[0][:,1]+ev['met_pt'][evIdx]
+
+        w=evWeight[evIdx]
+        isEMu=numpy.abs(cat[evIdx])==11*13
+        for evcat,catMask in [('emu',isEMu),('ll',~isEMu)]:
+            fillArrays(observablesH['dphibb_'+evcat],dphibb[catMask],w[catMask])
+            fillArrays(observablesH['cosbstar_'+evcat],numpy.concatenate([cosb1[catMask],cosb2[catMask]]),numpy.tile(w[catMask],2))
+            fillArrays(observablesH['cosbstarprod_'+evcat],(cosb1*cosb2)[catMask],w[catMask])
+            fillArrays(observablesH['dphill_'+evcat],dphill[catMask],w[catMask])
+            fillArrays(observablesH['coslstar_'+evcat],numpy.concatenate([cosl1[catMask],cosl2[catMask]]),numpy.tile(w[catMask],2))
+            fillArrays(observablesH['coslstarprod_'+evcat],(cosl1*cosl2)[catMask],w[catMask])
+            jjMask=catMask & (oSel[1]>=2)
+            fillArrays(observablesH['dphijj_'+evcat],dphijj[jjMask],w[jjMask])
+            fillArrays(observablesH['ht_'+evcat],ht[catMask],w[catMask])
+
+
+"""
+event loop: the kinematics is solved and the histograms are filled event by event
+"""
+def runEventLoop(tree,observablesH,ntuple,puNormSF,filtFunc,filtArgs,filtNormRwgt):
 
-    #loop over events in the tree and fill histos
     totalEntries=tree.GetEntries()
     lVec = ROOT.Math.LorentzVector(ROOT.Math.PtEtaPhiM4D('double')) 
     for i in xrange(0,totalEntries):
@@ -230,6 +413,75 @@ def runAnomalousTopProductionAnalysis(fileName,outFileName,filterName):
         #other control variables
         observablesH['ht_'+evcat].Fill(bjets[0].pt()+bjets[1].pt()+leptons[0].pt()+leptons[1].pt()+tree.met_pt,evWeight)
 
+
+"""
+Analysis loop
+"""
+def runAnomalousTopProductionAnalysis(fileName,outFileName,filterName,columnar=False):
+        
+    print '....analysing',fileName,'with output @',outFileName
+
+    fOut=ROOT.TFile.Open(outFileName,'RECREATE')
+    fOut.cd()
+    ntuple = ROOT.TNtuple("data","data","b1pt:b1eta:b1phi:b2pt:b2eta:b2phi:l1pt:l1eta:l1phi:l2pt:l2eta:l2phi:metx:mety:nj:ptest1:ptest2:ptgen")
+
+    #book histograms
+    observablesH={}
+    for k in ['emu','ll']:
+        observablesH['ht_'+k]=ROOT.TH1F('ht_'+k,';H_{T} [GeV];Events',20,0,1000)
+
+        observablesH['dphibb_'+k]=ROOT.TH1F('dphibb_'+k,';#Delta#phi(b,#bar{b}) [rad];Events',20,0,3.15)
+        observablesH['cosbstar_'+k]=ROOT.TH1F('cosbstar_'+k,';cos(#theta*_{b});Events',20,-1,1)
+        observablesH['cosbstarprod_'+k]=ROOT.TH1F('cosbstarprod_'+k,';cos(#theta*_{b_{1}})cos(#theta*_{b_{2}});Events',20,-1,1)
+
+        observablesH['dphill_'+k]=ROOT.TH1F('dphill_'+k,';#Delta#phi(l,l) [rad];Events',20,0,3.15)
+        observablesH['coslstar_'+k]=ROOT.TH1F('coslstar_'+k,';cos(#theta*_{l});Events',20,-1,1)
+        observablesH['coslstarprod_'+k]=ROOT.TH1F('coslstarprod_'+k,';cos(#theta*_{l_{1}})cos(#theta*_{l_{2}});Events',20,-1,1)
+
+        observablesH['dphijj_'+k]=ROOT.TH1F('dphijj_'+k,';#Delta#phi(j,j) [rad];Events',20,0,3.15)
+    for var in observablesH:
+        observablesH[var].SetDirectory(0)
+        observablesH[var].Sumw2()
+
+
+    #open file
+    puNormSF=1.0
+    if 'MC13TeV' in fileName:
+        fIn=ROOT.TFile.Open(fileName)
+        puCorrH=fIn.Get('puwgtctr')
+        nonWgt=puCorrH.GetBinContent(1)
+        wgt=puCorrH.GetBinContent(2)
+        if wgt>0 : puNormSF=nonWgt/wgt
+        fIn.Close()
+    tree=ROOT.TChain('twev')
+    tree.AddFile(fileName)
+
+    #if some filtering has to be applied, specialize it
+    filtFunc,filtArgs,filtNormRwgt=None,None,1.0
+    if filterName:
+        filtFunc,filtArgsList=filterName.split('=')
+        if filtFunc=='topRadiusFilter':
+            args=filtArgsList.split(',')
+            bsmUrl,smUrl,distName=args
+
+            #get the target distribution
+            bsmFile=ROOT.TFile.Open(bsmUrl)
+            weightH=bsmFile.Get(distName)
+            weightH.SetDirectory(0)
+            bsmFile.Close()
+
+            #get the SM distribution 
+            smFile=ROOT.TFile.Open(smUrl)
+            weightH.Divide(smFile.Get(distName))
+            smFile.Close()
+            filtArgs=[weightH]
+
+    #loop over events in the tree and fill histos (or process them in chunks of arrays)
+    if columnar:
+        runColumnarAnalysis(tree,observablesH,ntuple,puNormSF,filtFunc,filtArgs,filtNormRwgt)
+    else:
+        runEventLoop(tree,observablesH,ntuple,puNormSF,filtFunc,filtArgs,filtNormRwgt)
+
     #save results
     if filterName:
         postfix=outFileName.split('_')[-1]
@@ -248,8 +500,8 @@ Wrapper for when the analysis is run in parallel
 """
 def runAnomalousTopProductionAnalysisPacked(args):
     try:
-        fileNames,outFileName,filterName=args
-        runAnomalousTopProductionAnalysis(fileNames,outFileName,filterName)
+        fileNames,outFileName,filterName,columnar=args
+        runAnomalousTopProductionAnalysis(fileNames,outFileName,filterName,columnar)
     except : # ReferenceError:
         print 50*'<'
         print "  Problem with", name, "continuing without"
@@ -285,7 +537,7 @@ def createAnalysisTasks(opt):
                 if filtTag in tag:
                     processThis=True
             if not processThis : continue
-        tasklist.append((filename,'%s/%s'%(opt.output,baseFileName),opt.filter))
+        tasklist.append((filename,'%s/%s'%(opt.output,baseFileName),opt.filter,opt.columnar))
 
     #loop over tasks
     if opt.queue=='local':
@@ -295,13 +547,14 @@ def createAnalysisTasks(opt):
             pool = MP.Pool(opt.jobs)
             pool.map(runAnomalousTopProductionAnalysisPacked,tasklist)
         else:
-            for fileName,outFileName,filterName in tasklist:
-                runAnomalousTopProductionAnalysis(fileName,outFileName,filterName)
+            for fileName,outFileName,filterName,columnar in tasklist:
+                runAnomalousTopProductionAnalysis(fileName,outFileName,filterName,columnar)
     else:
         cmsswBase=os.environ['CMSSW_BASE']
-        for fileName,_,filterName in tasklist:
+        for fileName,_,filterName,columnar in tasklist:
             localRun='python %s/src/TopLJets2015/TopAnalysis/scripts/runAnomalousTopProductionAnalysis.py -i %s -o %s -q local'%(cmsswBase,fileName,opt.output)
             if filterName : localRun+=' --filter %s'%filterName
+            if columnar : localRun+=' --columnar'
             cmd='bsub -q %s %s/src/TopLJets2015/TopAnalysis/scripts/wrapLocalAnalysisRun.sh \"%s\"' % (opt.queue,cmsswBase,localRun)
             print cmd
             os.system(cmd)
@@ -334,6 +587,11 @@ def main():
                           dest='output', 
                           default='analysis',
                           help='Output directory [default: %default]')
+	parser.add_option('--columnar',
+                          dest='columnar',
+                          default=False,
+                          action='store_true',
+                          help='process the events in chunks with numpy arrays instead of the event loop [default: %default]')
 	parser.add_option('-q', '--queue',
                           dest='queue',
                           default='local',
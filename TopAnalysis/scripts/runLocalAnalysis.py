@@ -7,8 +7,27 @@ from collections import OrderedDict
 import json
 import re
 import commands
+import time
+import subprocess
 from TopLJets2015.TopAnalysis.storeTools import *
 from TopLJets2015.TopAnalysis.batchTools import *
+from TopLJets2015.TopAnalysis.jobLedger import JobLedger,getEntries,getFileSize,getVariationOutputs
+
+"""
+Builds the analysisWrapper command line for a task
+"""
+def buildAnalysisCommand(args):
+
+    method,inF,outF,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec=args
+    cmd='analysisWrapper --era %s --normTag %s --in %s --out %s --method %s --charge %d --channel %d --flag %d --systVar %s --genWeights %s --xsec %f'\
+        %(era, tag, inF, ','.join(getVariationOutputs(outF,systVar)), method, charge, channel, flag, systVar,genWeights,xsec)
+    if runSysts : cmd += ' --runSysts'
+    if debug : cmd += ' --debug'
+    if mvatree : cmd += ' --mvatree'
+    if CR : cmd += ' --CR'
+    if QCDTemp : cmd += ' --QCDTemp'
+    if SRfake : cmd += ' --SRfake'
+    return cmd
 
 """
 Wrapper to be used when run in parallel
@@ -28,23 +47,110 @@ def RunMethodPacked(args):
     print 'Prepare the region to apply fake ratio?', SRfake
 
     try:
-        cmd='analysisWrapper --era %s --normTag %s --in %s --out %s --method %s --charge %d --channel %d --flag %d --systVar %s --genWeights %s --xsec %f'\
-            %(era, tag, inF, outF, method, charge, channel, flag, systVar,genWeights,xsec)
-        if runSysts : cmd += ' --runSysts'
-        if debug : cmd += ' --debug'
-        if mvatree : cmd += ' --mvatree'
-        if CR : cmd += ' --CR'
-        if QCDTemp : cmd += ' --QCDTemp'
-        if SRfake : cmd += ' --SRfake'
+        cmd=buildAnalysisCommand(args)
         print(cmd)
-        os.system(cmd)
+        exitCode=os.system(cmd)
 
     except :
         print 50*'<'
         print "  Problem  (%s) with %s continuing without"%(sys.exc_info()[1],inF)
         print 50*'<'
         return False
-    return True
+    return exitCode==0
+
+"""
+Wrapper recording the result of the task in the job ledger
+"""
+def RunMethodWithLedger(args):
+
+    task,ledgerURL=args
+    ledger=JobLedger(ledgerURL)
+    ledger.markSubmitted(task)
+    start=time.time()
+    success=RunMethodPacked(task)
+    runtime=time.time()-start
+    nevents=getEntries(task[1]) if success else None
+    return ledger.markFinished(task[2],0 if success else 1,runtime,nevents)
+
+"""
+Runs a task in a subprocess with its output captured in a log file, retrying if it fails
+returns the exit code and the resources used (wall time, CPU time and max RSS of the last attempt)
+"""
+def RunMethodSubprocess(args):
+
+    task,logDir,maxRetries=args
+    outF=task[2]
+    logURL=os.path.join(logDir,os.path.splitext(os.path.basename(outF))[0]+'.log')
+    cmd=buildAnalysisCommand(task)
+
+    report={'output':outF,'input':task[1],'tag':task[9],'systVar':task[7],'log':logURL}
+    for attempt in xrange(1,maxRetries+2):
+        start=time.time()
+        with open(logURL,'w' if attempt==1 else 'a') as log:
+            log.write('[attempt %d] %s\n'%(attempt,cmd))
+            log.flush()
+            try:
+                p=subprocess.Popen(cmd.split(),stdout=log,stderr=subprocess.STDOUT)
+                _,status,rusage=os.wait4(p.pid,0)
+                exitCode=os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128+os.WTERMSIG(status)
+                cpu,maxrss=rusage.ru_utime+rusage.ru_stime,rusage.ru_maxrss/1024.
+            except Exception as e:
+                log.write('failed to launch: %s\n'%e)
+                exitCode,cpu,maxrss=-1,0.,0.
+        report.update({'exitCode':exitCode,'attempts':attempt,'wall':time.time()-start,'cpu':cpu,'maxrss':maxrss})
+        if exitCode==0: break
+
+    return report
+
+"""
+Prints (and stores in the log directory) the summary of the resources used by the tasks
+"""
+def printResourceReport(reports,logDir,njobs,totalWall):
+
+    ok=[r for r in reports if r['exitCode']==0]
+    failed=[r for r in reports if r['exitCode']!=0]
+    print '-'*50
+    print '%d tasks succeeded, %d failed, %d needed retries'%(len(ok),len(failed),len([r for r in reports if r['attempts']>1]))
+    for r in failed:
+        print '\t [exit code %d] %s (see %s)'%(r['exitCode'],r['output'],r['log'])
+    if len(reports)>0:
+        sumWall=sum([r['wall'] for r in reports])
+        sumCPU=sum([r['cpu'] for r in reports])
+        maxRSS=max([r['maxrss'] for r in reports])
+        print 'elapsed time %3.1fs with %d parallel jobs'%(totalWall,max(njobs,1))
+        print 'task wall time: mean %3.1fs max %3.1fs'%(sumWall/len(reports),max([r['wall'] for r in reports]))
+        print 'task CPU time: mean %3.1fs (CPU/wall=%3.2f)'%(sumCPU/len(reports),sumCPU/sumWall if sumWall>0 else 0.)
+        print 'task max RSS: mean %3.0fMB max %3.0fMB'%(sum([r['maxrss'] for r in reports])/len(reports),maxRSS)
+    print '-'*50
+
+    with open(os.path.join(logDir,'resource_report.json'),'w') as f:
+        json.dump({'njobs':njobs,'wall':totalWall,'tasks':reports},f,indent=2)
+    print 'Report stored in',os.path.join(logDir,'resource_report.json')
+
+"""
+Location of the file where a batch job stores the time spent in a task
+"""
+def getRuntimeURL(FarmDirectory,outF):
+    return '%s/%s.runtime'%(FarmDirectory,os.path.splitext(os.path.basename(outF))[0])
+
+"""
+Groups the tasks in bundles with a target processing time
+the time is estimated from the input size and the processing time per MB for each tag (None is used as default)
+"""
+def bundleTasks(task_list,targetTime,secPerMB,defaultSecPerMB):
+
+    bundles=[[]]
+    bundleTime=0.
+    for task in task_list:
+        inputSize=getFileSize(task[1])
+        rate=secPerMB.get(task[9],secPerMB.get(None,defaultSecPerMB))
+        taskTime=rate*inputSize/1024.**2 if inputSize else targetTime
+        if len(bundles[-1])>0 and bundleTime+taskTime>targetTime:
+            bundles.append([])
+            bundleTime=0.
+        bundles[-1].append(task)
+        bundleTime+=taskTime
+    return [b for b in bundles if len(b)>0]
 
 """
 """
@@ -60,6 +166,7 @@ def main():
     parser.add_option(      '--skip',        dest='skip',        help='csv list of samples to skip  [%default]',             default=None,       type='string')
     parser.add_option(      '--runSysts',    dest='runSysts',    help='run systematics  [%default]',                            default=False,      action='store_true')
     parser.add_option(      '--systVar',     dest='systVar',     help='single systematic variation  [%default]',   default='nominal',       type='string')
+    parser.add_option(      '--multiVar',    dest='multiVar',    help='process all the systematic variations of an input file in a single task  [%default]',   default=False,       action='store_true')
     parser.add_option(      '--debug',       dest='debug',       help='debug mode  [%default]',                            default=False,      action='store_true')
     parser.add_option(      '--flag',        dest='flag',        help='job specific flag  [%default]',   default=0,          type=int)
     parser.add_option(      '--xsec',        dest='xsec',        help='use this xsec value instead of the json one  [%default]',   default=None,          type=float)
@@ -69,10 +176,17 @@ def main():
     parser.add_option(      '--tag',         dest='tag',         help='normalize from this tag  [%default]',                    default=None,       type='string')
     parser.add_option('-q', '--queue',       dest='queue',       help='if not local send to batch with condor. queues are now called flavours, see http://batchdocs.web.cern.ch/batchdocs/local/submit.html#job-flavours   [%default]',     default='local',    type='string')    
     parser.add_option('-n', '--njobs',       dest='njobs',       help='# jobs to run in parallel  [%default]',                  default=0,    type='int')
+    parser.add_option(      '--executor',    dest='executor',    help='local executor: system (os.system calls) or subprocess (captured logs, retries and resource report) [%default]',  default='system',    type='choice', choices=['system','subprocess'])
+    parser.add_option(      '--retries',     dest='retries',     help='number of retries for failed tasks with the subprocess executor [%default]',  default=1,    type='int')
+    parser.add_option(      '--logDir',      dest='logDir',      help='directory for the task logs of the subprocess executor (by default logs in the output directory) [%default]',  default=None,    type='string')
     parser.add_option(      '--dryRun',      dest='dryRun',      help='create jobs, do not submit them  [%default]',       default=False,      action='store_true')
-    parser.add_option(      '--skipexisting',dest='skipexisting',help='skip jobs with existing output files  [%default]',       default=False,      action='store_true')
+    parser.add_option(      '--skipexisting',dest='skipexisting',help='skip jobs with existing output files (with a ledger: skip jobs which succeeded and whose output did not change)  [%default]',       default=False,      action='store_true')
+    parser.add_option(      '--ledger',      dest='ledger',      help='SQLite job ledger to keep track of the tasks (e.g. jobledger.db in the output directory) [%default]',       default=None,       type='string')
     parser.add_option(      '--exactonly',   dest='exactonly',   help='match only exact sample tags to process  [%default]',    default=False,      action='store_true')
     parser.add_option(      '--outputonly',  dest='outputonly',  help='filter job submission for a csv list of output files  [%default]',             default=None,       type='string')
+    parser.add_option(      '--bundleTime',  dest='bundleTime',  help='group the tasks in batch jobs with this target wall time in seconds, 0 to submit one job per task [%default]',  default=0,    type='float')
+    parser.add_option(      '--bundleJobs',  dest='bundleJobs',  help='number of tasks to run in parallel within each batch job [%default]',  default=1,    type='int')
+    parser.add_option(      '--secPerMB',    dest='secPerMB',    help='processing time per MB of input to use if it is not available from previous runs in the job ledger [%default]',  default=1.0,    type='float')
     parser.add_option(      '--farmappendix',dest='farmappendix',help='Appendix to condor FARM directory [%default]',             default='',       type='string')
     parser.add_option(      '--genWeights',  dest='genWeights',  help='genWeights to get the normalization from (found within data/era directory) [%default]',             default='genweights.root',       type='string')
     parser.add_option(      '--mvatree',     dest='mvatree',     help='make mva tree  [%default]',                            default=False,      action='store_true'),
@@ -133,6 +247,12 @@ def main():
             pass
     print 'Running following variations: ', varList
 
+    #all the variations can be processed in one pass (one task per input file)
+    taskVarList=varList
+    if opt.multiVar and len(varList)>1:
+        taskVarList=[','.join(varList)]
+        print 'Variations will be processed in a single pass'
+
     #prepare output if a directory
     if not '.root' in opt.output :
         print opt.output
@@ -142,22 +262,30 @@ def main():
         else:
             os.system('mkdir -p %s/Chunks'%opt.output)
 
+    #job ledger to keep track of the tasks
+    ledger=None
+    if opt.ledger:
+        ledger=JobLedger(opt.ledger)
+        print 'Tasks will be tracked in',opt.ledger
+
     #correct location of corrections to be used using cmsswBase, if needed
     cmsswBase=os.environ['CMSSW_BASE']
     if not cmsswBase in opt.era : opt.era=cmsswBase+'/src/TopLJets2015/TopAnalysis/data/'+opt.era
 
+    FarmDirectory = '%s/FARM%s%s'%(cmsswBase,os.path.basename(opt.output),opt.farmappendix)
+
     #process tasks
     task_list = []
     processedTags=[]
     if '.root' in opt.input:
         inF=opt.input
         if '/store/' in inF and not 'root:' in inF : inF='root://eoscms//eos/cms'+opt.input              
-        for systVar in varList:
+        for systVar in taskVarList:
             outF=opt.output
             xsec=1.
             if opt.tag in onlyListXsec: xsec=onlyListXsec[opt.tag]
             if opt.xsec: xsec=opt.xsec
-            if systVar != 'nominal' and not systVar in opt.output: outF=opt.output[:-5]+'_'+systVar+'.root'
+            if systVar != 'nominal' and not ',' in systVar and not systVar in opt.output: outF=opt.output[:-5]+'_'+systVar+'.root'
             task_list.append( (opt.method,inF,outF,opt.channel,opt.charge,opt.flag,opt.runSysts,systVar,opt.era,opt.tag,opt.debug, opt.CR, opt.QCDTemp, opt.SRfake, opt.mvatree,opt.genWeights,xsec) )
     else:
 
@@ -189,33 +317,76 @@ def main():
 
             input_list=getEOSlslist(directory='%s/%s' % (opt.input,tag) )
             
-            for systVar in varList:
+            for systVar in taskVarList:
                 nexisting = 0
                 for ifile in xrange(0,len(input_list)):
                     inF=input_list[ifile]
                 
                     outF=os.path.join(opt.output,'Chunks','%s_%d.root' %(tag,ifile))
-                    if systVar != 'nominal' and not systVar in tag: outF=os.path.join(opt.output,'Chunks','%s_%s_%d.root' %(tag,systVar,ifile))
-                    if (opt.skipexisting and os.path.isfile(outF)):
-                        nexisting += 1
-                        continue
+                    if systVar != 'nominal' and not ',' in systVar and not systVar in tag: outF=os.path.join(opt.output,'Chunks','%s_%s_%d.root' %(tag,systVar,ifile))
+                    task=(opt.method,inF,outF,opt.channel,opt.charge,opt.flag,opt.runSysts,systVar,opt.era,tag,opt.debug, opt.CR, opt.QCDTemp, opt.SRfake, opt.mvatree,opt.genWeights,xsec)
+                    if opt.skipexisting:
+                        isDone = not ledger.needsRun(task,getRuntimeURL(FarmDirectory,outF)) if ledger else all([os.path.isfile(f) for f in getVariationOutputs(outF,systVar)])
+                        if isDone:
+                            nexisting += 1
+                            continue
                     if (len(outputOnlyList) > 1 and not outF in outputOnlyList):
                         continue
-                    task_list.append( (opt.method,inF,outF,opt.channel,opt.charge,opt.flag,opt.runSysts,systVar,opt.era,tag,opt.debug, opt.CR, opt.QCDTemp, opt.SRfake, opt.mvatree,opt.genWeights,xsec) )
+                    task_list.append( task )
                 if (opt.skipexisting and nexisting): print '--skipexisting: %s - skipping %d of %d tasks as files already exist'%(systVar,nexisting,len(input_list))
 
     #run the analysis jobs
-    if opt.queue=='local':
+    nfailed=0
+    if opt.queue=='local' and opt.executor=='subprocess':
+        logDir=opt.logDir
+        if logDir is None:
+            logDir=os.path.join(os.path.dirname(opt.output) if '.root' in opt.output else opt.output,'logs')
+            if '/store/' in logDir: logDir='logs'
+        os.system('mkdir -p %s'%logDir)
+        print 'launching %d tasks in %d parallel jobs, logs will be stored in %s'%(len(task_list),opt.njobs,logDir)
+
+        #tasks are collected as they finish
+        from itertools import imap
+        runArgs=[(task,logDir,opt.retries) for task in task_list]
+        if ledger:
+            for task in task_list: ledger.markSubmitted(task)
+        pool=None
+        if opt.njobs == 0:
+            results=imap(RunMethodSubprocess,runArgs)
+        else:
+            from multiprocessing import Pool
+            pool = Pool(opt.njobs)
+            results=pool.imap_unordered(RunMethodSubprocess, runArgs)
+        start=time.time()
+        reports=[]
+        for r in results:
+            reports.append(r)
+            print '[%d/%d] exit code %d after %d attempt(s) wall=%3.1fs cpu=%3.1fs maxrss=%3.0fMB %s'\
+                %(len(reports),len(task_list),r['exitCode'],r['attempts'],r['wall'],r['cpu'],r['maxrss'],r['output'])
+            if ledger:
+                ledger.markFinished(r['output'],r['exitCode'],r['wall'],getEntries(r['input']) if r['exitCode']==0 else None)
+        if pool:
+            pool.close()
+            pool.join()
+        printResourceReport(reports,logDir,opt.njobs,time.time()-start)
+        if ledger: ledger.summary()
+        nfailed=len([r for r in reports if r['exitCode']!=0])
+
+    elif opt.queue=='local':
         print 'launching %d tasks in %d parallel jobs'%(len(task_list),opt.njobs)
+        runMethod,runArgs=RunMethodPacked,task_list
+        if ledger:
+            runMethod,runArgs=RunMethodWithLedger,[(task,opt.ledger) for task in task_list]
         if opt.njobs == 0:
-            for args in task_list: RunMethodPacked(args)
+            results=[runMethod(args) for args in runArgs]
         else:
             from multiprocessing import Pool
             pool = Pool(opt.njobs)
-            pool.map(RunMethodPacked, task_list)
+            results=pool.map(runMethod, runArgs)
+        if ledger: ledger.summary()
+        nfailed=len([x for x in results if not x])
     else:
         
-        FarmDirectory = '%s/FARM%s%s'%(cmsswBase,os.path.basename(opt.output),opt.farmappendix)
         os.system('mkdir -p %s'%FarmDirectory)
         
         print 'Preparing %d tasks to submit to the batch'%len(task_list)
@@ -227,6 +398,13 @@ def main():
         else:
             OpSysAndVer = "CentOS7"
 
+        #group the tasks in jobs with a target wall time
+        bundles=[[task] for task in task_list]
+        if opt.bundleTime>0:
+            secPerMB=ledger.getSecondsPerMB() if ledger else {}
+            bundles=bundleTasks(task_list,opt.bundleTime*max(1,opt.bundleJobs),secPerMB,opt.secPerMB)
+            print 'Tasks have been grouped in %d jobs with a target wall time of %ds'%(len(bundles),opt.bundleTime)
+
         allCfgs=[]
         with open ('%s/condor.sub'%FarmDirectory,'w') as condor:
 
@@ -236,12 +414,9 @@ def main():
             condor.write('log        = {0}/output_common.log\n'.format(FarmDirectory))
             condor.write('requirements = (OpSysAndVer =?= "{0}")\n'.format(OpSysAndVer)) 
             condor.write('+JobFlavour = "{0}"\n'.format(opt.queue))
-            jobNb=0
-            for method,inF,outF,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec in task_list:
+            for ibundle,bundle in enumerate(bundles):
 
-                jobNb+=1
-                cfgFile='%s'%(os.path.splitext(os.path.basename(outF))[0])
-                allCfgs.append((inF,outF))
+                cfgFile='bundle_%d'%ibundle if len(bundle)>1 else '%s'%(os.path.splitext(os.path.basename(bundle[0][2]))[0])
                 condor.write('cfgFile=%s\n'%cfgFile)
                 condor.write('queue 1\n')
                 
@@ -253,21 +428,46 @@ def main():
                     cfg.write('cd %s\n'%cmsswBase)
                     cfg.write('eval `scram r -sh`\n')
                     cfg.write('cd ${WORKDIR}\n')
-                    localOutF=os.path.basename(outF)
-                    runOpts='-i %s -o ${WORKDIR}/%s --charge %d --ch %d --era %s --tag %s --flag %d --method %s --systVar %s --genWeights %s --xsec %f'\
-                        %(inF, localOutF, charge, channel, era, tag, flag, method, systVar,genWeights,xsec)
-                    if runSysts : runOpts += ' --runSysts'
-                    if debug :    runOpts += ' --debug'
-                    if mvatree :  runOpts += ' --mvatree'                    
-                    if CR :       runOpts += ' --CR'
-                    if QCDTemp :  runOpts += ' --QCDTemp'
-                    if SRfake :  runOpts += ' --SRfake'
-                    cfg.write('python %s/src/TopLJets2015/TopAnalysis/scripts/runLocalAnalysis.py %s\n'%(cmsswBase,runOpts))
-                    if '/store' in outF:
-                        cfg.write('xrdcp --force ${WORKDIR}/%s root://eoscms//%s\n'%(localOutF,outF))
-                        cfg.write('rm ${WORKDIR}/%s'%localOutF)
-                    elif outF!=localOutF:
-                        cfg.write('  mv -v ${WORKDIR}/%s %s\n'%(localOutF,outF))
+
+                    #each task is a case of the runTask function
+                    cfg.write('runTask() {\n')
+                    cfg.write('  case $1 in\n')
+                    for itask,task in enumerate(bundle):
+                        method,inF,outF,channel,charge,flag,runSysts,systVar,era,tag,debug,CR,QCDTemp,SRfake,mvatree,genWeights,xsec=task
+                        if ledger and not opt.dryRun:
+                            ledger.markSubmitted(task,getRuntimeURL(FarmDirectory,outF))
+                        allCfgs += [(inF,f) for f in getVariationOutputs(outF,systVar)]
+
+                        cfg.write('  %d)\n'%itask)
+                        cfg.write('  start=`date +%s`\n')
+                        cfg.write('  trap \'echo $? $((`date +%%s`-start)) > %s\' RETURN\n'%getRuntimeURL(FarmDirectory,outF))
+                        localOutF=os.path.basename(outF)
+                        runOpts='-i %s -o ${WORKDIR}/%s --charge %d --ch %d --era %s --tag %s --flag %d --method %s --systVar %s --genWeights %s --xsec %f'\
+                            %(inF, localOutF, charge, channel, era, tag, flag, method, systVar,genWeights,xsec)
+                        if runSysts : runOpts += ' --runSysts'
+                        if debug :    runOpts += ' --debug'
+                        if mvatree :  runOpts += ' --mvatree'                    
+                        if CR :       runOpts += ' --CR'
+                        if QCDTemp :  runOpts += ' --QCDTemp'
+                        if SRfake :  runOpts += ' --SRfake'
+                        if ',' in systVar : runOpts += ' --multiVar'
+                        cfg.write('  python %s/src/TopLJets2015/TopAnalysis/scripts/runLocalAnalysis.py %s || return 1\n'%(cmsswBase,runOpts))
+                        for varOutF in getVariationOutputs(outF,systVar):
+                            localVarOutF=os.path.basename(varOutF)
+                            if '/store' in varOutF:
+                                cfg.write('  xrdcp --force ${WORKDIR}/%s root://eoscms//%s || return 1\n'%(localVarOutF,varOutF))
+                                cfg.write('  rm ${WORKDIR}/%s\n'%localVarOutF)
+                            elif varOutF!=localVarOutF:
+                                cfg.write('  mv -v ${WORKDIR}/%s %s || return 1\n'%(localVarOutF,varOutF))
+                        cfg.write('  return 0\n')
+                        cfg.write('  ;;\n')
+                    cfg.write('  esac\n')
+                    cfg.write('}\n')
+                    cfg.write('export -f runTask\n')
+                    cfg.write('export WORKDIR\n')
+
+                    #run the tasks sequentially or with a local pool
+                    cfg.write('seq 0 %d | xargs -P %d -I{} bash -c \'runTask {}\'\n'%(len(bundle)-1,max(1,opt.bundleJobs)))
 
                 os.system('chmod u+x %s/%s.sh'%(FarmDirectory,cfgFile))
 
@@ -278,6 +478,11 @@ def main():
         with open('%s/checkIntegList.dat'%FarmDirectory,'w') as f:
             for i,o in allCfgs: 
                 f.write('%s %s\n'%(i,o))
+
+    #propagate failures in the exit code
+    if nfailed>0:
+        print '%d tasks failed'%nfailed
+        return 1
             
 
 
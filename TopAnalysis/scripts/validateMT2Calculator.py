@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import ROOT
+import optparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from MT2Calculator import calcMt2, calcMt2Batch
+
+"""
+generates random configurations of two visible systems and the missing transverse momentum
+returns the (N,4) arrays of [px,py,pz,E] and the mass of the invisible particles
+mode is massless, massive or mixed (massless and massive visible systems)
+"""
+def generateConfigurations(n,mode,rng):
+
+    vis=[]
+    for ivis in xrange(0,2):
+        pt=rng.uniform(10.,300.,n)
+        eta=rng.uniform(-2.5,2.5,n)
+        phi=rng.uniform(-np.pi,np.pi,n)
+        if mode=='massless'  : m=np.zeros(n)
+        elif mode=='massive' : m=rng.uniform(0.,200.,n)
+        else                 : m=np.where(rng.uniform(0.,1.,n)<0.5,0.,rng.uniform(0.,200.,n))
+        px,py,pz=pt*np.cos(phi),pt*np.sin(phi),pt*np.sinh(eta)
+        vis.append( np.stack([px,py,pz,np.sqrt(px**2+py**2+pz**2+m**2)],axis=1) )
+
+    met=rng.uniform(0.,300.,n)
+    metphi=rng.uniform(-np.pi,np.pi,n)
+    mn=0. if mode=='massless' else rng.uniform(0.,100.)
+    child=np.stack([met*np.cos(metphi),met*np.sin(metphi),np.zeros(n),np.sqrt(met**2+mn**2)],axis=1)
+
+    return vis[0],vis[1],child,mn
+
+"""
+M_{T2} computed event by event with calcMt2
+"""
+def runScalar(vis1,vis2,child):
+    mt2=[]
+    for i in xrange(0,len(vis1)):
+        p4=[ROOT.TLorentzVector(*[float(x) for x in p[i]]) for p in (vis1,vis2,child)]
+        mt2.append( calcMt2(*p4) )
+    return np.array(mt2)
+
+"""
+M_{T2} computed event by event with the C++ Davismt2 (None if the library can't be loaded)
+"""
+def runDavis(vis1,vis2,child,mn):
+    ROOT.gSystem.Load('libTopLJets2015TopAnalysis')
+    if not hasattr(ROOT,'Davismt2') : return None
+
+    davis=ROOT.Davismt2()
+    davis.set_mn(mn)
+    mt2=[]
+    for i in xrange(0,len(vis1)):
+        pa=np.array([np.sqrt(max(vis1[i,3]**2-(vis1[i,:3]**2).sum(),0.)),vis1[i,0],vis1[i,1]])
+        pb=np.array([np.sqrt(max(vis2[i,3]**2-(vis2[i,:3]**2).sum(),0.)),vis2[i,0],vis2[i,1]])
+        pmiss=np.array([0.,child[i,0],child[i,1]])
+        davis.set_momenta(pa,pb,pmiss)
+        mt2.append( davis.get_mt2() )
+    return np.array(mt2)
+
+"""
+prints the comparison of two sets of M_{T2} values, returns True if all agree within the relative tolerance
+"""
+def compare(title,ref,test,tol):
+    diff=np.abs(test-ref)/np.maximum(np.abs(ref),1.)
+    nbad=(diff>tol).sum()
+    print '\t %-30s max rel. diff=%3.2e  %d/%d above %3.1e'%(title,diff.max(),nbad,len(ref),tol)
+    return nbad==0
+
+"""
+steer
+"""
+def main():
+
+    usage = 'usage: %prog [options]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('-n', '--nevents',  dest='nevents',  help='configurations to generate per mode [%default]',       default=2000,  type=int)
+    parser.add_option(      '--seed',     dest='seed',     help='seed of the random generator [%default]',              default=42,    type=int)
+    parser.add_option(      '--tol',      dest='tol',      help='relative tolerance w.r.t. calcMt2 [%default]',         default=1e-9,  type=float)
+    parser.add_option(      '--davisTol', dest='davisTol', help='relative tolerance w.r.t. Davismt2 [%default]',        default=1e-4,  type=float)
+    (opt, args) = parser.parse_args()
+
+    rng=np.random.RandomState(opt.seed)
+    allOk=True
+    for mode in ['massless','massive','mixed']:
+        vis1,vis2,child,mn=generateConfigurations(opt.nevents,mode,rng)
+        print '%s configurations (invisible mass %3.1f GeV)'%(mode,mn)
+
+        start=time.time()
+        batch=calcMt2Batch(vis1,vis2,child)
+        tBatch=time.time()-start
+
+        start=time.time()
+        scalar=runScalar(vis1,vis2,child)
+        tScalar=time.time()-start
+        print '\t calcMt2 %3.2fs calcMt2Batch %3.2fs'%(tScalar,tBatch)
+        allOk &= compare('calcMt2Batch vs calcMt2',scalar,batch,opt.tol)
+
+        davis=runDavis(vis1,vis2,child,mn)
+        if davis is None:
+            print '\t Davismt2 is not available, comparison skipped'
+            continue
+        allOk &= compare('calcMt2Batch vs Davismt2',davis,batch,opt.davisTol)
+
+    return 0 if allOk else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,671 @@
+import ROOT
+import numpy as np
+import random
+import sys
+from TopLJets2015.TopAnalysis.myProgressBar import *
+from EventSummary import EventSummary
+from MixingBank import MIXSIDES
+from PPSFiducialCuts import isPixelFiducialArrays
+from runExclusiveAnalysis import VALIDLHCXANGLES,DIMUONS,EMU,DIELECTRONS,SINGLEPHOTON,getEraCumulativeFractions
+
+"""
+columnar version of the event loop in runExclusiveAnalysis for data and background samples
+the branches are read in chunks to numpy arrays and the event categories, proton kinematics,
+event mixing and event summary are computed with array operations
+the operations of the TLorentzVector-based event loop are reproduced one by one and the random numbers
+are consumed in the same sequence (python random for the era and mixed event choice, numpy for the pixel veto in MC)
+so that, for the same seeds, the output data tree matches the one of the event loop
+"""
+
+CHUNKSIZE=2000
+ERAS=['2017%s'%x for x in 'BCDEF']
+EVCATEGS=['ee','em','mm','offz','a','zbias']
+MIXCATEGS=[DIMUONS,EMU]
+EVBRANCHES=['evcat','isZ','isA','isSS','hasATrigger','hasZBTrigger','mboson','beamXangle','evwgt',
+            'l1pt','l1eta','l1phi','ml1','l2pt','l2eta','l2phi','ml2',
+            'bosonpt','bosoneta','bosonphi',
+            'nvtx','nchPV','rho','met_pt','met_phi','metfilters',
+            'nj','j1pt','j1eta','j1phi','j1m','j2pt','j2eta','j2phi','j2m',
+            'nrawmu','rawmu_pt','rawmu_eta','rawmu_phi'] \
+            + ['PF%sSum%s'%(v,d) for v in ['Mult','Ht','Pz'] for d in ['HF','HE','EE','EB']]
+DATABRANCHES=['run','lumi','event',
+              'nProtons','protonCsi','isFarRPProton','isMultiRPProton','isPosRPProton',
+              'protonX','protonTX','protonY','protonTY']
+
+
+def flattenJagged(col,counts):
+
+    """flattens a variable-size (object) or a fixed-size (2D) array branch keeping the first counts entries per event"""
+
+    counts=np.asarray(counts,dtype=np.int64)
+    if col.dtype==object:
+        if counts.sum()==0: return np.zeros(0,dtype=np.float64)
+        return np.concatenate([np.asarray(c[:n]) for c,n in zip(col,counts)])
+    mask=np.arange(col.shape[1])[np.newaxis,:]<counts[:,np.newaxis]
+    return col[mask]
+
+
+def phiMpiPi(x):
+
+    """same as ROOT.TVector2.Phi_mpi_pi for arrays"""
+
+    x=np.array(x,dtype=np.float64)
+    while True:
+        mask=(x>=np.pi)
+        if not mask.any(): break
+        x[mask] -= 2.*np.pi
+    while True:
+        mask=(x<-np.pi)
+        if not mask.any(): break
+        x[mask] += 2.*np.pi
+    return x
+
+
+def p4FromPtEtaPhiM(pt,eta,phi,m):
+
+    """same as TLorentzVector.SetPtEtaPhiM for arrays, returns (px,py,pz,E)"""
+
+    pt=np.abs(pt)
+    px,py,pz=pt*np.cos(phi),pt*np.sin(phi),pt*np.sinh(eta)
+    p2=px*px+py*py+pz*pz
+    en=np.where(m>=0, np.sqrt(p2+m*m), np.sqrt(np.maximum(p2-m*m,0.)))
+    return px,py,pz,en
+
+
+def p4Pt(p4):
+    return np.sqrt(p4[0]*p4[0]+p4[1]*p4[1])
+
+
+def p4M(p4):
+    mm=p4[3]*p4[3]-(p4[0]*p4[0]+p4[1]*p4[1]+p4[2]*p4[2])
+    return np.where(mm<0.,-1.,1.)*np.sqrt(np.abs(mm))
+
+
+def p4Rapidity(p4):
+    with np.errstate(all='ignore'):
+        return 0.5*np.log( (p4[3]+p4[2])/(p4[3]-p4[2]) )
+
+
+def p4Eta(p4):
+    ptot=np.sqrt(p4[0]*p4[0]+p4[1]*p4[1]+p4[2]*p4[2])
+    with np.errstate(all='ignore'):
+        cosTheta=np.where(ptot==0.,1.,p4[2]/ptot)
+        eta=-0.5*np.log( (1.0-cosTheta)/(1.0+cosTheta) )
+    return np.where(cosTheta*cosTheta<1, eta, np.where(p4[2]==0.,0.,np.where(p4[2]>0,10e10,-10e10)))
+
+
+def p4Phi(p4):
+    return np.where((p4[0]==0.) & (p4[1]==0.), 0., np.arctan2(p4[1],p4[0]))
+
+
+def p4Sum(a,b):
+    return tuple(a[i]+b[i] for i in range(4))
+
+
+def computeCosThetaStarArrays(lm,lp):
+
+    """same as computeCosThetaStar for arrays"""
+
+    dil=p4Sum(lm,lp)
+    dilM=p4M(dil)
+    with np.errstate(all='ignore'):
+        costhetaCS = 1./dilM
+        costhetaCS = np.where(dil[2]<0, -costhetaCS, costhetaCS)
+        costhetaCS *= (lm[3] + lm[2]) * (lp[3] - lp[2]) - (lm[3] - lm[2]) * (lp[3] + lp[2])
+        costhetaCS /= np.sqrt( dilM*dilM + p4Pt(dil)**2 )
+    return costhetaCS
+
+
+def buildDiProtonArrays(csi_pos,csi_neg,sqrts=13000.):
+
+    """same as buildDiProton for arrays"""
+
+    beamP=0.5*sqrts
+    return (np.zeros_like(csi_pos),np.zeros_like(csi_pos),beamP*(csi_pos-csi_neg),beamP*(csi_pos+csi_neg))
+
+
+def buildMissingMassSystemArrays(pp,boson):
+
+    """same as buildMissingMassSystem for arrays"""
+
+    return tuple(pp[i]-boson[i] for i in range(4))
+
+
+def isValidRunLumiArrays(run,lumi,runLumiList):
+
+    """same as isValidRunLumi for arrays"""
+
+    mask=np.ones(len(run),dtype=bool)
+    if not runLumiList:
+        return mask
+    for r in np.unique(run):
+        if not int(r) in runLumiList: continue
+        inRun=(run==r)
+        for lran in runLumiList[int(r)]:
+            mask[inRun & (lumi>=lran[0]) & (lumi<=lran[1])]=False
+    return mask
+
+
+def vetoPixels2017Arrays(run,eraIdx,isData,nCalls):
+
+    """
+    same as vetoPixels2017 for arrays, returns a (nev,nCalls) mask
+    in MC the random numbers are drawn for each call as in the event loop
+    """
+
+    nev=len(eraIdx)
+    isEraC=(eraIdx==ERAS.index('2017C'))[:,np.newaxis]
+    isEraD=(eraIdx==ERAS.index('2017D'))[:,np.newaxis]
+    isEraF=(eraIdx==ERAS.index('2017F'))[:,np.newaxis]
+    if isData:
+        run=run[:,np.newaxis]
+        veto = isEraD | (isEraC & (run>=300806) & (run<=302029)) | (isEraF & (run>=305178))
+        return np.repeat(veto,nCalls,axis=1)
+
+    subEra=np.zeros((nev,nCalls),dtype=np.float64)
+    notD=~isEraD[:,0]
+    subEra[notD,:]=np.random.uniform(size=(notD.sum(),nCalls))
+    return isEraD | (isEraC & (subEra>0.607)) | (isEraF & (subEra>0.128))
+
+
+def drawUniforms(n):
+
+    """draws n numbers from the python random generator in the same sequence as n calls in the event loop"""
+
+    rnd=random.random
+    return np.array([rnd() for _ in xrange(n)],dtype=np.float64)
+
+
+class ProtonCollection:
+
+    """
+    protons for a set of events grouped by side ('pos','neg') and algorithm (0 multi, 1 far/pixels, 2 near/strips)
+    for each group it holds the number of protons per event, the flat list of csi (sorted by decreasing csi in each event)
+    and the event position of each proton
+    """
+
+    def __init__(self,nev):
+        self.nev=nev
+        self.groups={}
+        for side in MIXSIDES:
+            for algo in range(3):
+                self.groups[(side,algo)]=(np.zeros(nev,dtype=np.int64),np.zeros(0,dtype=np.float64),np.zeros(0,dtype=np.int64))
+
+    @classmethod
+    def fromGroups(cls,nev,side,algo,csi,evpos):
+
+        """builds the collection from flat arrays (the ordering within each event is done here)"""
+
+        coll=cls(nev)
+        for iside,sideName in enumerate(MIXSIDES):
+            for ialgo in range(3):
+                mask=(side==iside) & (algo==ialgo)
+                icsi,ievpos=csi[mask],evpos[mask]
+                order=np.lexsort((-icsi,ievpos))
+                coll.groups[(sideName,ialgo)]=(np.bincount(ievpos,minlength=nev),icsi[order],ievpos[order])
+        return coll
+
+    def counts(self,side,algo):
+        return self.groups[(side,algo)][0]
+
+    def leading(self,side,algo):
+
+        """csi of the first proton in each event (0 if none)"""
+
+        counts,csi,_=self.groups[(side,algo)]
+        lead=np.zeros(self.nev,dtype=np.float64)
+        hasProtons=(counts>0)
+        lead[hasProtons]=csi[(np.cumsum(counts)-counts)[hasProtons]]
+        return lead
+
+    def clear(self,side,algo,evMask):
+
+        """removes the protons from the events flagged in evMask"""
+
+        counts,csi,evpos=self.groups[(side,algo)]
+        keep=~evMask[evpos]
+        self.groups[(side,algo)]=(np.where(evMask,0,counts),csi[keep],evpos[keep])
+
+    def doFinalCheck2017(self,veto):
+
+        """same as doFinalCheck2017: if vetoed, pixel-only protons are removed"""
+
+        for side in MIXSIDES:
+            self.clear(side,1,veto & (self.counts(side,0)==0))
+
+
+def getTracksPerRomanPotArrays(ev,nev,evEra,xangle,isRPIn,minCsi,usePixelOnly,applyPxFid=True):
+
+    """same as getTracksPerRomanPot (reconstructed csi) for arrays of events"""
+
+    nProtons=np.where(isRPIn,ev['nProtons'],0)
+    evpos=np.repeat(np.arange(nev),nProtons)
+    csi=flattenJagged(ev['protonCsi'],nProtons).astype(np.float64)
+    isFar=flattenJagged(ev['isFarRPProton'],nProtons).astype(bool)
+    isMulti=flattenJagged(ev['isMultiRPProton'],nProtons).astype(bool)
+    isPos=flattenJagged(ev['isPosRPProton'],nProtons).astype(bool)
+
+    keep=~(csi<minCsi)
+
+    #fiducial cut
+    if applyPxFid:
+        x=flattenJagged(ev['protonX'],nProtons).astype(np.float64)
+        tx=flattenJagged(ev['protonTX'],nProtons).astype(np.float64)
+        y=flattenJagged(ev['protonY'],nProtons).astype(np.float64)
+        ty=flattenJagged(ev['protonTY'],nProtons).astype(np.float64)
+        toCheck=keep & (isMulti | isFar)
+        keep[toCheck]=isPixelFiducialArrays(evEra,np.where(isPos[toCheck],45,56),
+                                            x[toCheck],tx[toCheck],y[toCheck],ty[toCheck],
+                                            csi[toCheck],xangle[evpos[toCheck]])
+
+    algo=np.where(isMulti,0,np.where(isFar,1,2))
+    side=np.where(isPos,0,1)
+    coll=ProtonCollection.fromGroups(nev,side[keep],algo[keep],csi[keep],evpos[keep])
+
+    #reset multi and strips
+    if usePixelOnly:
+        for sideName in MIXSIDES:
+            for ialgo in [0,2]:
+                coll.clear(sideName,ialgo,np.ones(nev,dtype=bool))
+
+    return coll
+
+
+def hasMixingBank(evMixTool,key):
+
+    """checks if there are events to mix for a (era,xangle,category) key (as getNew, events without a bank get no mixed protons)"""
+
+    try:
+        return len(evMixTool.getBank(key))>0
+    except KeyError:
+        return False
+
+
+def getMixedProtonCollection(evMixTool,keys,mixIdx,nev,usePixelOnly):
+
+    """
+    builds the proton collection of the events drawn from the mixing banks of the event mixing tool
+    keys is a list of (bank key, event mask) and mixIdx the index of the mixed event for each event
+    """
+
+    side,algo,csi,evpos=[],[],[],[]
+    for key,evMask in keys:
+        if not hasMixingBank(evMixTool,key): continue
+        ievpos=np.nonzero(evMask)[0]
+        for iside,sideName in enumerate(MIXSIDES):
+            for ialgo in range(3):
+                if usePixelOnly and ialgo!=1: continue
+                _,icsi,iidx=evMixTool.getBank(key).getProtons(mixIdx[ievpos],sideName,ialgo)
+                csi.append(icsi)
+                evpos.append(ievpos[iidx])
+                side.append(np.full(len(icsi),iside,dtype=np.int64))
+                algo.append(np.full(len(icsi),ialgo,dtype=np.int64))
+    if len(csi)==0:
+        return ProtonCollection(nev)
+    return ProtonCollection.fromGroups(nev,np.concatenate(side),np.concatenate(algo),np.concatenate(csi),np.concatenate(evpos))
+
+
+def getDiProtonCategoryArrays(nmulti_pos,csi_multi_pos,npix_pos,csi_pix_pos,
+                              nmulti_neg,csi_multi_neg,npix_neg,csi_pix_neg,
+                              allowPixMult):
+
+    """same as getDiProtonCategory for arrays, returns the category and the csi of the selected protons"""
+
+    pixOnly_pos=(nmulti_pos==0) & np.in1d(npix_pos,allowPixMult).reshape(npix_pos.shape)
+    pixOnly_neg=(nmulti_neg==0) & np.in1d(npix_neg,allowPixMult).reshape(npix_neg.shape)
+    cat1=(nmulti_pos==1) & (nmulti_neg==1)
+    cat2=(nmulti_pos==1) & pixOnly_neg
+    cat3=pixOnly_pos & (nmulti_neg==1)
+    cat4=pixOnly_pos & pixOnly_neg
+    proton_cat=np.select([cat1,cat2,cat3,cat4],[1,2,3,4],-1)
+    csi_pos=np.select([cat1|cat2,cat3|cat4],[csi_multi_pos,csi_pix_pos],0.)
+    csi_neg=np.select([cat1|cat3,cat2|cat4],[csi_multi_neg,csi_pix_neg],0.)
+    return proton_cat,csi_pos,csi_neg
+
+
+def applyPixelVeto(nmulti,npix,veto):
+
+    """number of pixel protons after doFinalCheck2017"""
+
+    return np.where(veto & (nmulti==0),0,npix)
+
+
+def fillByCategory(ht,catMasks,key,vals,wgts,evpos=None,pfix=None):
+
+    """fills the histograms for each category, evpos maps the values to the events for per-object quantities"""
+
+    for cat,mask in catMasks:
+        sel=mask if evpos is None else mask[evpos]
+        ht.fillN(vals[sel],wgts[sel],key,[cat],pfix)
+
+
+def runColumnarEventLoop(tree,nEntries,ht,tOut,evMixTool,isData,era,isDY,runLumiList,allowPixMult,usePixelOnly,minCsi,chunkSize=CHUNKSIZE):
+
+    """
+    processes the tree in chunks filling the histograms in ht and the event summary tree tOut
+    only data and background samples with a mixing bank are supported
+    """
+
+    from root_numpy import tree2array,array2tree
+
+    dtype=EventSummary().getNumpyDtype()
+    branches=EVBRANCHES+(DATABRANCHES if isData else [])
+    nMixTries=100 if isData else 1
+    nTries=2*nMixTries+1 if isData or isDY else 0
+    nDraws=len(MIXCATEGS)*(1+(nTries-1 if nTries>0 else 0))
+
+    for start in xrange(0,nEntries,chunkSize):
+
+        drawProgressBar(float(start)/float(nEntries))
+        ev=tree2array(tree,branches=branches,start=start,stop=min(start+chunkSize,nEntries))
+
+        #base event selection
+        evcat=ev['evcat']
+        isZ,isSS=ev['isZ'].astype(bool),ev['isSS'].astype(bool)
+        isOffZ=(ev['mboson']>101) & ((evcat==DIELECTRONS) | (evcat==DIMUONS))
+        catIdx=np.select([ (evcat==DIELECTRONS) & isZ,
+                           (evcat==EMU) & ~isSS,
+                           (evcat==DIMUONS) & isZ,
+                           isOffZ,
+                           (evcat==SINGLEPHOTON) & ev['hasATrigger'].astype(bool),
+                           (evcat==0) & ev['hasZBTrigger'].astype(bool) ],
+                         range(len(EVCATEGS)),-1)
+        ev,isOffZ,catIdx=ev[catIdx>=0],isOffZ[catIdx>=0],catIdx[catIdx>=0]
+        nev=len(ev)
+        if nev==0: continue
+        evcat=ev['evcat']
+
+        #assign data-taking era and crossing angle and draw the events to mix
+        beamXangle=ev['beamXangle'].astype(np.int64)
+        if isData:
+            eraIdx=np.full(nev,ERAS.index(era),dtype=np.int64)
+            hasMixDraws=np.in1d(beamXangle,VALIDLHCXANGLES)
+            mixU=np.zeros((nev,nDraws),dtype=np.float64)
+            mixU[hasMixDraws,:]=drawUniforms(hasMixDraws.sum()*nDraws).reshape(-1,nDraws)
+        else:
+            u=drawUniforms(nev*(1+nDraws)).reshape(nev,1+nDraws)
+            cum_fracs=getEraCumulativeFractions(False,False)
+            eraIdx=np.array([ERAS.index(cum_fracs[i][0]) for i in np.searchsorted([cf for _,cf in cum_fracs],u[:,0],side='left')],dtype=np.int64)
+            for i in xrange(nev):
+                xbin=evMixTool.getRandomLHCCrossingAngle(evEra=ERAS[eraIdx[i]],evCat=SINGLEPHOTON if ev['isA'][i] else DIMUONS)
+                beamXangle[i]=VALIDLHCXANGLES[xbin]
+            hasMixDraws=np.ones(nev,dtype=bool)
+            mixU=u[:,1:]
+        mixU=mixU.reshape(nev,-1,len(MIXCATEGS))
+
+        #index of the mixed events in the bank for the first draw and all the tries
+        mixKeys=[]
+        mixIdx=np.zeros(mixU.shape,dtype=np.int64)
+        for iera,xangle in set(zip(eraIdx[hasMixDraws],beamXangle[hasMixDraws])):
+            evMask=hasMixDraws & (eraIdx==iera) & (beamXangle==xangle)
+            mixKeys.append( ((ERAS[iera],xangle),evMask) )
+            for icat,mixEvCat in enumerate(MIXCATEGS):
+                if not hasMixingBank(evMixTool,(ERAS[iera],xangle,mixEvCat)): continue
+                mixIdx[evMask,:,icat]=evMixTool.drawIndices((ERAS[iera],xangle,mixEvCat),u=mixU[evMask,:,icat])
+
+        #check if RP is in (MC assume true by default)
+        run=ev['run'].astype(np.int64) if isData else np.full(nev,-1,dtype=np.int64)
+        if isData:
+            isRPIn=np.in1d(beamXangle,VALIDLHCXANGLES) & isValidRunLumiArrays(run,ev['lumi'],runLumiList)
+        else:
+            isRPIn=np.ones(nev,dtype=bool)
+
+        #lepton kinematics
+        f64=lambda x : np.asarray(x,dtype=np.float64)
+        hasLeptons=(evcat!=SINGLEPHOTON) & (evcat!=0)
+        zeros=np.zeros(nev,dtype=np.float64)
+        l1p4=tuple(np.where(hasLeptons,c,0.) for c in p4FromPtEtaPhiM(f64(ev['l1pt']),f64(ev['l1eta']),f64(ev['l1phi']),f64(ev['ml1'])))
+        l2p4=tuple(np.where(hasLeptons,c,0.) for c in p4FromPtEtaPhiM(f64(ev['l2pt']),f64(ev['l2eta']),f64(ev['l2phi']),f64(ev['ml2'])))
+        acopl=np.where(hasLeptons,1.0-np.abs(phiMpiPi(f64(ev['l1phi'])-f64(ev['l2phi'])))/np.pi,0.)
+        costhetacs=np.where(hasLeptons,computeCosThetaStarArrays(l1p4,l2p4),0.)
+
+        #force ordering by pT (before they were ordered by charge to compute costhetacs)
+        swap=p4Pt(l1p4)<p4Pt(l2p4)
+        l1p4,l2p4=tuple(np.where(swap,l2p4[i],l1p4[i]) for i in range(4)),tuple(np.where(swap,l1p4[i],l2p4[i]) for i in range(4))
+
+        #boson kinematics
+        boson=p4FromPtEtaPhiM(f64(ev['bosonpt']),f64(ev['bosoneta']),f64(ev['bosonphi']),f64(ev['mboson']))
+        bosonPt=p4Pt(boson)
+
+        #PU-related variables
+        nvtx,nch,rho,met,njets=ev['nvtx'],ev['nchPV'],f64(ev['rho']),f64(ev['met_pt']),ev['nj']
+        PFMultSumHF,PFHtSumHF,PFPzSumHF=f64(ev['PFMultSumHF']),f64(ev['PFHtSumHF']),f64(ev['PFPzSumHF'])
+
+        nrawmu=ev['nrawmu'].astype(np.int64)
+        mu_evpos=np.repeat(np.arange(nev),nrawmu)
+        mup4=p4FromPtEtaPhiM(f64(flattenJagged(ev['rawmu_pt'],nrawmu)),
+                             f64(flattenJagged(ev['rawmu_eta'],nrawmu))/10.,
+                             f64(flattenJagged(ev['rawmu_phi'],nrawmu))/10.,
+                             np.full(len(mu_evpos),0.105))
+        isExtraMu=np.ones(len(mu_evpos),dtype=bool)
+        for lp4 in [l1p4,l2p4]:
+            deta=p4Eta(mup4)-p4Eta(lp4)[mu_evpos]
+            dphi=phiMpiPi(p4Phi(mup4)-p4Phi(lp4)[mu_evpos])
+            isExtraMu &= ~(np.sqrt(deta*deta+dphi*dphi)<0.05)
+        n_extra_mu=np.bincount(mu_evpos[isExtraMu],minlength=nev)
+
+        metphi=f64(ev['met_phi'])
+        mpf=1.+(met*np.cos(metphi)*boson[0]+met*np.sin(metphi)*boson[1])/(bosonPt**2+1.0e-6)
+        zjb=np.where(njets>0,f64(ev['j1pt'])-bosonPt,0.)
+        j1p4=p4FromPtEtaPhiM(f64(ev['j1pt']),f64(ev['j1eta']),f64(ev['j1phi']),f64(ev['j1m']))
+        j2p4=p4FromPtEtaPhiM(f64(ev['j2pt']),f64(ev['j2eta']),f64(ev['j2phi']),f64(ev['j2m']))
+        zj2b=np.where(njets>1,p4Pt(p4Sum(j1p4,j2p4))-bosonPt,0.)
+
+        #proton tracks: for data the ones in the event, for MC the ones from the first mixed event
+        if isData:
+            protons=getTracksPerRomanPotArrays(ev,nev,era,beamXangle,isRPIn,minCsi,usePixelOnly)
+        else:
+            protons=getMixedProtonCollection(evMixTool,[((k[0],k[1],DIMUONS),m) for k,m in mixKeys],mixIdx[:,0,0],nev,usePixelOnly)
+
+        #the pixel veto is applied at event level and for each try (nominal and systematic selection)
+        veto=vetoPixels2017Arrays(run,eraIdx,isData,1+2*nTries)
+        protons.doFinalCheck2017(veto[:,0])
+        nmulti={s:protons.counts(s,0) for s in MIXSIDES}
+        npix={s:protons.counts(s,1) for s in MIXSIDES}
+        csimulti={s:protons.leading(s,0) for s in MIXSIDES}
+        csipix={s:protons.leading(s,1) for s in MIXSIDES}
+        proton_cat,csi_pos,csi_neg=getDiProtonCategoryArrays(nmulti['pos'],csimulti['pos'],npix['pos'],csipix['pos'],
+                                                             nmulti['neg'],csimulti['neg'],npix['neg'],csipix['neg'],
+                                                             allowPixMult)
+        ppSystem=buildDiProtonArrays(csi_pos,csi_neg)
+        mmassSystem=buildMissingMassSystemArrays(ppSystem,boson)
+
+        #compare categorization with fully exclusive selection of pixels
+        ones=np.ones(nev,dtype=np.float64)
+        ht.fillN(zeros,ones,'catcount',['inc'])
+        hasPixPair=np.in1d(npix['pos'],allowPixMult) & np.in1d(npix['neg'],allowPixMult)
+        ht.fillN(ones[hasPixPair],ones[hasPixPair],'catcount',['inc'])
+        ht.fillN(proton_cat+1.,ones,'catcount',['inc'])
+
+        #event categories
+        catMasks=[]
+        for icat,c in enumerate(EVCATEGS):
+            isCat=(catIdx==icat)
+            if not isCat.any(): continue
+            catMasks += [(c,isCat), (c+'rpin',isCat & isRPIn), (c+'rpinhpur',isCat & isRPIn & (proton_cat>0))]
+
+        #fill control plots
+        wgt=f64(ev['evwgt'])
+        def fill(key,vals,valid=None,pfix=None):
+            if valid is None:
+                fillByCategory(ht,catMasks,key,f64(vals),wgt,pfix=pfix)
+            else:
+                evpos=np.nonzero(valid)[0]
+                fillByCategory(ht,catMasks,key,f64(vals)[evpos],wgt[evpos],evpos=evpos,pfix=pfix)
+
+        #boson kinematics
+        fill('l1pt',       p4Pt(l1p4))
+        fill('l2pt',       p4Pt(l2p4))
+        fill('l1eta',      np.abs(p4Eta(l1p4)))
+        fill('l2eta',      np.abs(p4Eta(l2p4)))
+        fill('acopl',      acopl)
+        fill('mll',        p4M(boson))
+        fill('mll_full',   p4M(boson))
+        fill('yll',        p4Rapidity(boson))
+        fill('etall',      p4Eta(boson))
+        fill('ptll',       bosonPt)
+        fill('ptll_high',  bosonPt)
+        fill('costhetacs', costhetacs)
+
+        #pileup related
+        fill('xangle',     beamXangle)
+        fill('nvtx',       nvtx)
+        fill('rho',        rho)
+        fill('met',        met)
+        fill('mpf',        mpf)
+        fill('njets',      njets)
+        fill('zjb',        zjb,  valid=(njets>0))
+        fill('zj2b',       zj2b, valid=(njets>1))
+        fill('nch',        nch)
+        fill('PFMultHF',   PFMultSumHF)
+        fill('PFHtHF',     PFHtSumHF)
+        fill('PFPZHF',     PFPzSumHF/1.e3)
+        fill('nextramu',   n_extra_mu)
+        fill('metbits',    ev['metfilters'])
+        for sd in ['HE','EE','EB']:
+            fill('PFMult'+sd, ev['PFMultSum'+sd])
+            fill('PFHt'+sd,   ev['PFHtSum'+sd])
+            fill('PFPZ'+sd,   f64(ev['PFPzSum'+sd])/1.e3)
+        mu_evpos=mu_evpos[isExtraMu]
+        fillByCategory(ht,catMasks,'extramupt',  p4Pt(mup4)[isExtraMu],          wgt[mu_evpos], evpos=mu_evpos)
+        fillByCategory(ht,catMasks,'extramueta', np.abs(p4Eta(mup4))[isExtraMu], wgt[mu_evpos], evpos=mu_evpos)
+
+        #proton counting and kinematics
+        for ip in range(3):
+            for side in MIXSIDES:
+                rpside='%d%s'%(ip,side)
+                counts,csi,evpos=protons.groups[(side,ip)]
+                fill('ntk',counts,pfix=rpside)
+                fillByCategory(ht,catMasks,'csi',csi,wgt[evpos],evpos=evpos,pfix=rpside)
+
+        #diproton kinematics
+        hasPP=(proton_cat>0)
+        fill('ppcount', hasPP.astype(np.float64))
+        fill('mpp',     p4M(ppSystem),        valid=hasPP)
+        fill('pzpp',    ppSystem[2],          valid=hasPP)
+        fill('ypp',     p4Rapidity(ppSystem), valid=hasPP)
+        mmass=p4M(mmassSystem)
+        fill('mmass_full', mmass, valid=hasPP)
+        for c in range(1,5):
+            fill('mmass_full', mmass, valid=(proton_cat==c), pfix='%d'%c)
+        fill('mmass', mmass, valid=hasPP & (mmass>0))
+        for c in range(1,5):
+            fill('mmass', mmass, valid=(proton_cat==c) & (mmass>0), pfix='%d'%c)
+
+        if nTries==0: continue
+
+        #proton multiplicities and leading csi for each try (nominal and systematic selection)
+        #first try uses the protons in the event (csi shifted by 1% for the systematic selection)
+        #the next nMixTries use the mixed events for the mumu and emu categories (mixType=1)
+        #the last nMixTries use the mixed mumu event in one side and the protons in the event in the other (mixType=2)
+        mixed={}
+        for icat,mixEvCat in enumerate(MIXCATEGS):
+            for side in MIXSIDES:
+                for algo in [0,1]:
+                    n,lead=np.zeros((nev,nTries-1),dtype=np.int64),np.zeros((nev,nTries-1),dtype=np.float64)
+                    if not (usePixelOnly and algo==0):
+                        for (iera,xangle),evMask in mixKeys:
+                            if not hasMixingBank(evMixTool,(iera,xangle,mixEvCat)): continue
+                            bank=evMixTool.getBank((iera,xangle,mixEvCat))
+                            idx=mixIdx[evMask,1:,icat]
+                            n[evMask,:]=bank.getNProtons(side,algo)[idx]
+                            lead[evMask,:]=bank.getLeadingXi(side,algo)[idx]
+                    mixed[(mixEvCat,side,algo)]=(n,lead)
+
+        iMix1=slice(1,nMixTries+1)
+        iMix2=slice(nMixTries+1,nTries)
+        sel={}
+        for sel_type in ['nom','syst']:
+            for side in MIXSIDES:
+                for algo in [0,1]:
+                    nbase=protons.counts(side,algo)
+                    leadbase=protons.leading(side,algo)
+                    n=np.zeros((nev,nTries),dtype=np.int64)
+                    lead=np.zeros((nev,nTries),dtype=np.float64)
+                    n[:,0]=nbase
+                    lead[:,0]=leadbase if sel_type=='nom' else 1.01*leadbase
+                    mixn,mixlead=mixed[(DIMUONS if sel_type=='nom' else EMU,side,algo)]
+                    n[:,iMix1],lead[:,iMix1]=mixn[:,iMix1.start-1:iMix1.stop-1],mixlead[:,iMix1.start-1:iMix1.stop-1]
+                    useMixed=(side=='pos')==(sel_type=='nom')
+                    mixn,mixlead=mixed[(DIMUONS,side,algo)]
+                    if useMixed:
+                        n[:,iMix2],lead[:,iMix2]=mixn[:,iMix2.start-1:iMix2.stop-1],mixlead[:,iMix2.start-1:iMix2.stop-1]
+                    else:
+                        n[:,iMix2],lead[:,iMix2]=nbase[:,np.newaxis],leadbase[:,np.newaxis]
+                    sel[(sel_type,side,algo)]=(n,lead)
+
+        #apply the pixel veto and categorize
+        i_boson=tuple(c[:,np.newaxis] for c in boson)
+        results={}
+        for isel,sel_type in enumerate(['nom','syst']):
+            iveto=veto[:,1+isel::2]
+            npix_pos=applyPixelVeto(sel[(sel_type,'pos',0)][0],sel[(sel_type,'pos',1)][0],iveto)
+            npix_neg=applyPixelVeto(sel[(sel_type,'neg',0)][0],sel[(sel_type,'neg',1)][0],iveto)
+            i_proton_cat,i_csi_pos,i_csi_neg=getDiProtonCategoryArrays(sel[(sel_type,'pos',0)][0],sel[(sel_type,'pos',0)][1],npix_pos,sel[(sel_type,'pos',1)][1],
+                                                                       sel[(sel_type,'neg',0)][0],sel[(sel_type,'neg',0)][1],npix_neg,sel[(sel_type,'neg',1)][1],
+                                                                       allowPixMult)
+            i_ppSystem=buildDiProtonArrays(i_csi_pos,i_csi_neg)
+            i_mmassSystem=buildMissingMassSystemArrays(i_ppSystem,i_boson)
+            results[sel_type]=(i_proton_cat,i_csi_pos,i_csi_neg,i_ppSystem,i_mmassSystem)
+
+        #if no selection passes the cuts ignore its summary
+        passAtLeastOneSelection=(results['nom'][0]>0) | (results['syst'][0]>0)
+        nPass=passAtLeastOneSelection.sum()
+        if nPass==0: continue
+
+        #fill the event summary
+        def perTry(vals):
+            return np.broadcast_to(np.asarray(vals)[:,np.newaxis],(nev,nTries))[passAtLeastOneSelection]
+
+        evSummary=np.zeros(nPass,dtype=dtype)
+        if isData:
+            evSummary['run']=perTry(run)
+            evSummary['event']=perTry(ev['event'])
+            evSummary['lumi']=perTry(ev['lumi'])
+        for name,vals in [('era',[ord(ERAS[x][-1]) for x in eraIdx]),('cat',evcat),('isOffZ',isOffZ),('xangle',beamXangle),
+                          ('l1pt',p4Pt(l1p4)),('l1eta',p4Eta(l1p4)),('l2pt',p4Pt(l2p4)),('l2eta',p4Eta(l2p4)),
+                          ('bosonm',p4M(boson)),('bosonpt',bosonPt),('bosoneta',p4Eta(boson)),('bosony',p4Rapidity(boson)),
+                          ('acopl',acopl),('costhetacs',costhetacs),('njets',njets),('mpf',mpf),('zjb',zjb),('zj2b',zj2b),
+                          ('nch',nch),('nvtx',nvtx),('rho',rho),
+                          ('PFMultSumHF',PFMultSumHF),('PFHtSumHF',PFHtSumHF),('PFPzSumHF',PFPzSumHF)]:
+            evSummary[name]=perTry(vals)
+        evSummary['gen_pzwgtUp']=1.
+        evSummary['gen_pzwgtDown']=1.
+
+        mixType=np.zeros((nev,nTries),dtype=np.int32)
+        mixType[:,iMix1]=1
+        mixType[:,iMix2]=2
+        evSummary['mixType']=mixType[passAtLeastOneSelection]
+        itry_wgt=np.empty((nev,nTries),dtype=np.float64)
+        itry_wgt[:,0]=wgt
+        itry_wgt[:,1:]=(wgt/float(nMixTries))[:,np.newaxis]
+        evSummary['wgt']=itry_wgt[passAtLeastOneSelection]
+
+        for pfix,sel_type in [('','nom'),('syst','syst')]:
+            i_proton_cat,i_csi_pos,i_csi_neg,i_ppSystem,i_mmassSystem=results[sel_type]
+            i_proton_cat=i_proton_cat[passAtLeastOneSelection]
+            i_ppSystem=tuple(c[passAtLeastOneSelection] for c in i_ppSystem)
+            i_mmassSystem=tuple(np.broadcast_to(c,(nev,nTries))[passAtLeastOneSelection] for c in i_mmassSystem)
+            hasPP=(i_proton_cat>0)
+            evSummary[pfix+'protonCat']=i_proton_cat
+            for name,vals in [('csi1',      i_csi_pos[passAtLeastOneSelection]),
+                              ('csi2',      i_csi_neg[passAtLeastOneSelection]),
+                              ('mpp',       p4M(i_ppSystem)),
+                              ('ypp',       p4Rapidity(i_ppSystem)),
+                              ('pzpp',      i_ppSystem[2]),
+                              ('mmiss',     p4M(i_mmassSystem)),
+                              ('ymmiss',    p4Rapidity(i_mmassSystem)),
+                              ('ppsEff',    1.0),
+                              ('ppsEffUnc', 0.0)]:
+                evSummary[pfix+name]=np.where(hasPP,vals,0.)
+
+            #vary boson energy scale
+            if sel_type!='nom': continue
+            evpos=np.nonzero(passAtLeastOneSelection)[0]
+            for name,scale in [('mmissvup',1.03),('mmissvdn',0.97)]:
+                boson_var=tuple(c[evpos]*scale for c in boson)
+                evSummary[name]=np.where(hasPP,p4M(buildMissingMassSystemArrays(i_ppSystem,boson_var)),0.)
+
+        array2tree(evSummary,tree=tOut)
+
+    drawProgressBar(1.0)
@@ -1,8 +1,13 @@
 import pickle
 import ROOT
 import random
-import copy
+import numpy as np
 from random import shuffle
+from MixingBank import MixingBank
+
+#read-only placeholder for the vetoed tracking algorithms
+NOPROTONS=np.zeros(0,dtype=np.float64)
+NOPROTONS.flags.writeable=False
 
 class EventMixingTool:
 
@@ -11,6 +16,7 @@ class EventMixingTool:
         """ Reads the event mixing data from a pickle file and builds a list of crossing angle probabilities """
 
         self.mixedRP=mixedRP
+        self.banks={}
         self.xangleRelFracs={}
         self.usePixelOnly=usePixelOnly
         if self.usePixelOnly:
@@ -59,10 +65,47 @@ class EventMixingTool:
         return False if self.mixedRP else True
 
 
-    def getNew(self,evEra,beamXangle,isData,validAngles,mixEvCategs,orderByDecreasingCsi=True):
+    def getBank(self,key):
+
+        """returns the mixing bank for a (era,xangle,category) key, protons are sorted by decreasing csi only once"""
+
+        if not key in self.banks:
+            bank=self.mixedRP[key]
+            self.banks[key]=bank if isinstance(bank,MixingBank) else MixingBank.fromMixedEventSummaries(bank)
+        return self.banks[key]
+
+
+    def drawIndices(self,key,n=1,u=None):
+
+        """
+        draws n random indices of events in the bank for a (era,xangle,category) key
+        the python random generator is used (or the uniforms u if given) so that one draw is equivalent to random.choice
+        """
+
+        if u is None:
+            rnd=random.random
+            u=np.array([rnd() for _ in xrange(n)],dtype=np.float64)
+        return (np.asarray(u)*len(self.getBank(key))).astype(np.int64)
+
+
+    def getNewBatch(self,evEra,beamXangle,mixEvCat,n=1,u=None):
+
+        """
+        draws n events from the bank for a given (era,xangle,category) in one go
+        returns the bank and the indices of the events drawn, which can be used to retrieve
+        the protons with bank.getProtons(idx,side,algo) and the pileup discriminators with bank.puDiscr[idx]
+        """
+
+        key=(evEra,beamXangle,mixEvCat)
+        return self.getBank(key),self.drawIndices(key,n,u)
+
+
+    def getNew(self,evEra,beamXangle,isData,validAngles,mixEvCategs):
 
         """get new list of mixed protons from different event categories
-        also returns a list of variables which be used for pileup discrimination"""
+        also returns a list of variables which be used for pileup discrimination
+        the protons are returned as read-only views of the bank (already ordered by decreasing csi)
+        so they should not be modified in place"""
 
         mixed_pos_protons={}
         mixed_neg_protons={}
@@ -77,20 +120,16 @@ class EventMixingTool:
                 if isData and not beamXangle in validAngles : continue
                 
                 mixedEvKey                  = (evEra,beamXangle,mixEvCat)
-                mixedEv                     = random.choice( self.mixedRP[mixedEvKey] )                
-                mixed_pudiscr[mixEvCat]     = copy.deepcopy(mixedEv.puDiscr)
-                mixed_pos_protons[mixEvCat] = copy.deepcopy(mixedEv.pos_protons)               
-                mixed_neg_protons[mixEvCat] = copy.deepcopy(mixedEv.neg_protons)
-
-                if orderByDecreasingCsi:
-                    mixed_pos_protons[mixEvCat][1].sort(reverse = True) 
-                    mixed_neg_protons[mixEvCat][1].sort(reverse = True) 
-
-                if self.usePixelOnly:
-                    mixed_pos_protons[mixEvCat][0]=[]
-                    mixed_pos_protons[mixEvCat][2]=[]
-                    mixed_neg_protons[mixEvCat][0]=[]
-                    mixed_neg_protons[mixEvCat][2]=[]
+                bank,idx                    = self.getNewBatch(evEra,beamXangle,mixEvCat)
+                idx                         = idx[0]
+                mixed_pudiscr[mixEvCat]     = bank.puDiscr[idx]
+                for side,mixed_protons in [('pos',mixed_pos_protons),('neg',mixed_neg_protons)]:
+                    for algo in range(3):
+                        if self.usePixelOnly and algo!=1:
+                            mixed_protons[mixEvCat][algo]=NOPROTONS
+                            continue
+                        offsets=bank.offsets[(side,algo)]
+                        mixed_protons[mixEvCat][algo]=bank.xi[(side,algo)][offsets[idx]:offsets[idx+1]]
 
         except Exception as e:
             print e  
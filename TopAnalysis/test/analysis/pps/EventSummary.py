@@ -49,6 +49,13 @@ class EventSummary:
             for v in self.vars[t]:
                 tree.Branch( v,   getattr(self,v), '%s/%s'%(v,t.upper()) )
 
+    def getNumpyDtype(self):
+
+        """ returns the list of (variable,numpy type) matching the branches created in attachToTree """
+
+        npTypes={'i':'i4','l':'i8','f':'f4'}
+        return [(v,npTypes[t]) for t in self.vars for v in self.vars[t]]
+
 
 def main():
     print 'Defines EventSummary class'
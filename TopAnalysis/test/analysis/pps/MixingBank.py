@@ -0,0 +1,167 @@
+import numpy as np
+import os
+import re
+import sys
+from MixedEventSummary import MixedEventSummary
+
+MIXSIDES=['pos','neg']
+NPUDISCR=7
+
+class MixingBank:
+
+    """
+    columnar version of a list of MixedEventSummary objects for a given (era,xangle,category)
+    puDiscr           - (n,7) matrix with the pileup discriminant variables
+    xi[(side,algo)]   - flat array with the csi of the protons of all the events
+                        sorted by decreasing csi within each event
+    offsets[(side,algo)] - the protons of event i are xi[offsets[i]:offsets[i+1]]
+    side is 'pos' or 'neg', algo is 0 (multiRP), 1 (far/pixels) or 2 (near/strips)
+    the arrays can be saved to a directory and memory-mapped read-only when loading it back
+    so that the bank is shared by all the processes running on the same machine
+    """
+
+    def __init__(self,puDiscr,xi,offsets):
+        self.puDiscr=puDiscr
+        self.xi=xi
+        self.offsets=offsets
+        self.nProtonsCache={}
+        self.leadingXiCache={}
+
+    def __len__(self):
+        return self.puDiscr.shape[0]
+
+    def __getitem__(self,i):
+
+        """returns the i-th event as a MixedEventSummary (allows to use the bank as the list it replaces)"""
+
+        if i<0 : i += len(self)
+        if i<0 or i>=len(self): raise IndexError('mixing bank index out of range')
+        protons={}
+        for key in self.offsets:
+            protons[key]=self.xi[key][self.offsets[key][i]:self.offsets[key][i+1]].tolist()
+        return MixedEventSummary(puDiscr=self.puDiscr[i].tolist(),
+                                 pos_protons=[protons[('pos',algo)] for algo in range(3)],
+                                 neg_protons=[protons[('neg',algo)] for algo in range(3)])
+
+    def getNProtons(self,side,algo):
+
+        """number of protons per event (computed only once)"""
+
+        key=(side,algo)
+        if not key in self.nProtonsCache:
+            self.nProtonsCache[key]=np.diff(self.offsets[key])
+        return self.nProtonsCache[key]
+
+    def getLeadingXi(self,side,algo):
+
+        """csi of the leading proton per event, 0 if none (computed only once)"""
+
+        key=(side,algo)
+        if not key in self.leadingXiCache:
+            nprotons=self.getNProtons(side,algo)
+            hasProtons=(nprotons>0)
+            self.leadingXiCache[key]=np.zeros(len(self),dtype=np.float64)
+            self.leadingXiCache[key][hasProtons]=self.xi[key][self.offsets[key][:-1][hasProtons]]
+        return self.leadingXiCache[key]
+
+    def save(self,outDir):
+
+        """saves the arrays as .npy files in a directory"""
+
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        np.save(os.path.join(outDir,'puDiscr.npy'),np.asarray(self.puDiscr,dtype=np.float64))
+        for side,algo in self.offsets:
+            np.save(os.path.join(outDir,'%s_%d_xi.npy'%(side,algo)),np.asarray(self.xi[(side,algo)],dtype=np.float64))
+            np.save(os.path.join(outDir,'%s_%d_offsets.npy'%(side,algo)),np.asarray(self.offsets[(side,algo)],dtype=np.int64))
+
+    @classmethod
+    def load(cls,inDir,mmap_mode='r'):
+
+        """loads the arrays from a directory (memory-mapped read-only by default)"""
+
+        puDiscr=np.load(os.path.join(inDir,'puDiscr.npy'),mmap_mode=mmap_mode)
+        xi,offsets={},{}
+        for side in MIXSIDES:
+            for algo in range(3):
+                xi[(side,algo)]=np.load(os.path.join(inDir,'%s_%d_xi.npy'%(side,algo)),mmap_mode=mmap_mode)
+                offsets[(side,algo)]=np.load(os.path.join(inDir,'%s_%d_offsets.npy'%(side,algo)),mmap_mode=mmap_mode)
+        return cls(puDiscr,xi,offsets)
+
+    @classmethod
+    def fromMixedEventSummaries(cls,evList):
+
+        """builds the arrays from a list of MixedEventSummary objects"""
+
+        n=len(evList)
+        puDiscr=np.zeros((n,NPUDISCR),dtype=np.float64)
+        for i,ev in enumerate(evList):
+            puDiscr[i,:]=ev.puDiscr
+
+        xi,offsets={},{}
+        for side in MIXSIDES:
+            for algo in range(3):
+                key=(side,algo)
+                protons=[sorted(ev.getProtons(side=='pos')[algo],reverse=True) for ev in evList]
+                offsets[key]=np.zeros(n+1,dtype=np.int64)
+                offsets[key][1:]=np.cumsum([len(p) for p in protons])
+                xi[key]=np.array([x for p in protons for x in p],dtype=np.float64)
+                xi[key].flags.writeable=False
+                offsets[key].flags.writeable=False
+        puDiscr.flags.writeable=False
+
+        return cls(puDiscr,xi,offsets)
+
+    def getProtons(self,idx,side,algo):
+
+        """
+        returns the protons for a list of event indices as (number of protons per event, flat csi, event position)
+        where event position refers to the position in idx
+        """
+
+        key=(side,algo)
+        idx=np.asarray(idx,dtype=np.int64)
+        nprotons=self.getNProtons(side,algo)[idx]
+        evpos=np.repeat(np.arange(len(idx)),nprotons)
+        starts=np.repeat(self.offsets[key][idx]-np.cumsum(nprotons)+nprotons,nprotons)
+        return nprotons,self.xi[key][starts+np.arange(len(evpos))],evpos
+
+
+def buildMixingBanks(mixedRP):
+
+    """converts a dict of lists of MixedEventSummary objects to a dict of MixingBank objects (banks are kept as they are)"""
+
+    banks={}
+    for key,evList in mixedRP.items():
+        banks[key]=evList if isinstance(evList,MixingBank) else MixingBank.fromMixedEventSummaries(evList)
+    return banks
+
+
+def saveMixingBanks(mixedRP,outDir):
+
+    """
+    saves a dict of mixing banks for a given era and crossing angle
+    each (era,xangle,category) key is stored in a sub-directory named by the category
+    """
+
+    for key,bank in buildMixingBanks(mixedRP).items():
+        bank.save(os.path.join(outDir,'%d'%key[2]))
+
+
+def loadMixingBanks(inDir,mmap_mode='r'):
+
+    """loads the banks saved with saveMixingBanks in a mixbank_<era>_<xangle> directory"""
+
+    era,xangle=re.search('mixbank_(2017\w)_(\d+)',os.path.basename(os.path.normpath(inDir))).groups()
+    banks={}
+    for cat in os.listdir(inDir):
+        if not cat.isdigit(): continue
+        banks[(era,int(xangle),int(cat))]=MixingBank.load(os.path.join(inDir,cat),mmap_mode=mmap_mode)
+    return banks
+
+
+def main():
+    print 'Defines MixingBank class'
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,7 @@ import ROOT
 import sys
 import numpy as np
 import re
-
-#see https://twiki.cern.ch/twiki/bin/view/CMS/TaggedProtonsFiducialCuts
-APPERTUREPARAMS={
-    'preTS2':{
-        45:ROOT.TF1("prets2_45","-(8.71198E-07*[xangle]-0.000134726)+((x<(0.000264704*[xangle]+0.081951))*-(4.32065E-05*[xangle]-0.0130746)+(x>=(0.000264704*[xangle]+0.081951))*-(0.000183472*[xangle]-0.0395241))*(x-(0.000264704*[xangle]+0.081951))"),
-        56:ROOT.TF1("prets2_56","3.43116E-05+((x<(0.000626936*[xangle]+0.061324))*0.00654394+(x>=(0.000626936*[xangle]+0.061324))*-(0.000145164*[xangle]-0.0272919))*(x-(0.000626936*[xangle]+0.061324))")
-    },
-    'postTS2':{
-        45:ROOT.TF1("postts2_45","-(8.92079E-07*[xangle]-0.000150214)+((x<(0.000278622*[xangle]+0.0964383))*-(3.9541e-05*[xangle]-0.0115104)+(x>=(0.000278622*[xangle]+0.0964383))*-(0.000108249*[xangle]-0.0249303))*(x-(0.000278622*[xangle]+0.0964383))"),
-        56:ROOT.TF1("postts2_56","4.56961E-05+((x<(0.00075625*[xangle]+0.0643361))*-(3.01107e-05*[xangle]-0.00985126)+(x>=(0.00075625*[xangle]+0.0643361))*-(8.95437e-05*[xangle]-0.0169474))*(x-(0.00075625*[xangle]+0.0643361))")
-    },
-}
-
+from PPSFiducialCuts import isPixelFiducialArrays
 
 def isPixelFiducial(era,sector,x,tx,y,ty,xi,xangle):
 
@@ -23,38 +11,7 @@ def isPixelFiducial(era,sector,x,tx,y,ty,xi,xangle):
     cf. https://twiki.cern.ch/twiki/bin/viewauth/CMS/TaggedProtonsPixelEfficiencies
     """
 
-    #check angle of the track to be below 20mrad
-    if abs(tx)>0.02 : return False
-    if abs(ty)>0.02 : return False         
-        
-    xy_fid=None
-    if era in ['2017B','2017C','2017D']:
-        if sector==45:
-            xy_fid=[1.860,24.334,-11.098,4.298]
-            if era=='2017B' :
-                xy_fid[0]=1.995
-                xy_fid[1]=24.479
-        else:
-            xy_fid=[2.422,24.620,-10.698,4.698]
-    else:
-        if sector==45:
-            xy_fid=[1.995,24.479,-10.098,4.998]
-        else:
-            xy_fid=[2.422,24.620,-9.698,5.498]
-    px_x0_rotated = x * np.cos((-8. / 180.) * np.pi) - y * np.sin((-8. / 180.) * np.pi)
-    px_y0_rotated = x * np.sin((-8. / 180.) * np.pi) + y * np.cos((-8. / 180.) * np.pi)
-    if px_x0_rotated<xy_fid[0] : return False
-    if px_x0_rotated>xy_fid[1] : return False
-    if px_y0_rotated<xy_fid[2] : return False
-    if px_y0_rotated>xy_fid[3] : return False
-    
-    #apperture cuts
-    if not xi is None:
-        eraKey='preTS2' if era in ['2017B','2017C'] else 'postTS2'
-        APPERTUREPARAMS[eraKey][sector].SetParameter('xangle',xangle)
-        max_tx = (-1)*APPERTUREPARAMS[eraKey][sector].Eval(xi)
-        if tx > max_tx : return False
-    return True
+    return bool(isPixelFiducialArrays(era,sector,x,tx,y,ty,xi,xangle)[0])
 
 def vetoPixels2017(run,era):
 
@@ -86,6 +43,37 @@ def doFinalCheck2017(pos_protons,neg_protons,run,era):
     return hasVeto,pos_protons,neg_protons
 
 
+class EfficiencyLookupTable:
+
+    """
+    dense copy of the contents of a TH1/TH2 (including under/overflows) and of its bin edges
+    to retrieve bin contents and errors for arrays of values without calling ROOT
+    """
+
+    def __init__(self,h):
+        self.ndim=2 if h.InheritsFrom('TH2') else 1
+        axes=[h.GetXaxis()]+([h.GetYaxis()] if self.ndim==2 else [])
+        self.edges=[np.array([ax.GetBinLowEdge(i) for i in range(1,ax.GetNbins()+2)],dtype=np.float64) for ax in axes]
+        shape=[len(e)+1 for e in self.edges]
+        self.contents=np.zeros(shape,dtype=np.float64)
+        self.errors=np.zeros(shape,dtype=np.float64)
+        for ibin in np.ndindex(*shape):
+            self.contents[ibin]=h.GetBinContent(*ibin)
+            self.errors[ibin]=h.GetBinError(*ibin)
+
+    def findBin(self,*vals):
+
+        """same as FindBin (0 is the underflow and nbins+1 the overflow) for each axis"""
+
+        return tuple(np.searchsorted(e,np.asarray(v,dtype=np.float64),side='right') for e,v in zip(self.edges,vals))
+
+    def getBinContent(self,*vals):
+        return self.contents[self.findBin(*vals)]
+
+    def getBinError(self,*vals):
+        return self.errors[self.findBin(*vals)]
+
+
 class PPSEfficiencyReader:
     
     """ 
@@ -233,58 +221,71 @@ class PPSEfficiencyReader:
         print '[PPSEfficiencyReader] retrieved %d histograms'%len(self.allEffs)
         #print self.allEffs.keys()
 
+        #export the histograms to arrays for the lookups
+        self.lookupTables={}
+        for key in self.allEffs:
+            self.lookupTables[key]=EfficiencyLookupTable(self.allEffs[key])
+
     def getPPSEfficiency(self,era,xangle,xi,x,y,rp,isMulti=True):
 
-        sector=45 if rp<100 else 56
-        eff,effUnc=1.0,0.0
-        #print era,xangle,xi,isMulti,'|',
-        if isMulti:
-            
-            #strip radiation damage
-            key=('strip_raddam', sector, era, xangle, '')
-            key_unc=('strip_raddam', sector, era, xangle, 'errors')
-            raddam=self.allEffs[key]
-            raddamUnc=self.allEffs[key_unc]
-            ibin=raddam.FindBin(xi)
-            ieff = raddam.GetBinContent(ibin)
-            eff *= ieff
-            if ieff>0:
-                effUnc += (raddamUnc.GetBinError(ibin)/ieff)**2            
-            #print 'raddam=',ieff,
-
-            if x>-90 and y>-90 : #-99 is the default for n/a
-                key=('multi_ip',sector,era)
-                interPot=self.allEffs[key]
-                xbin=interPot.GetXaxis().FindBin(x)
-                ybin=interPot.GetYaxis().FindBin(y)
-                ieff = interPot.GetBinContent(xbin,ybin)
-                eff *=ieff
-                effUnc += 0.02**2 #the errors in the histograms seem flawed, assign 2% ad-hoc
-                #print 'interpot=',ieff,
-
-            #pure 0 efficiency
-            pure0Eff = self.pure0Probs[(sector,xangle,era)]
-            eff *= pure0Eff
-            if pure0Eff>0:
-                effUnc *= 0.02**2 #ad-hoc
-            #print 'pure0=',pure0Eff,
-
-
-        else:
-
-            #check if era is available (if not do nothing as it will be vetoed later)    
-            key=('px_raddam',sector,era)
-            if key in self.allEffs and x>-90 and y>-90 :
-                pxrad=self.allEffs[key]
-                xbin=pxrad.GetXaxis().FindBin(x)
-                ybin=pxrad.GetYaxis().FindBin(y)
-                ieff=pxrad.GetBinContent(xbin,ybin)
-                eff *=ieff
-                effUnc += 0.02**2  #the errors in the histograms seem flawed, assign 2% ad-hoc
-                #print 'px raddam=',ieff,
-            
-        effUnc=eff*ROOT.TMath.Sqrt(effUnc)
-        #print ' ====> eff=',eff,'+/-',effUnc
+        """efficiency and uncertainty for a single proton"""
+
+        eff,effUnc=self.getPPSEfficiencyArrays(era,xangle,xi,x,y,rp,isMulti)
+        return float(eff[0]),float(effUnc[0])
+
+    def getPPSEfficiencyArrays(self,era,xangle,xi,x,y,rp,isMulti=True):
+
+        """
+        efficiency and uncertainty for arrays of protons
+        era, xangle and rp can be either arrays or a single value common to all the protons
+        """
+
+        xi,x,y=[np.atleast_1d(np.asarray(v,dtype=np.float64)) for v in (xi,x,y)]
+        n=len(xi)
+        era=np.broadcast_to(np.asarray(era),(n,))
+        xangle=np.broadcast_to(np.asarray(xangle),(n,))
+        sector=np.where(np.broadcast_to(np.asarray(rp),(n,))<100,45,56)
+        hasXY=(x>-90) & (y>-90) #-99 is the default for n/a
+
+        eff,effUnc=np.ones(n,dtype=np.float64),np.zeros(n,dtype=np.float64)
+        for iera,ixangle,isector in set(zip(era,xangle,sector)):
+            mask=(era==iera) & (xangle==ixangle) & (sector==isector)
+
+            if isMulti:
+
+                #strip radiation damage
+                raddam=self.lookupTables[('strip_raddam', isector, iera, ixangle, '')]
+                raddamUnc=self.lookupTables[('strip_raddam', isector, iera, ixangle, 'errors')]
+                ibin=raddam.findBin(xi[mask])
+                ieff=raddam.contents[ibin]
+                ieffUnc=raddamUnc.errors[ibin]
+                eff[mask] *= ieff
+                effUnc[mask] += np.where(ieff>0,(ieffUnc/np.where(ieff>0,ieff,1.))**2,0.)
+
+                #inter-pot efficiency
+                ipMask=mask & hasXY
+                if ipMask.any():
+                    interPot=self.lookupTables[('multi_ip',isector,iera)]
+                    eff[ipMask] *= interPot.getBinContent(x[ipMask],y[ipMask])
+                    effUnc[ipMask] += 0.02**2 #the errors in the histograms seem flawed, assign 2% ad-hoc
+
+                #pure 0 efficiency
+                pure0Eff = self.pure0Probs[(isector,ixangle,iera)]
+                eff[mask] *= pure0Eff
+                if pure0Eff>0:
+                    effUnc[mask] *= 0.02**2 #ad-hoc
+
+            else:
+
+                #check if era is available (if not do nothing as it will be vetoed later)
+                key=('px_raddam',isector,iera)
+                if not key in self.lookupTables: continue
+                pxrad=self.lookupTables[key]
+                pxMask=mask & hasXY
+                eff[pxMask] *= pxrad.getBinContent(x[pxMask],y[pxMask])
+                effUnc[pxMask] += 0.02**2  #the errors in the histograms seem flawed, assign 2% ad-hoc
+
+        effUnc=eff*np.sqrt(effUnc)
 
         return eff,effUnc
 
@@ -0,0 +1,106 @@
+import numpy as np
+import sys
+
+#pixel fiducial region in the rotated frame (xmin,xmax,ymin,ymax) per era group and sector
+#the region for the first runs of 2017B in sector 45 differs from the rest of 2017B-D
+#cf. https://twiki.cern.ch/twiki/bin/viewauth/CMS/TaggedProtonsPixelEfficiencies
+PXFIDUCIALREGIONS={
+    ('2017BCD',45):(1.860,24.334,-11.098,4.298),
+    ('2017BCD',56):(2.422,24.620,-10.698,4.698),
+    ('2017EF', 45):(1.995,24.479,-10.098,4.998),
+    ('2017EF', 56):(2.422,24.620,-9.698, 5.498),
+    ('2017B',  45):(1.995,24.479,-11.098,4.298),
+}
+PXROTANGLE=(-8. / 180.) * np.pi
+PXCOSROT,PXSINROT=np.cos(PXROTANGLE),np.sin(PXROTANGLE)
+MAXTRACKANGLE=0.02
+
+
+#aperture cuts: maximum tx as a function of xi (x) and of the crossing angle
+#see https://twiki.cern.ch/twiki/bin/view/CMS/TaggedProtonsFiducialCuts
+def getMaxTx2017BC45(x,xangle):
+    x0=0.000264704*xangle+0.081951
+    slope=np.where(x<x0,-(4.32065E-05*xangle-0.0130746),-(0.000183472*xangle-0.0395241))
+    return (8.71198E-07*xangle-0.000134726)-slope*(x-x0)
+
+def getMaxTx2017BC56(x,xangle):
+    x0=0.000626936*xangle+0.061324
+    slope=np.where(x<x0,0.00654394,-(0.000145164*xangle-0.0272919))
+    return -3.43116E-05-slope*(x-x0)
+
+def getMaxTx2017DEF45(x,xangle):
+    x0=0.000278622*xangle+0.0964383
+    slope=np.where(x<x0,-(3.9541e-05*xangle-0.0115104),-(0.000108249*xangle-0.0249303))
+    return (8.92079E-07*xangle-0.000150214)-slope*(x-x0)
+
+def getMaxTx2017DEF56(x,xangle):
+    x0=0.00075625*xangle+0.0643361
+    slope=np.where(x<x0,-(3.01107e-05*xangle-0.00985126),-(8.95437e-05*xangle-0.0169474))
+    return -4.56961E-05-slope*(x-x0)
+
+APERTURECUTS={
+    ('2017BC', 45):getMaxTx2017BC45,
+    ('2017BC', 56):getMaxTx2017BC56,
+    ('2017DEF',45):getMaxTx2017DEF45,
+    ('2017DEF',56):getMaxTx2017DEF56,
+}
+
+
+def getFiducialRegion(era,sector):
+
+    """returns the pixel fiducial region for an era and sector"""
+
+    if era=='2017B' and sector==45:
+        return PXFIDUCIALREGIONS[(era,sector)]
+    return PXFIDUCIALREGIONS[('2017BCD' if era in ['2017B','2017C','2017D'] else '2017EF',sector)]
+
+
+def getMaxTx(era,sector,xi,xangle):
+
+    """evaluates the aperture cut (maximum tx) for arrays of xi and crossing angles"""
+
+    eraKey='2017BC' if era in ['2017B','2017C'] else '2017DEF'
+    x=np.asarray(xi,dtype=np.float64)
+    xangle=np.asarray(xangle,dtype=np.float64)
+    return APERTURECUTS[(eraKey,sector)](x,xangle)
+
+
+def isPixelFiducialArrays(era,sector,x,tx,y,ty,xi,xangle):
+
+    """
+    same as isPixelFiducial for arrays of tracks, returns a boolean mask
+    all arguments can be either arrays or a single value common to all the tracks
+    if xi is None the aperture cuts are not applied
+    """
+
+    x,tx,y,ty=[np.atleast_1d(np.asarray(v,dtype=np.float64)) for v in (x,tx,y,ty)]
+    n=len(x)
+    era=np.broadcast_to(np.asarray(era),(n,))
+    sector=np.broadcast_to(np.asarray(sector),(n,))
+    xangle=np.broadcast_to(np.asarray(xangle,dtype=np.float64),(n,))
+
+    #check angle of the track to be below 20mrad
+    mask=~( (np.abs(tx)>MAXTRACKANGLE) | (np.abs(ty)>MAXTRACKANGLE) )
+
+    #fiducial region in the rotated frame
+    px_x0_rotated = x * PXCOSROT - y * PXSINROT
+    px_y0_rotated = x * PXSINROT + y * PXCOSROT
+    for iera,isector in set(zip(era,sector)):
+        sel=(era==iera) & (sector==isector)
+        xmin,xmax,ymin,ymax=getFiducialRegion(iera,isector)
+        mask[sel] &= ~( (px_x0_rotated[sel]<xmin) | (px_x0_rotated[sel]>xmax) \
+                        | (px_y0_rotated[sel]<ymin) | (px_y0_rotated[sel]>ymax) )
+
+        #apperture cuts
+        if xi is None: continue
+        ixi=np.broadcast_to(np.asarray(xi,dtype=np.float64),(n,))
+        mask[sel] &= ~(tx[sel]>getMaxTx(iera,isector,ixi[sel],xangle[sel]))
+
+    return mask
+
+
+def main():
+    print 'Defines vectorized PPS fiducial cuts'
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,15 @@
 import MixedEventSummary
+import os
 import sys
 import pickle
 import ROOT
+from MixingBank import loadMixingBanks
 
-with open(sys.argv[1],'r') as f:
-    rpData=pickle.load(f)
+if os.path.isdir(sys.argv[1]):
+    rpData=loadMixingBanks(sys.argv[1])
+else:
+    with open(sys.argv[1],'r') as f:
+        rpData=pickle.load(f)
 
 csi={}
 for key in rpData:
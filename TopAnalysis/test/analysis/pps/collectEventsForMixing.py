@@ -4,6 +4,7 @@ import sys
 from random import shuffle
 from collections import defaultdict
 from generateBinnedWorkspace import VALIDLHCXANGLES
+from MixingBank import saveMixingBanks
 
 #create mixing manks per era and crossing angle
 for era in 'BCDEF':
@@ -44,11 +45,12 @@ for era in 'BCDEF':
         for key in rpData:
             print '\t',key,len(rpData[key])
 
-        mixbank='mixbank_%s_%d.pck'%(era,xangle)
+        #the bank is stored as arrays which can be memory-mapped by the analysis jobs
+        mixbank='mixbank_%s_%d'%(era,xangle)
         print '\t writing mixing bank @',mixbank
-        with open(mixbank,'w') as cache:
-            pickle.dump(rpData,cache)
-        os.system('cp -v {0} {1}/mixing/{0}'.format(mixbank,baseDir))
+        os.system('rm -rf {0}'.format(mixbank))
+        saveMixingBanks(rpData,mixbank)
+        os.system('rm -rf {1}/mixing/{0} && cp -rv {0} {1}/mixing/{0}'.format(mixbank,baseDir))
 
 if len(toCheck)>0:
     print '-'*50
@@ -4,6 +4,8 @@ import sys
 import argparse
 import pickle
 import copy
+import re
+import time
 
 #sigma=1pb distributed accross crossing angles 
 #NB this does not sum to 1 as we don't use all crossing angles in the analysis
@@ -12,6 +14,46 @@ PHOTONSIGNALXSECS = {120:0.372,130:0.295,140:0.162,150:0.171}
 VALIDLHCXANGLES   = SIGNALXSECS.keys()
 CH_DICT           = {'169':'zmm','121':'zee','22':'g'}
 CH_TITLE_DICT     = {'169':'Z#rightarrow#mu#mu','121':'Z#rightarrowee','22':'#gamma'}
+TEMPLATEBRANCHES  = ['cat','mixType','wgt','ppsEff','gen_pzwgtUp','gencsi1','gencsi2','bosoneta',
+                     'mmiss','csi1','csi2','protonCat','systmmiss','systcsi1','systcsi2','systprotonCat']
+
+
+class TemplateBooker:
+
+    """
+    books all the templates for a chain up front and fills them in a single pass over the events
+    each template is defined as in TTree::Draw by a variable and a selection (weight) expression
+    and is booked as a lazy action of a RDataFrame
+    """
+
+    def __init__(self,chain):
+        self.chain=chain
+        self.df=ROOT.RDataFrame(chain)
+        self.booked={}
+
+    def book(self,name,varExpr,selExpr,nbins,xmin,xmax):
+        itmpl=len(self.booked)
+        var,wgt='tmpl%d_var'%itmpl,'tmpl%d_wgt'%itmpl
+        node=self.df.Define(var,'(double)(%s)'%varExpr).Define(wgt,'(double)(%s)'%selExpr).Filter('%s!=0'%wgt)
+        self.booked[name]=node.Histo1D(ROOT.RDF.TH1DModel(name,'',nbins,xmin,xmax),var,wgt)
+
+    def get(self,name):
+
+        """returns a detached copy of the template (the first call triggers the event loop for all the booked templates)"""
+
+        h=self.booked[name].GetValue().Clone(name)
+        h.SetDirectory(0)
+        return h
+
+
+def getTemplateDef(opt,pfix=''):
+
+    """variable expression and binning for the missing mass templates"""
+
+    if opt.signed:
+        #return '(%sypp>=0 ? %smmiss : -%smmiss)'%(pfix,pfix,pfix),2*opt.nbins,-opt.mMax,opt.mMax
+        return '(bosoneta>=0 ? %smmiss : -%smmiss)'%(pfix,pfix),2*opt.nbins,-opt.mMax,opt.mMax
+    return '%smmiss'%pfix,opt.nbins,opt.mMin,opt.mMax
 
 
 def defineProcessTemplates(histos,norm=False):
@@ -61,12 +103,11 @@ def defineProcessTemplates(histos,norm=False):
     return templates
 
         
-def fillBackgroundTemplates(opt):
+def getDataFiles(opt):
 
-    """fills the background and observed data histograms"""
+    """list of data files used for the background and observed data in a channel"""
 
-    #import signal events
-    data=ROOT.TChain('data')
+    fList=[]
     for f in [os.path.join(opt.input,x) for x in os.listdir(opt.input) if 'Data13TeV' in x]:
         if 'MuonEG' in f : continue
         if opt.chTag.find('zmm')==0:
@@ -78,52 +119,128 @@ def fillBackgroundTemplates(opt):
         if opt.chTag.find('g_')==0:
             if not 'Photon' in f : 
                 continue
-        data.AddFile(f)
+        fList.append(f)
+    return fList
+
+
+def getSignalFiles(opt,boson,mass):
+
+    """list of signal files (pre- and post-TS2) used for a given mass"""
+
+    fList=[]
+    for ixangle in VALIDLHCXANGLES:
+        signalFile=os.path.join(opt.input,opt.sig.format(boson=boson,xangle=ixangle,mass=mass))
+        fList += [signalFile,signalFile.replace('preTS2','postTS2')]
+    return fList
+
+
+def getInputURL(opt,url):
+
+    """returns the location of the cached copy of an input file, if available"""
+
+    inputCache=getattr(opt,'inputCache',None)
+    if inputCache and url in inputCache:
+        return inputCache[url]
+    return url
+
+
+def cacheTask(args):
+
+    """
+    writes a slimmed copy of the data tree of an input file with the branches needed for the templates
+    the copy is re-used if it is more recent than the original file
+    if the copy can't be written no cached file is left behind so that the original file is used
+    """
+
+    inURL,outURL,cuts=args
+    try:
+        if os.path.isfile(outURL) and os.path.getmtime(outURL)>=os.path.getmtime(inURL):
+            return
+
+        usedNames=set(TEMPLATEBRANCHES+re.findall('[A-Za-z_]\w*',cuts))
+        fIn=ROOT.TFile.Open(inURL)
+        branches=[b.GetName() for b in fIn.Get('data').GetListOfBranches() if b.GetName() in usedNames]
+        fIn.Close()
+
+        branchList=ROOT.std.vector('string')()
+        for b in branches: branchList.push_back(b)
+        ROOT.RDataFrame('data',inURL).Snapshot('data',outURL+'.tmp',branchList)
+        os.rename(outURL+'.tmp',outURL)
+    except Exception as e:
+        print 'Failed to cache',inURL,'the original file will be used'
+        print e
+        for url in [outURL+'.tmp',outURL]:
+            if os.path.isfile(url): os.remove(url)
+
+
+def timedTask(args):
+
+    """runs a task and returns its name and the wall time spent"""
+
+    func,name,taskArgs=args
+    start=time.time()
+    func(taskArgs)
+    return name,time.time()-start
+
+
+def runTasks(pool,tasks,title):
+
+    """runs a list of (function, name, arguments) in the pool and prints the time spent in each task"""
+
+    if len(tasks)==0: return
+
+    start=time.time()
+    timing=pool.map(timedTask,tasks)
+    print '\t %s: %d tasks in %3.1fs'%(title,len(tasks),time.time()-start)
+    for name,dt in sorted(timing,key=lambda x:-x[1]):
+        print '\t\t %30s %8.1fs'%(name,dt)
+
+
+def fillBackgroundTemplates(opt):
+
+    """fills the background and observed data histograms"""
+
+    #import data events
+    data=ROOT.TChain('data')
+    for f in getDataFiles(opt):
+        data.AddFile(getInputURL(opt,f))
 
     #set preselection cuts
     catName='%s'%opt.chTag
     categCut=opt.presel
     print '\t\t',catName,categCut
 
-    #background modelling histos
-    histos=[]
-    data_obs=None
-    histodef='mmiss >> h(%d,%f,%f)'%(opt.nbins,opt.mMin,opt.mMax)
-    if opt.signed:
-        #histodef='(ypp>=0 ? mmiss : -mmiss) >> h(%d,%f,%f)'%(2*opt.nbins,-opt.mMax,opt.mMax)
-        histodef='(bosoneta>=0 ? mmiss : -mmiss) >> h(%d,%f,%f)'%(2*opt.nbins,-opt.mMax,opt.mMax)
-    data.Draw(histodef,
-              '{0} && mmiss>0 && mixType==0'.format(categCut),
-              'goff')
-    h=data.GetHistogram()
-    totalBkg=h.Integral()
-    data_obs=h.Clone('data_obs_'+catName)
-    data_obs.SetDirectory(0)
-    h.Reset('ICE')
-
-    for name,mixType,pfix in [('bkg_'+catName,                          1, ''),
-                              ('bkg_%s_bkgShape'%catName,               1, 'syst'),
-                              ('bkg_%s_bkgShapeSingleDiffUp'%catName,   2, ''),
-                              ('bkg_%s_bkgShapeSingleDiffDown'%catName, 2, 'syst'), ]:
+    #book the observed data and the background modelling histos
+    booker=TemplateBooker(data)
+    varExpr,nbins,xmin,xmax=getTemplateDef(opt)
+    booker.book('data_obs_'+catName,
+                varExpr,
+                '{0} && mmiss>0 && mixType==0'.format(categCut),
+                nbins,xmin,xmax)
+
+    bkgTemplates=[('bkg_'+catName,                          1, ''),
+                  ('bkg_%s_bkgShape'%catName,               1, 'syst'),
+                  ('bkg_%s_bkgShapeSingleDiffUp'%catName,   2, ''),
+                  ('bkg_%s_bkgShapeSingleDiffDown'%catName, 2, 'syst'), ]
+    for name,mixType,pfix in bkgTemplates:
         templCuts=categCut.replace('csi1',pfix+'csi1')
         templCuts=templCuts.replace('csi2',pfix+'csi2')
         if pfix=='syst':
             templCuts=templCuts.replace('protonCat','systprotonCat')
 
-        histodef='%smmiss >> h(%d,%f,%f)'%(pfix,opt.nbins,opt.mMin,opt.mMax)           
-        if opt.signed:
-            #histodef='(%sypp>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
-            histodef='(bosoneta>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
-            
-        data.Draw(histodef,
-                  'wgt*({0} && {1}mmiss>0 && mixType=={2})'.format(templCuts,pfix,mixType),
-                  'goff')
-        h=data.GetHistogram()
-        h.Scale(totalBkg/h.Integral())
-        histos.append(h.Clone(name))
-        histos[-1].SetDirectory(0)
+        varExpr,nbins,xmin,xmax=getTemplateDef(opt,pfix)
+        booker.book(name,
+                    varExpr,
+                    'wgt*({0} && {1}mmiss>0 && mixType=={2})'.format(templCuts,pfix,mixType),
+                    nbins,xmin,xmax)
 
-        h.Reset('ICE')
+    #fill all at once
+    data_obs=booker.get('data_obs_'+catName)
+    totalBkg=data_obs.Integral()
+    histos=[]
+    for name,_,_ in bkgTemplates:
+        histos.append(booker.get(name))
+        histos[-1].Scale(totalBkg/histos[-1].Integral())
 
     #finalize templates
     templates = defineProcessTemplates(histos)
@@ -142,11 +259,11 @@ def fillSignalTemplates(mass,signalFile,xsec,opt,fiducialCuts='gencsi1>0.02 && g
 
     #import signal events
     data=ROOT.TChain('data')
-    data.AddFile(os.path.join(opt.input,signalFile))
+    data.AddFile(getInputURL(opt,os.path.join(opt.input,signalFile)))
     dataWgt=14586.4464/41529.3 #preTS2/total
 
     dataAlt=ROOT.TChain('data')
-    dataAlt.AddFile(os.path.join(opt.input,signalFile).replace('preTS2','postTS2'))
+    dataAlt.AddFile(getInputURL(opt,os.path.join(opt.input,signalFile).replace('preTS2','postTS2')))
 
     #common weight exppression
     wgtExpr='ppsEff*wgt*{xsec}*{lumi}'.format(xsec=xsec,lumi=opt.lumi)
@@ -157,11 +274,13 @@ def fillSignalTemplates(mass,signalFile,xsec,opt,fiducialCuts='gencsi1>0.02 && g
     categCut=opt.presel
     print '\t\t',catName,categCut
                
-    #define final preselection cuts and repeat for fiducial/non-fiducial regions
+    #book the templates for the fiducial/non-fiducial regions in the two chains
+    booker=TemplateBooker(data)
+    bookerAlt=TemplateBooker(dataAlt)
+    sigTemplates=[]
     for sigType in totalSig.keys():
                         
         #signal modelling histograms
-        histos=[]
         for name,mixType,pfix,addWgt in [('sig_%s_m%s'%(catName,mass),               1, '',     None),
                                          ('sig_%s_m%s_sigShape'%(catName,mass),      1, 'syst', None),                                             
                                          ('sig_%s_m%s_sigCalibUp'%(catName,mass),    1, '',     None),
@@ -170,6 +289,7 @@ def fillSignalTemplates(mass,signalFile,xsec,opt,fiducialCuts='gencsi1>0.02 && g
                                          ('sig_%s_m%s_sigPzModel'%(catName,mass),    1, '',     'gen_pzwgtUp')]:
 
             name=sigType+name
+            sigTemplates.append( (sigType,name) )
             templCuts=categCut.replace('csi1',pfix+'csi1')
             templCuts=templCuts.replace('csi2',pfix+'csi2')
             if sigType=='outfid':
@@ -179,47 +299,38 @@ def fillSignalTemplates(mass,signalFile,xsec,opt,fiducialCuts='gencsi1>0.02 && g
             if pfix=='syst':
                 templCuts=templCuts.replace('protonCat','systprotonCat')
 
-            histodef='%smmiss >> h(%d,%f,%f)'%(pfix,opt.nbins,opt.mMin,opt.mMax)           
-            if opt.signed:
-                #histodef='(%sypp>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
-                histodef='(bosoneta>=0 ? %smmiss : -%smmiss) >> h(%d,%f,%f)'%(pfix,pfix,2*opt.nbins,-opt.mMax,opt.mMax)
+            varExpr,nbins,xmin,xmax=getTemplateDef(opt,pfix)
 
             shiftDataWgt=1.0
             if 'sigCalibUp' in name:   shiftDataWgt *=1.03
             if 'sigCalibDown' in name: shiftDataWgt *=0.97
                 
             #sum up contributions
-            data.Draw(histodef,
-                      '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
-                                                                               addWgt if addWgt else '1',
-                                                                               dataWgt*shiftDataWgt,
-                                                                               templCuts,
-                                                                               mixType,
-                                                                               pfix),
-                      'goff')
-            h=data.GetHistogram()
-
-            dataAlt.Draw(histodef.replace('h(','halt('),
-                         '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
-                                                                                  addWgt if addWgt else '1',
-                                                                                  (1-dataWgt*shiftDataWgt),
-                                                                                  templCuts,
-                                                                                  mixType,
-                                                                                  pfix),
-                         'goff')
-            h.Add(dataAlt.GetHistogram())
-
-            histos.append( h.Clone(name) )         
-            histos[-1].SetDirectory(0)
-
-            if len(histos)==1:
-                totalSig[sigType]=h.Integral()
-                nom_templates[sigType]=h.Clone(name+'_sigforpseudodata')
-                nom_templates[sigType].SetDirectory(0)
-
-            h.Reset('ICE')
-        
-        templates[sigType]=defineProcessTemplates(histos)
+            for b,lumiWgt in [(booker,dataWgt*shiftDataWgt),(bookerAlt,1-dataWgt*shiftDataWgt)]:
+                b.book(name,
+                       varExpr,
+                       '{0}*{1}*{2}*({3} && mixType=={4} && {5}mmiss>0)'.format(wgtExpr,
+                                                                                addWgt if addWgt else '1',
+                                                                                lumiWgt,
+                                                                                templCuts,
+                                                                                mixType,
+                                                                                pfix),
+                       nbins,xmin,xmax)
+
+    #fill all at once
+    histos=dict( (sigType,[]) for sigType in totalSig )
+    for sigType,name in sigTemplates:
+        h=booker.get(name)
+        h.Add(bookerAlt.get(name))
+        histos[sigType].append(h)
+
+        if len(histos[sigType])==1:
+            totalSig[sigType]=h.Integral()
+            nom_templates[sigType]=h.Clone(name+'_sigforpseudodata')
+            nom_templates[sigType].SetDirectory(0)
+
+    for sigType in totalSig.keys():
+        templates[sigType]=defineProcessTemplates(histos[sigType])
     
     print '\t total signal:',totalSig
     return totalSig,templates,nom_templates
@@ -561,6 +672,20 @@ def main(args):
                         dest='finalStates',
                         default=CH_DICT.keys(),
                         help='Generate cards for these final states [default: %default]')
+    parser.add_argument('--njobs',
+                        dest='njobs',
+                        default=0,
+                        type=int,
+                        help='number of parallel processes, 0 to use all the available cores [default: %default]')
+    parser.add_argument('--cacheDir',
+                        dest='cacheDir',
+                        default=None,
+                        help='directory for the cache of the input files read by several tasks, by default it is created in the output directory [default: %default]')
+    parser.add_argument('--noCache',
+                        dest='noCache',
+                        default=False,
+                        help='read always the original input files [default %default]',
+                        action='store_true')
     opt=parser.parse_args(args)
 
     ROOT.gROOT.SetBatch(True)
@@ -588,17 +713,50 @@ def main(args):
     os.system('mkdir -p %s'%opt.output)
 
     opt.finalStates=opt.finalStates.split(',')
-    task_list=[]
-    for ch in CH_DICT.keys():
-        if not ch in opt.finalStates: continue
-        task_list.append( (ch,copy.deepcopy(opt)) )
+    chList=[ch for ch in CH_DICT.keys() if ch in opt.finalStates]
+
+    #split the shapes in one task per channel and background/signal mass point
+    #and list the input files read by each of them
+    shapes_task_list=[]
+    inputUsage={}
+    for ch in chList:
+        chOpt=copy.deepcopy(opt)
+        setattr(chOpt,'chTag',CH_DICT[ch])
+        boson='gamma' if ch=='22' else 'Z'
+        subTasks=[]
+        if opt.doBackground:
+            subTasks.append( ('bkg',True,[],getDataFiles(chOpt)) )
+        for m in opt.massList:
+            subTasks.append( ('m%s'%m,False,[m],getSignalFiles(chOpt,boson,m)) )
+        for tag,doBackground,massList,fList in subTasks:
+            taskOpt=copy.deepcopy(opt)
+            taskOpt.doBackground=doBackground
+            taskOpt.massList=massList
+            shapes_task_list.append( [shapesTask,'shapes_%s_%s'%(ch,tag),(ch,taskOpt)] )
+            for f in fList:
+                inputUsage[f]=inputUsage.get(f,0)+1
 
     import multiprocessing as MP
-    pool = MP.Pool(min(8,len(task_list)))
-    if opt.doBackground or len(opt.massList)>0:
-        pool.map( shapesTask, task_list )
+    njobs=opt.njobs if opt.njobs>0 else MP.cpu_count()
+    pool = MP.Pool(njobs)
+    print '\t using %d parallel processes'%njobs
+
+    #read once the files which are shared by several tasks
+    if not opt.noCache:
+        cacheDir=opt.cacheDir if opt.cacheDir else os.path.join(opt.output,'inputcache')
+        inputCache=dict( (f,os.path.join(cacheDir,os.path.basename(f))) for f,n in inputUsage.items() if n>1 and os.path.isfile(f) )
+        if len(inputCache)>0:
+            os.system('mkdir -p %s'%cacheDir)
+            runTasks(pool,
+                     [ (cacheTask,os.path.basename(f),(f,cacheURL,opt.cuts)) for f,cacheURL in inputCache.items() ],
+                     'input cache')
+            inputCache=dict( (f,cacheURL) for f,cacheURL in inputCache.items() if os.path.isfile(cacheURL) )
+            for task in shapes_task_list:
+                task[2][1].inputCache=inputCache
+
+    runTasks(pool, [tuple(task) for task in shapes_task_list], 'shapes')
     if opt.doDataCards:
-        pool.map( datacardTask, task_list )
+        runTasks(pool, [ (datacardTask,'datacard_%s'%ch,(ch,copy.deepcopy(opt))) for ch in chList ], 'datacards')
 
 
     print '\t all done, output can be found in',opt.output
@@ -17,7 +17,9 @@ from TopLJets2015.TopAnalysis.HistoTool import *
 from EventMixingTool import *
 from EventSummary import EventSummary
 from MixedEventSummary import MixedEventSummary
+from MixingBank import loadMixingBanks
 from PPSEfficiencyReader import PPSEfficiencyReader,isPixelFiducial,doFinalCheck2017
+from PPSFiducialCuts import isPixelFiducialArrays
 from TopLJets2015.TopAnalysis.myProgressBar import *
 
 VALIDLHCXANGLES=[120,130,140,150]
@@ -67,6 +69,7 @@ def getTracksPerRomanPot(tree,era,run,xangle,mcTruth=False,minCsi=0,orderByDecre
 
     tkPos=[[],[],[]]
     tkNeg=[[],[],[]]
+    tracks=[]
     for itk in xrange(0,tree.nProtons):
 
         #read the reconstructed csi (or XY)
@@ -93,15 +96,27 @@ def getTracksPerRomanPot(tree,era,run,xangle,mcTruth=False,minCsi=0,orderByDecre
         isFar   = tree.isFarRPProton[itk]
         isMulti = tree.isMultiRPProton[itk]
         isPosRP = tree.isPosRPProton[itk]
-
-        #fiducial cut
-        if applyPxFid and (isMulti or isFar):
-
-            sector=45 if isPosRP else 56
-            passPxFid=isPixelFiducial(era,sector,
-                                      tree.protonX[itk],tree.protonTX[itk],tree.protonY[itk],tree.protonTY[itk],
-                                      csi if not useXY else None,xangle)
-            if not passPxFid : continue
+        tracks.append( (itk,csi,isFar,isMulti,isPosRP) )
+
+    #fiducial cut (evaluated at once for all the tracks)
+    passPxFid=[True]*len(tracks)
+    if applyPxFid:
+        toCheck=[i for i,(_,_,isFar,isMulti,_) in enumerate(tracks) if isMulti or isFar]
+        if len(toCheck)>0:
+            itks=[tracks[i][0] for i in toCheck]
+            mask=isPixelFiducialArrays(era,
+                                       [45 if tracks[i][4] else 56 for i in toCheck],
+                                       [tree.protonX[itk] for itk in itks],
+                                       [tree.protonTX[itk] for itk in itks],
+                                       [tree.protonY[itk] for itk in itks],
+                                       [tree.protonTY[itk] for itk in itks],
+                                       [tracks[i][1] for i in toCheck] if not useXY else None,
+                                       xangle)
+            for i,passFid in zip(toCheck,mask):
+                passPxFid[i]=passFid
+
+    for (itk,csi,isFar,isMulti,isPosRP),passFid in zip(tracks,passPxFid):
+        if not passFid : continue
 
         idx = (0 if isMulti else (1 if isFar else 2))
         if mcTruth: idx=0
@@ -191,11 +206,9 @@ def getDiProtonCategory(pos_protons,neg_protons,boson,allowPixMult):
     return proton_cat,csi_pos,csi_neg,pp,mmass
 
 
-def getRandomEra(isSignal,isPreTS2Signal):
+def getEraCumulativeFractions(isSignal,isPreTS2Signal):
 
-    """generates a random era according to the integrated luminosity in each one"""
-
-    r=random.random()
+    """returns the cumulative fractions of the integrated luminosity in each era"""
 
     cum_fracs=[('2017B',0.115),('2017C',0.348),('2017D',0.451),('2017E',0.671),('2017F',1)]
     if isSignal:
@@ -203,7 +216,15 @@ def getRandomEra(isSignal,isPreTS2Signal):
             cum_fracs=[('2017B',0.327),('2017C',0.991),('2017D',1)]
         else:
             cum_fracs=[('2017D',0.154),('2017E',0.493),('2017F',1)]
+    return cum_fracs
+
+def getRandomEra(isSignal,isPreTS2Signal):
+
+    """generates a random era according to the integrated luminosity in each one"""
 
+    r=random.random()
+
+    cum_fracs=getEraCumulativeFractions(isSignal,isPreTS2Signal)
     for era,cf in cum_fracs:
         if r>cf : continue
         return era
@@ -249,9 +270,9 @@ def isSignalFiducial(csiPos,csiNeg,gen_pzpp):
 
 
 
-def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEvents=-1,sighyp=0,mixDir=None):
+def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEvents=-1,sighyp=0,mixDir=None,columnar=False):
     
-    """event loop"""
+    """event loop (if columnar is set, data and background are processed with arrays in ColumnarExclusiveAnalysis)"""
 
     global MIXEDRPSIG
     global ALLOWPIXMULT
@@ -274,7 +295,9 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
     if mixDir:
  
         print 'Collecting events from the mixing bank'
-        mixFiles=[f for f in os.listdir(mixDir) if '.pck' in f]
+        #memory-mapped banks (directories) are preferred over the pickled lists of events
+        mixFiles=[f for f in os.listdir(mixDir) if f.startswith('mixbank_') and os.path.isdir(os.path.join(mixDir,f))]
+        mixFiles += [f for f in os.listdir(mixDir) if '.pck' in f and not f.replace('.pck','') in mixFiles]
         
         #open just the necessary for signal and data
         if isSignal or isData:
@@ -296,6 +319,9 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
         MIXEDRP=defaultdict(list)
         for f in mixFiles:
             print '\t',f
+            if os.path.isdir(os.path.join(mixDir,f)):
+                MIXEDRP.update( loadMixingBanks(os.path.join(mixDir,f)) )
+                continue
             with open(os.path.join(mixDir,f),'r') as cachefile:
                 rpData=pickle.load(cachefile)
                 for key in rpData:
@@ -422,6 +448,19 @@ def runExclusiveAnalysis(inFile,outFileName,runLumiList,effDir,ppsEffFile,maxEve
     tOut=ROOT.TTree('data','data')
     evSummary.attachToTree(tOut)
 
+    #columnar processing (signal and the preparation of the mixing bank always use the event loop)
+    if columnar and not isSignal and not evMixTool.isIdle():
+        from ColumnarExclusiveAnalysis import runColumnarEventLoop
+        print 'Using columnar processing'
+        runColumnarEventLoop(tree,nEntries,ht,tOut,evMixTool,
+                             isData=isData,era=era,isDY=isDY,runLumiList=runLumiList,
+                             allowPixMult=ALLOWPIXMULT,usePixelOnly=USESINGLERP,minCsi=MINCSI)
+        fOut.cd()
+        tOut.Write()
+        ht.writeToFile(fOut)
+        fOut.Close()
+        return
+
     #summary events for the mixing
     rpData={}
 
@@ -1107,10 +1146,10 @@ def runAnalysisTasks(opt):
                 for sighyp in range(16):
                     fOut=sigOut.replace('.root','_%d.root'%sighyp)
                     mergeList[sigOut].append(fOut)
-                    task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,sighyp,opt.mix) )
+                    task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,sighyp,opt.mix,opt.columnar) )
             else:
                 fOut='%s/Chunks/%s'%(opt.output,os.path.basename(f))
-                task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,0,opt.mix) )
+                task_list.append( (f,fOut,runLumiList,opt.effDir,opt.ppsEffFile,opt.maxEvents,0,opt.mix,opt.columnar) )
 
     pool.map(runExclusiveAnalysisPacked,task_list)
 
@@ -1178,6 +1217,11 @@ def main():
                       default=None,
                       type='string',
                       help='bank of events to use for the mixing')
+    parser.add_option('--columnar',
+                      dest='columnar',
+                      default=False,
+                      action='store_true',
+                      help='process data and background in chunks with numpy arrays instead of the event loop [default: %default]')
     parser.add_option('--mixSignal',
                       dest='mixSignal',
                       default=None,